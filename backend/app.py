@@ -4,6 +4,7 @@ from pathlib import Path
 from flask import Flask, send_from_directory
 from flask_cors import CORS
 from backend.config import Config
+from backend.utils.key_pool import provider_api_keys
 from backend.routes import register_routes
 
 
@@ -89,6 +90,7 @@ def create_app():
                     "health": "/api/health",
                     "outline": "POST /api/outline",
                     "generate": "POST /api/generate",
+                    "task_events": "GET /api/tasks/<task_id>/events",
                     "images": "GET /api/images/<filename>"
                 }
             }
@@ -116,10 +118,11 @@ def _validate_config_on_startup(logger):
             # 检查激活的服务商是否有 API Key
             if active in text_config.get('providers', {}):
                 provider = text_config['providers'][active]
-                if not provider.get('api_key'):
+                key_count = len(provider_api_keys(provider))
+                if not key_count:
                     logger.warning(f"⚠️  文本服务商 [{active}] 未配置 API Key")
                 else:
-                    logger.info(f"✅ 文本服务商 [{active}] API Key 已配置")
+                    logger.info(f"✅ 文本服务商 [{active}] API Key 已配置（{key_count} 个）")
         except Exception as e:
             logger.error(f"❌ 读取 text_providers.yaml 失败: {e}")
     else:
@@ -138,10 +141,11 @@ def _validate_config_on_startup(logger):
             # 检查激活的服务商是否有 API Key
             if active in image_config.get('providers', {}):
                 provider = image_config['providers'][active]
-                if not provider.get('api_key'):
+                key_count = len(provider_api_keys(provider))
+                if not key_count:
                     logger.warning(f"⚠️  图片服务商 [{active}] 未配置 API Key")
                 else:
-                    logger.info(f"✅ 图片服务商 [{active}] API Key 已配置")
+                    logger.info(f"✅ 图片服务商 [{active}] API Key 已配置（{key_count} 个）")
         except Exception as e:
             logger.error(f"❌ 读取 image_providers.yaml 失败: {e}")
     else:
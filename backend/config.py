@@ -1,10 +1,30 @@
+import copy
 import logging
+import os
+import threading
 import yaml
 from pathlib import Path
 
+from backend.utils.key_pool import provider_api_keys
+
 logger = logging.getLogger(__name__)
 
 
+class ConfigSnapshot:
+    """
+    一次加载得到的服务商配置（只读）
+
+    配置文件变化后会生成新的快照（版本号递增），已有快照的内容不再改变：
+    正在运行的任务继续使用开始时的快照，新任务使用最新快照。
+    """
+
+    def __init__(self, version: int, image: dict, text: dict, search: dict):
+        self.version = version
+        self.image = image
+        self.text = text
+        self.search = search
+
+
 class Config:
     DEBUG = True
     HOST = '0.0.0.0'
@@ -12,34 +32,52 @@ class Config:
     CORS_ORIGINS = ['http://localhost:5173', 'http://localhost:3000']
     OUTPUT_DIR = 'output'
 
-    _image_providers_config = None
-    _text_providers_config = None
-    _search_providers_config = None
+    CONFIG_DIR = Path(__file__).parent.parent
+
+    # 配置文件名 -> (日志名称, 默认配置)
+    _CONFIG_FILES = {
+        'image': ('image_providers.yaml', '图片', {'active_provider': 'google_genai', 'providers': {}}),
+        'text': ('text_providers.yaml', '文本', {'active_provider': 'google_gemini', 'providers': {}}),
+        'search': ('search_providers.yaml', '搜索', {'active_provider': 'duckduckgo', 'providers': {}}),
+    }
+
+    _snapshot = None
+    # 生成当前快照时各配置文件的 (修改时间, 大小)
+    _stamps = None
+    _version = 0
+    _lock = threading.Lock()
 
     @classmethod
-    def load_image_providers_config(cls):
-        if cls._image_providers_config is not None:
-            return cls._image_providers_config
+    def _file_stamps(cls) -> dict:
+        stamps = {}
+        for kind, (filename, _, _) in cls._CONFIG_FILES.items():
+            try:
+                stat = os.stat(cls.CONFIG_DIR / filename)
+                stamps[kind] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                stamps[kind] = None
+        return stamps
 
-        config_path = Path(__file__).parent.parent / 'image_providers.yaml'
-        logger.debug(f"加载图片服务商配置: {config_path}")
+    @classmethod
+    def _load_file(cls, kind: str) -> dict:
+        """解析一个配置文件，不存在时返回默认配置"""
+        filename, label, default = cls._CONFIG_FILES[kind]
+        config_path = cls.CONFIG_DIR / filename
+        logger.debug(f"加载{label}服务商配置: {config_path}")
 
         if not config_path.exists():
-            logger.warning(f"图片配置文件不存在: {config_path}，使用默认配置")
-            cls._image_providers_config = {
-                'active_provider': 'google_genai',
-                'providers': {}
-            }
-            return cls._image_providers_config
+            logger.warning(f"{label}配置文件不存在: {config_path}，使用默认配置")
+            return copy.deepcopy(default)
 
         try:
             with open(config_path, 'r', encoding='utf-8') as f:
-                cls._image_providers_config = yaml.safe_load(f) or {}
-            logger.debug(f"图片配置加载成功: {list(cls._image_providers_config.get('providers', {}).keys())}")
+                config = yaml.safe_load(f) or {}
+            logger.debug(f"{label}配置加载成功: {list(config.get('providers', {}).keys())}")
+            return config
         except yaml.YAMLError as e:
-            logger.error(f"图片配置文件 YAML 格式错误: {e}")
+            logger.error(f"{label}配置文件 YAML 格式错误: {e}")
             raise ValueError(
-                f"配置文件格式错误: image_providers.yaml\n"
+                f"配置文件格式错误: {filename}\n"
                 f"YAML 解析错误: {e}\n"
                 "解决方案：\n"
                 "1. 检查 YAML 缩进是否正确（使用空格，不要用Tab）\n"
@@ -47,89 +85,74 @@ class Config:
                 "3. 使用在线 YAML 验证器检查格式"
             )
 
-        return cls._image_providers_config
+    @classmethod
+    def current(cls) -> ConfigSnapshot:
+        """
+        获取最新的配置快照
+
+        每次调用只检查配置文件的修改时间，文件变化后才重新解析并生成新版本。
+        新文件格式错误时继续使用上一个可用的快照（首次加载时直接报错）。
+        """
+        stamps = cls._file_stamps()
+        snapshot = cls._snapshot
+        if snapshot is not None and stamps == cls._stamps:
+            return snapshot
+
+        with cls._lock:
+            if cls._snapshot is not None and stamps == cls._stamps:
+                return cls._snapshot
+            try:
+                loaded = {kind: cls._load_file(kind) for kind in cls._CONFIG_FILES}
+            except ValueError:
+                if cls._snapshot is None:
+                    raise
+                # 记下这次的修改时间，文件再次变化前不重复解析
+                cls._stamps = stamps
+                logger.error(f"❌ 配置文件有误，继续使用配置版本 {cls._snapshot.version}")
+                return cls._snapshot
+
+            cls._version += 1
+            cls._snapshot = ConfigSnapshot(cls._version, loaded['image'], loaded['text'], loaded['search'])
+            cls._stamps = stamps
+            if cls._version > 1:
+                logger.info(f"✅ 配置已更新到版本 {cls._version}（运行中的任务继续使用原配置）")
+            return cls._snapshot
+
+    @classmethod
+    def load_image_providers_config(cls):
+        return cls.current().image
 
     @classmethod
     def load_text_providers_config(cls):
         """加载文本生成服务商配置"""
-        if cls._text_providers_config is not None:
-            return cls._text_providers_config
-
-        config_path = Path(__file__).parent.parent / 'text_providers.yaml'
-        logger.debug(f"加载文本服务商配置: {config_path}")
-
-        if not config_path.exists():
-            logger.warning(f"文本配置文件不存在: {config_path}，使用默认配置")
-            cls._text_providers_config = {
-                'active_provider': 'google_gemini',
-                'providers': {}
-            }
-            return cls._text_providers_config
-
-        try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                cls._text_providers_config = yaml.safe_load(f) or {}
-            logger.debug(f"文本配置加载成功: {list(cls._text_providers_config.get('providers', {}).keys())}")
-        except yaml.YAMLError as e:
-            logger.error(f"文本配置文件 YAML 格式错误: {e}")
-            raise ValueError(
-                f"配置文件格式错误: text_providers.yaml\n"
-                f"YAML 解析错误: {e}\n"
-                "解决方案：\n"
-                "1. 检查 YAML 缩进是否正确（使用空格，不要用Tab）\n"
-                "2. 检查引号是否配对\n"
-                "3. 使用在线 YAML 验证器检查格式"
-            )
-
-        return cls._text_providers_config
+        return cls.current().text
 
     @classmethod
     def load_search_providers_config(cls):
         """加载搜索服务商配置"""
-        if cls._search_providers_config is not None:
-            return cls._search_providers_config
-
-        config_path = Path(__file__).parent.parent / 'search_providers.yaml'
-        logger.debug(f"加载搜索服务商配置: {config_path}")
-
-        if not config_path.exists():
-            logger.warning(f"搜索配置文件不存在: {config_path}，使用默认配置")
-            cls._search_providers_config = {
-                'active_provider': 'duckduckgo',
-                'providers': {}
-            }
-            return cls._search_providers_config
-
-        try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                cls._search_providers_config = yaml.safe_load(f) or {}
-            logger.debug(f"搜索配置加载成功: {list(cls._search_providers_config.get('providers', {}).keys())}")
-        except yaml.YAMLError as e:
-            logger.error(f"搜索配置文件 YAML 格式错误: {e}")
-            raise ValueError(
-                f"配置文件格式错误: search_providers.yaml\n"
-                f"YAML 解析错误: {e}\n"
-                "解决方案：\n"
-                "1. 检查 YAML 缩进是否正确（使用空格，不要用Tab）\n"
-                "2. 检查引号是否配对\n"
-                "3. 使用在线 YAML 验证器检查格式"
-            )
-
-        return cls._search_providers_config
+        return cls.current().search
 
     @classmethod
-    def get_active_image_provider(cls):
-        config = cls.load_image_providers_config()
+    def get_active_image_provider(cls, snapshot: ConfigSnapshot = None):
+        config = (snapshot or cls.current()).image
         active = config.get('active_provider', 'google_genai')
         logger.debug(f"当前激活的图片服务商: {active}")
         return active
 
     @classmethod
-    def get_image_provider_config(cls, provider_name: str = None):
-        config = cls.load_image_providers_config()
+    def get_image_provider_config(cls, provider_name: str = None, snapshot: ConfigSnapshot = None):
+        """
+        获取图片服务商配置（副本）
+
+        Args:
+            provider_name: 服务商名称，默认为 active_provider
+            snapshot: 配置快照，默认使用最新配置
+        """
+        snapshot = snapshot or cls.current()
+        config = snapshot.image
 
         if provider_name is None:
-            provider_name = cls.get_active_image_provider()
+            provider_name = cls.get_active_image_provider(snapshot)
 
         logger.info(f"获取图片服务商配置: {provider_name}")
 
@@ -155,16 +178,17 @@ class Config:
                 "3. 检查 image_providers.yaml 文件"
             )
 
-        provider_config = providers[provider_name].copy()
+        # 深拷贝，调用方修改配置不会影响快照
+        provider_config = copy.deepcopy(providers[provider_name])
 
         # 验证必要字段
-        if not provider_config.get('api_key'):
+        if not provider_api_keys(provider_config):
             logger.error(f"图片服务商 [{provider_name}] 未配置 API Key")
             raise ValueError(
                 f"服务商 {provider_name} 未配置 API Key\n"
                 "解决方案：\n"
                 "1. 在系统设置页面编辑该服务商，填写 API Key\n"
-                "2. 或手动在 image_providers.yaml 中添加 api_key 字段"
+                "2. 或手动在 image_providers.yaml 中添加 api_key 字段（多个 Key 可写成列表或使用 api_keys）"
             )
 
         provider_type = provider_config.get('type', provider_name)
@@ -180,10 +204,44 @@ class Config:
         logger.info(f"图片服务商配置验证通过: {provider_name} (type={provider_type})")
         return provider_config
 
+    @classmethod
+    def get_image_routing(cls, snapshot: ConfigSnapshot = None):
+        """
+        获取图片服务商路由配置
+
+        Args:
+            snapshot: 配置快照，默认使用最新配置
+
+        Returns:
+            服务商名称 -> 权重；未启用路由时返回空字典
+        """
+        config = (snapshot or cls.current()).image
+        routing = config.get('routing') or {}
+        if not routing.get('enabled', False):
+            return {}
+
+        providers = routing.get('providers') or {}
+        # 也支持只列出名称（权重均为 1）
+        if isinstance(providers, list):
+            providers = {name: 1 for name in providers}
+
+        available = config.get('providers', {})
+        weights = {}
+        for name, weight in providers.items():
+            if name not in available:
+                logger.warning(f"路由配置中的图片服务商 [{name}] 不存在，已忽略")
+                continue
+            try:
+                weight = float(weight)
+            except (TypeError, ValueError):
+                weight = 1.0
+            if weight > 0:
+                weights[name] = weight
+        return weights
+
     @classmethod
     def reload_config(cls):
-        """重新加载配置（清除缓存）"""
+        """重新加载配置（下次获取时重新解析配置文件，生成新版本）"""
         logger.info("重新加载所有配置...")
-        cls._image_providers_config = None
-        cls._text_providers_config = None
-        cls._search_providers_config = None
+        with cls._lock:
+            cls._stamps = None
@@ -1,17 +1,49 @@
 """Google GenAI 图片生成器"""
 import logging
-import time
-import random
 import base64
-from functools import wraps
 from typing import Dict, Any, Optional
 from google import genai
 from google.genai import types
 from .base import ImageGeneratorBase
-from ..utils.image_compressor import compress_image
+from ..utils.reference_payload import ReferenceImage, prepare_reference_images
+from ..utils.retry import ERROR_INVALID_REQUEST, ERROR_SAFETY, ProviderError, to_provider_error
 
 logger = logging.getLogger(__name__)
 
+# 表示内容被拦截的候选结束原因（其余如 STOP / MAX_TOKENS 不是拦截）
+BLOCKED_FINISH_REASONS = {
+    "SAFETY", "RECITATION", "BLOCKLIST", "PROHIBITED_CONTENT", "SPII",
+    "IMAGE_SAFETY", "IMAGE_PROHIBITED_CONTENT", "IMAGE_RECITATION",
+}
+
+
+def _reason_name(reason) -> Optional[str]:
+    """枚举值的名称（SDK 版本不同时可能是字符串）"""
+    if not reason:
+        return None
+    return getattr(reason, "name", None) or str(reason).rsplit(".", 1)[-1]
+
+
+def _block_reason(chunk) -> Optional[str]:
+    """
+    响应块中的拦截原因
+
+    Args:
+        chunk: generate_content_stream 返回的响应块
+
+    Returns:
+        拦截原因（提示词被拦截的 block_reason 或候选的 finish_reason），未拦截时返回 None
+    """
+    feedback = getattr(chunk, "prompt_feedback", None)
+    reason = _reason_name(getattr(feedback, "block_reason", None))
+    if reason and reason != "BLOCKED_REASON_UNSPECIFIED":
+        return reason
+    for candidate in getattr(chunk, "candidates", None) or []:
+        reason = _reason_name(getattr(candidate, "finish_reason", None))
+        if reason in BLOCKED_FINISH_REASONS:
+            return reason
+    return None
+
 
 def parse_genai_error(error: Exception) -> str:
     """
@@ -279,58 +311,6 @@ def parse_genai_error(error: Exception) -> str:
     )
 
 
-def retry_on_error(max_retries=5, base_delay=3):
-    """智能重试装饰器，根据错误类型决定是否重试"""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            last_error = None
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    last_error = e
-                    error_str = str(e).lower()
-
-                    # 不可重试的错误类型
-                    non_retryable = [
-                        "401", "unauthenticated",  # 认证错误
-                        "403", "permission_denied", "forbidden",  # 权限错误
-                        "404", "not_found",  # 资源不存在
-                        "invalid_argument",  # 参数错误
-                        "safety", "blocked", "filter",  # 安全过滤
-                    ]
-
-                    should_retry = True
-                    for keyword in non_retryable:
-                        if keyword in error_str:
-                            should_retry = False
-                            break
-
-                    if not should_retry:
-                        # 直接抛出，不重试
-                        raise Exception(parse_genai_error(e))
-
-                    # 可重试的错误
-                    if attempt < max_retries - 1:
-                        if "429" in error_str or "resource_exhausted" in error_str:
-                            wait_time = (base_delay ** attempt) + random.uniform(0, 1)
-                            logger.warning(f"⏳ 遇到速率限制，{wait_time:.1f}秒后重试 (尝试 {attempt + 2}/{max_retries})")
-                        else:
-                            wait_time = min(2 ** attempt, 10) + random.uniform(0, 1)
-                            logger.warning(f"⚠️ 请求失败，{wait_time:.1f}秒后重试 (尝试 {attempt + 2}/{max_retries})")
-                        time.sleep(wait_time)
-                        continue
-
-                    # 重试次数耗尽
-                    raise Exception(parse_genai_error(e))
-
-            # 理论上不会到这里，但保险起见
-            raise Exception(parse_genai_error(last_error))
-        return wrapper
-    return decorator
-
-
 class GoogleGenAIGenerator(ImageGeneratorBase):
     """Google GenAI 图片生成器"""
 
@@ -381,14 +361,13 @@ class GoogleGenAIGenerator(ImageGeneratorBase):
         """验证配置"""
         return bool(self.api_key)
 
-    @retry_on_error(max_retries=5, base_delay=3)
     def generate_image(
         self,
         prompt: str,
         aspect_ratio: str = "3:4",
         temperature: float = 1.0,
         model: str = "gemini-3-pro-image-preview",
-        reference_image: Optional[bytes] = None,
+        reference_image: Optional[ReferenceImage] = None,
         **kwargs
     ) -> bytes:
         """
@@ -399,7 +378,7 @@ class GoogleGenAIGenerator(ImageGeneratorBase):
             aspect_ratio: 宽高比 (如 "3:4", "1:1", "16:9")
             temperature: 温度
             model: 模型名称
-            reference_image: 参考图片二进制数据（用于保持风格一致）
+            reference_image: 参考图片（二进制数据或已准备好的载荷，用于保持风格一致）
             **kwargs: 其他参数
 
         Returns:
@@ -414,14 +393,14 @@ class GoogleGenAIGenerator(ImageGeneratorBase):
         # 如果有参考图，先添加参考图和说明
         if reference_image:
             logger.debug(f"  添加参考图片 ({len(reference_image)} bytes)")
-            # 压缩参考图到 200KB 以内
-            compressed_ref = compress_image(reference_image, max_size_kb=200)
-            logger.debug(f"  参考图压缩后: {len(compressed_ref)} bytes")
+            # 压缩参考图到 200KB 以内（任务内已准备好的载荷直接复用）
+            reference = prepare_reference_images([reference_image], max_size_kb=200)[0]
+            logger.debug(f"  参考图压缩后: {len(reference)} bytes")
             # 添加参考图
             parts.append(types.Part(
                 inline_data=types.Blob(
-                    mime_type="image/png",
-                    data=compressed_ref
+                    mime_type=reference.mime_type,
+                    data=reference.data
                 )
             ))
             # 添加带参考说明的提示词
@@ -465,35 +444,52 @@ class GoogleGenAIGenerator(ImageGeneratorBase):
         )
 
         image_data = None
+        block_reason = None
         logger.debug(f"  开始调用 API: model={model}")
-        for chunk in self.client.models.generate_content_stream(
-            model=model,
-            contents=contents,
-            config=generate_content_config,
-        ):
-            if chunk.candidates and chunk.candidates[0].content and chunk.candidates[0].content.parts:
-                for part in chunk.candidates[0].content.parts:
-                    # 检查是否有图片数据
-                    if hasattr(part, 'inline_data') and part.inline_data:
-                        image_data = part.inline_data.data
-                        logger.debug(f"  收到图片数据: {len(image_data)} bytes")
-                        break
+        try:
+            for chunk in self.client.models.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=generate_content_config,
+            ):
+                block_reason = block_reason or _block_reason(chunk)
+                if chunk.candidates and chunk.candidates[0].content and chunk.candidates[0].content.parts:
+                    for part in chunk.candidates[0].content.parts:
+                        # 检查是否有图片数据
+                        if hasattr(part, 'inline_data') and part.inline_data:
+                            image_data = part.inline_data.data
+                            logger.debug(f"  收到图片数据: {len(image_data)} bytes")
+                            break
+        except Exception as e:
+            # 保留错误分类（是否可重试由调用方的重试策略决定）
+            raise to_provider_error(e, parse_genai_error(e)) from e
+
+        if not image_data and block_reason:
+            logger.error(f"图片生成被拦截: {block_reason}")
+            raise ProviderError(
+                f"❌ 图片生成失败：内容被安全过滤拦截（{block_reason}）\n\n"
+                "【解决方案】\n"
+                "1. 修改提示词，避免敏感内容：\n"
+                "   - 避免涉及暴力、血腥、色情等内容\n"
+                "   - 避免涉及真实人物（明星、政治人物等）\n"
+                "   - 使用更中性、积极的描述\n"
+                "2. 尝试简化提示词",
+                kind=ERROR_SAFETY
+            )
 
         if not image_data:
+            # 服务商正常响应但没有返回图片：与服务商健康无关，不计入熔断、不切换服务商，可重试一次
             logger.error("API 返回为空，未生成图片")
-            raise ValueError(
+            raise ProviderError(
                 "❌ 图片生成失败：API 返回为空\n\n"
                 "【可能原因】\n"
-                "1. 提示词触发了安全过滤（最常见）\n"
-                "2. 模型不支持当前的图片生成请求\n"
-                "3. 网络传输过程中数据丢失\n\n"
+                "1. 模型只返回了文字，没有生成图片\n"
+                "2. 模型不支持当前的图片生成请求\n\n"
                 "【解决方案】\n"
-                "1. 修改提示词，避免敏感内容：\n"
-                "   - 避免涉及暴力、血腥、色情等内容\n"
-                "   - 避免涉及真实人物（明星、政治人物等）\n"
-                "   - 使用更中性、积极的描述\n"
-                "2. 尝试简化提示词\n"
-                "3. 检查网络连接后重试"
+                "1. 尝试简化提示词\n"
+                "2. 确认所选模型支持图片生成",
+                kind=ERROR_INVALID_REQUEST,
+                retryable=True
             )
 
         logger.info(f"✅ Google GenAI 图片生成成功: {len(image_data)} bytes")
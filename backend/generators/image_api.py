@@ -1,35 +1,16 @@
 """Image API 图片生成器"""
 import logging
-import time
-import random
 import base64
 import requests
 from typing import Dict, Any, Optional, List, Union
 from .base import ImageGeneratorBase
-from ..utils.image_compressor import compress_image
+from ..utils.reference_payload import ReferenceImage, prepare_reference_images
+from ..utils.http_client import get_http_client, http_timeout, pool_size_for
+from ..utils.retry import http_error
 
 logger = logging.getLogger(__name__)
 
 
-def retry_on_error(max_retries: int = 3, base_delay: float = 2):
-    """错误重试装饰器"""
-    def decorator(func):
-        def wrapper(*args, **kwargs):
-            last_error = None
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    last_error = e
-                    if attempt < max_retries - 1:
-                        delay = base_delay * (2 ** attempt) + random.uniform(0, 1)
-                        logger.warning(f"请求失败，{delay:.1f}秒后重试 (尝试 {attempt + 2}/{max_retries}): {str(e)[:100]}")
-                        time.sleep(delay)
-            raise last_error
-        return wrapper
-    return decorator
-
-
 class ImageApiGenerator(ImageGeneratorBase):
     """Image API 生成器"""
 
@@ -53,6 +34,10 @@ class ImageApiGenerator(ImageGeneratorBase):
             endpoint_type = '/' + endpoint_type
         self.endpoint_type = endpoint_type
 
+        # 共享连接池（长连接，连接池大小按并发上限设置）
+        self.http = get_http_client()
+        self.http.ensure_pool(self.base_url, pool_size_for(config))
+
         logger.info(f"ImageApiGenerator 初始化完成: base_url={self.base_url}, model={self.model}, endpoint={self.endpoint_type}")
 
     def validate_config(self) -> bool:
@@ -73,15 +58,14 @@ class ImageApiGenerator(ImageGeneratorBase):
         """获取支持的宽高比"""
         return ["1:1", "2:3", "3:2", "3:4", "4:3", "4:5", "5:4", "9:16", "16:9", "21:9"]
 
-    @retry_on_error(max_retries=3, base_delay=2)
     def generate_image(
         self,
         prompt: str,
         aspect_ratio: str = None,
         temperature: float = 1.0,
         model: str = None,
-        reference_image: Optional[bytes] = None,
-        reference_images: Optional[List[bytes]] = None,
+        reference_image: Optional[ReferenceImage] = None,
+        reference_images: Optional[List[ReferenceImage]] = None,
         **kwargs
     ) -> bytes:
         """
@@ -119,8 +103,8 @@ class ImageApiGenerator(ImageGeneratorBase):
         prompt: str,
         aspect_ratio: str,
         model: str,
-        reference_image: Optional[bytes] = None,
-        reference_images: Optional[List[bytes]] = None
+        reference_image: Optional[ReferenceImage] = None,
+        reference_images: Optional[List[ReferenceImage]] = None
     ) -> bytes:
         """通过 /v1/images/generations 端点生成图片"""
         headers = {
@@ -146,15 +130,12 @@ class ImageApiGenerator(ImageGeneratorBase):
         # 如果有参考图片，添加到 image 数组
         if all_reference_images:
             logger.debug(f"  添加 {len(all_reference_images)} 张参考图片")
-            image_uris = []
-            for idx, img_data in enumerate(all_reference_images):
-                compressed_img = compress_image(img_data, max_size_kb=200)
-                logger.debug(f"  参考图 {idx}: {len(img_data)} -> {len(compressed_img)} bytes")
-                base64_image = base64.b64encode(compressed_img).decode('utf-8')
-                data_uri = f"data:image/png;base64,{base64_image}"
-                image_uris.append(data_uri)
+            # 参考图压缩到 200KB 以内（任务内已准备好的载荷直接复用，不再重复压缩和编码）
+            references = prepare_reference_images(all_reference_images, max_size_kb=200)
+            for idx, reference in enumerate(references):
+                logger.debug(f"  参考图 {idx}: {len(reference)} bytes")
 
-            payload["image"] = image_uris
+            payload["image"] = [reference.data_uri for reference in references]
 
             ref_count = len(all_reference_images)
             enhanced_prompt = f"""参考提供的 {ref_count} 张图片的风格（色彩、光影、构图、氛围），生成一张新图片。
@@ -170,12 +151,13 @@ class ImageApiGenerator(ImageGeneratorBase):
 
         api_url = f"{self.base_url}{self.endpoint_type}"
         logger.debug(f"  发送请求到: {api_url}")
-        response = requests.post(api_url, headers=headers, json=payload, timeout=300)
+        response = self.http.post(api_url, headers=headers, json=payload, timeout=http_timeout(self.config, 300))
 
         if response.status_code != 200:
             error_detail = response.text[:500]
             logger.error(f"Image API 请求失败: status={response.status_code}, error={error_detail}")
-            raise Exception(
+            raise http_error(
+                response,
                 f"Image API 请求失败 (状态码: {response.status_code})\n"
                 f"错误详情: {error_detail}\n"
                 f"请求地址: {api_url}\n"
@@ -219,8 +201,8 @@ class ImageApiGenerator(ImageGeneratorBase):
         prompt: str,
         aspect_ratio: str,
         model: str,
-        reference_image: Optional[bytes] = None,
-        reference_images: Optional[List[bytes]] = None
+        reference_image: Optional[ReferenceImage] = None,
+        reference_images: Optional[List[ReferenceImage]] = None
     ) -> bytes:
         """通过 /v1/chat/completions 端点生成图片（如即梦 API）"""
         import re
@@ -245,13 +227,13 @@ class ImageApiGenerator(ImageGeneratorBase):
             logger.debug(f"  添加 {len(all_reference_images)} 张参考图片到 chat 消息")
             content_parts = [{"type": "text", "text": prompt}]
 
-            for idx, img_data in enumerate(all_reference_images):
-                compressed_img = compress_image(img_data, max_size_kb=200)
-                logger.debug(f"  参考图 {idx}: {len(img_data)} -> {len(compressed_img)} bytes")
-                base64_image = base64.b64encode(compressed_img).decode('utf-8')
+            # 参考图压缩到 200KB 以内（任务内已准备好的载荷直接复用，不再重复压缩和编码）
+            references = prepare_reference_images(all_reference_images, max_size_kb=200)
+            for idx, reference in enumerate(references):
+                logger.debug(f"  参考图 {idx}: {len(reference)} bytes")
                 content_parts.append({
                     "type": "image_url",
-                    "image_url": {"url": f"data:image/png;base64,{base64_image}"}
+                    "image_url": {"url": reference.data_uri}
                 })
 
             user_content = content_parts
@@ -266,14 +248,15 @@ class ImageApiGenerator(ImageGeneratorBase):
         api_url = f"{self.base_url}{self.endpoint_type}"
         logger.info(f"Chat API 生成图片: {api_url}, model={model}")
 
-        response = requests.post(api_url, headers=headers, json=payload, timeout=300)
+        response = self.http.post(api_url, headers=headers, json=payload, timeout=http_timeout(self.config, 300))
 
         if response.status_code != 200:
             error_detail = response.text[:500]
             status_code = response.status_code
 
             if status_code == 401:
-                raise Exception(
+                raise http_error(
+                    response,
                     "❌ API Key 认证失败\n\n"
                     "【可能原因】\n"
                     "1. API Key 无效或已过期\n"
@@ -282,14 +265,16 @@ class ImageApiGenerator(ImageGeneratorBase):
                     "在系统设置页面检查 API Key 是否正确"
                 )
             elif status_code == 429:
-                raise Exception(
+                raise http_error(
+                    response,
                     "⏳ API 配额或速率限制\n\n"
                     "【解决方案】\n"
                     "1. 稍后再试\n"
                     "2. 检查 API 配额使用情况"
                 )
             else:
-                raise Exception(
+                raise http_error(
+                    response,
                     f"❌ Chat API 请求失败 (状态码: {status_code})\n\n"
                     f"【错误详情】\n{error_detail[:300]}\n\n"
                     f"【请求地址】{api_url}\n"
@@ -348,7 +333,7 @@ class ImageApiGenerator(ImageGeneratorBase):
         """下载图片并返回二进制数据"""
         logger.info(f"下载图片: {url[:100]}...")
         try:
-            response = requests.get(url, timeout=60)
+            response = self.http.get(url, timeout=http_timeout(self.config, 60))
             if response.status_code == 200:
                 logger.info(f"✅ 图片下载成功: {len(response.content)} bytes")
                 return response.content
@@ -1,53 +1,15 @@
 """OpenAI 兼容接口图片生成器"""
 import logging
-import time
-import random
 import base64
-from functools import wraps
 from typing import Dict, Any
 import requests
 from .base import ImageGeneratorBase
+from ..utils.http_client import get_http_client, http_timeout, pool_size_for
+from ..utils.retry import http_error
 
 logger = logging.getLogger(__name__)
 
 
-def retry_on_error(max_retries=5, base_delay=3):
-    """错误自动重试装饰器"""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    error_str = str(e)
-                    # 检查是否是速率限制错误
-                    if "429" in error_str or "rate" in error_str.lower():
-                        if attempt < max_retries - 1:
-                            wait_time = (base_delay ** attempt) + random.uniform(0, 1)
-                            logger.warning(f"遇到速率限制，{wait_time:.1f}秒后重试 (尝试 {attempt + 2}/{max_retries})")
-                            time.sleep(wait_time)
-                            continue
-                    # 其他错误或重试耗尽
-                    if attempt < max_retries - 1:
-                        wait_time = 2 ** attempt
-                        logger.warning(f"请求失败: {error_str[:100]}，{wait_time}秒后重试")
-                        time.sleep(wait_time)
-                        continue
-                    raise
-            logger.error(f"图片生成失败: 重试 {max_retries} 次后仍失败")
-            raise Exception(
-                f"图片生成失败：重试 {max_retries} 次后仍失败。\n"
-                "可能原因：\n"
-                "1. API持续限流或配额不足\n"
-                "2. 网络连接持续不稳定\n"
-                "3. API服务暂时不可用\n"
-                "建议：稍后再试，或检查API配额和网络状态"
-            )
-        return wrapper
-    return decorator
-
-
 class OpenAICompatibleGenerator(ImageGeneratorBase):
     """OpenAI 兼容接口图片生成器"""
 
@@ -84,13 +46,16 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
             endpoint_type = '/v1/chat/completions'
         self.endpoint_type = endpoint_type
 
+        # 共享连接池（长连接，连接池大小按并发上限设置）
+        self.http = get_http_client()
+        self.http.ensure_pool(self.base_url, pool_size_for(config))
+
         logger.info(f"OpenAICompatibleGenerator 初始化完成: base_url={self.base_url}, model={self.default_model}, endpoint={self.endpoint_type}")
 
     def validate_config(self) -> bool:
         """验证配置"""
         return bool(self.api_key and self.base_url)
 
-    @retry_on_error(max_retries=5, base_delay=3)
     def generate_image(
         self,
         prompt: str,
@@ -154,12 +119,13 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
         if quality and model.startswith('dall-e'):
             payload["quality"] = quality
 
-        response = requests.post(url, headers=headers, json=payload, timeout=180)
+        response = self.http.post(url, headers=headers, json=payload, timeout=http_timeout(self.config, 180))
 
         if response.status_code != 200:
             error_detail = response.text[:500]
             logger.error(f"OpenAI Images API 请求失败: status={response.status_code}, error={error_detail}")
-            raise Exception(
+            raise http_error(
+                response,
                 f"OpenAI Images API 请求失败 (状态码: {response.status_code})\n"
                 f"错误详情: {error_detail}\n"
                 f"请求地址: {url}\n"
@@ -199,7 +165,7 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
         # 处理URL格式
         elif "url" in image_data:
             logger.debug(f"  下载图片 URL...")
-            img_response = requests.get(image_data["url"], timeout=60)
+            img_response = self.http.get(image_data["url"], timeout=http_timeout(self.config, 60))
             if img_response.status_code == 200:
                 logger.info(f"✅ OpenAI Images API 图片生成成功: {len(img_response.content)} bytes")
                 return img_response.content
@@ -254,7 +220,7 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
             "temperature": 1.0
         }
 
-        response = requests.post(url, headers=headers, json=payload, timeout=180)
+        response = self.http.post(url, headers=headers, json=payload, timeout=http_timeout(self.config, 180))
 
         if response.status_code != 200:
             error_detail = response.text[:500]
@@ -262,7 +228,8 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
 
             # 详细的错误信息
             if status_code == 401:
-                raise Exception(
+                raise http_error(
+                    response,
                     "❌ API Key 认证失败\n\n"
                     "【可能原因】\n"
                     "1. API Key 无效或已过期\n"
@@ -271,14 +238,16 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
                     "在系统设置页面检查 API Key 是否正确"
                 )
             elif status_code == 429:
-                raise Exception(
+                raise http_error(
+                    response,
                     "⏳ API 配额或速率限制\n\n"
                     "【解决方案】\n"
                     "1. 稍后再试\n"
                     "2. 检查 API 配额使用情况"
                 )
             else:
-                raise Exception(
+                raise http_error(
+                    response,
                     f"❌ Chat API 请求失败 (状态码: {status_code})\n\n"
                     f"【错误详情】\n{error_detail[:300]}\n\n"
                     f"【请求地址】{url}\n"
@@ -342,7 +311,7 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
         """下载图片并返回二进制数据"""
         logger.info(f"下载图片: {url[:100]}...")
         try:
-            response = requests.get(url, timeout=60)
+            response = self.http.get(url, timeout=http_timeout(self.config, 60))
             if response.status_code == 200:
                 logger.info(f"✅ 图片下载成功: {len(response.content)} bytes")
                 return response.content
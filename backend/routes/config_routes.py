@@ -11,6 +11,7 @@ import logging
 from pathlib import Path
 import yaml
 from flask import Blueprint, request, jsonify
+from backend.utils.key_pool import provider_api_keys
 from .utils import prepare_providers_for_response
 
 logger = logging.getLogger(__name__)
@@ -201,9 +202,10 @@ def _read_config(path: Path, default: dict) -> dict:
 
 
 def _write_config(path: Path, config: dict):
-    """写入配置文件"""
-    with open(path, 'w', encoding='utf-8') as f:
-        yaml.dump(config, f, allow_unicode=True, default_flow_style=False)
+    """写入配置文件（原子替换，监视配置文件的一方不会读到写了一半的文件）"""
+    from backend.utils.fs import write_file_atomic
+    content = yaml.dump(config, allow_unicode=True, default_flow_style=False)
+    write_file_atomic(str(path), content.encode('utf-8'), durable=True)
 
 
 def _update_provider_config(config_path: Path, new_data: dict):
@@ -227,12 +229,13 @@ def _update_provider_config(config_path: Path, new_data: dict):
         new_providers = new_data['providers']
 
         for name, new_provider_config in new_providers.items():
-            # 如果新配置的 api_key 是空的，保留原有的
-            if new_provider_config.get('api_key') in [True, False, '', None]:
-                if name in existing_providers and existing_providers[name].get('api_key'):
-                    new_provider_config['api_key'] = existing_providers[name]['api_key']
-                else:
-                    new_provider_config.pop('api_key', None)
+            # 如果新配置的 api_key / api_keys 是空的，保留原有的（前端不回传 Key 的实际值）
+            for field in ('api_key', 'api_keys'):
+                if new_provider_config.get(field) in [True, False, '', None, []]:
+                    if name in existing_providers and existing_providers[name].get(field):
+                        new_provider_config[field] = existing_providers[name][field]
+                    else:
+                        new_provider_config.pop(field, None)
 
             # 移除不需要保存的字段
             new_provider_config.pop('api_key_env', None)
@@ -245,18 +248,22 @@ def _update_provider_config(config_path: Path, new_data: dict):
 
 
 def _clear_config_cache():
-    """清除配置缓存"""
+    """
+    让新配置立即生效
+
+    生成新的配置版本：新任务使用新配置，正在运行的任务继续使用原来的服务实例和配置，
+    任务状态存储不受影响，重试可以接回原任务
+    """
     try:
         from backend.config import Config
-        Config._image_providers_config = None
-        Config._text_providers_config = None
-        Config._search_providers_config = None
+        Config.reload_config()
     except Exception:
         pass
 
+    # 文本服务按配置指纹缓存，配置变化会自动重建；保存后直接清空，避免同一时刻多次写入时修改时间不变
     try:
-        from backend.services.image import reset_image_service
-        reset_image_service()
+        from backend.utils.service_registry import get_service_registry
+        get_service_registry().invalidate()
     except Exception:
         pass
 
@@ -286,7 +293,9 @@ def _load_provider_config(provider_type: str, provider_name: str, config: dict)
 
             if provider_name in providers:
                 saved = providers[provider_name]
-                config['api_key'] = saved.get('api_key')
+                # 配置了多个 Key 时用第一个测试
+                keys = provider_api_keys(saved)
+                config['api_key'] = keys[0] if keys else None
 
                 if not config['base_url']:
                     config['base_url'] = saved.get('base_url')
@@ -11,11 +11,15 @@
 
 import os
 import json
+import uuid
 import base64
 import logging
 from flask import Blueprint, request, jsonify, Response, send_file
 from backend.services.image import get_image_service
-from .utils import log_request, log_error
+from backend.services.task_manager import get_task_manager
+from backend.services.thumbnail import get_thumbnail_service, THUMBNAIL_PREFIX
+from .task_routes import sse_task_stream
+from .utils import log_request, log_error, SSE_HEADERS
 
 logger = logging.getLogger(__name__)
 
@@ -29,28 +33,34 @@ def create_image_blueprint():
     @image_bp.route('/generate', methods=['POST'])
     def generate_images():
         """
-        批量生成图片（SSE 流式返回）
+        批量生成图片（后台任务）
+
+        生成任务提交到后台线程池执行，与本次 HTTP 连接解耦：连接断开后任务继续执行，
+        可通过 GET /api/tasks/<task_id>/events 回放并继续订阅事件。
 
         请求体：
         - pages: 页面列表（必填）
-        - task_id: 任务 ID
+        - task_id: 任务 ID（可选，不传则自动生成；传入已有任务时，生成输入未变化的页面直接复用）
         - full_outline: 完整大纲文本
         - user_topic: 用户原始输入主题
         - user_images: base64 编码的用户参考图片列表
+        - async: 为 true 时立即返回 task_id，不在本连接上推送事件（默认 false）
 
         返回：
-        SSE 事件流，包含以下事件类型：
-        - image: 单张图片生成完成
-        - error: 生成错误
-        - complete: 全部完成
+        - async=true: {success, task_id, events_url}（202）
+        - 否则：SSE 事件流（与 /tasks/<task_id>/events 相同），包含以下事件类型：
+          - progress: 生成进度
+          - complete: 单张图片生成完成（复用的页面带 reused: true）
+          - error: 生成错误
+          - finish: 全部完成（reused 为复用的页码）
         """
         try:
             data = request.get_json()
             pages = data.get('pages')
-            task_id = data.get('task_id')
+            task_id = data.get('task_id') or f"task_{uuid.uuid4().hex[:8]}"
             full_outline = data.get('full_outline', '')
             user_topic = data.get('user_topic', '')
-            logger.info("图片生成请求：", data)  # 打印图片生成请求数据
+            run_async = bool(data.get('async', False))
             # 解析 base64 格式的用户参考图片
             user_images = _parse_base64_images(data.get('user_images', []))
 
@@ -58,7 +68,8 @@ def create_image_blueprint():
                 'pages_count': len(pages) if pages else 0,
                 'task_id': task_id,
                 'user_topic': user_topic[:50] if user_topic else None,
-                'user_images': user_images
+                'user_images': user_images,
+                'async': run_async
             })
 
             if not pages:
@@ -71,27 +82,32 @@ def create_image_blueprint():
             logger.info(f"🖼️  开始图片生成任务: {task_id}, 共 {len(pages)} 页")
             image_service = get_image_service()
 
-            def generate():
-                """SSE 事件生成器"""
-                for event in image_service.generate_images(
+            def run():
+                return image_service.generate_images(
                     pages, task_id, full_outline,
                     user_images=user_images if user_images else None,
                     user_topic=user_topic
-                ):
-                    event_type = event["event"]
-                    event_data = event["data"]
+                )
 
-                    # 格式化为 SSE 格式
-                    yield f"event: {event_type}\n"
-                    yield f"data: {json.dumps(event_data, ensure_ascii=False)}\n\n"
+            try:
+                job = get_task_manager().submit(task_id, 'generate', run)
+            except RuntimeError as e:
+                return jsonify({
+                    "success": False,
+                    "error": f"{str(e)}\n请等待当前任务完成，或订阅 /api/tasks/{task_id}/events 查看进度。"
+                }), 409
+
+            if run_async:
+                return jsonify({
+                    "success": True,
+                    "task_id": task_id,
+                    "events_url": f"/api/tasks/{task_id}/events"
+                }), 202
 
             return Response(
-                generate(),
+                sse_task_stream(task_id, job.first_event_id - 1),
                 mimetype='text/event-stream',
-                headers={
-                    'Cache-Control': 'no-cache',
-                    'X-Accel-Buffering': 'no',
-                }
+                headers=SSE_HEADERS
             )
 
         except Exception as e:
@@ -132,17 +148,16 @@ def create_image_blueprint():
                 "history"
             )
 
-            if thumbnail:
-                # 尝试返回缩略图
-                thumb_filename = f"thumb_{filename}"
-                thumb_filepath = os.path.join(history_root, task_id, thumb_filename)
+            filepath = os.path.join(history_root, task_id, filename)
+
+            if thumbnail and not filename.startswith(THUMBNAIL_PREFIX):
+                # 返回缩略图（后台尚未生成时当场生成并缓存到磁盘）
+                thumb_filepath = get_thumbnail_service().ensure_thumbnail(filepath)
 
-                if os.path.exists(thumb_filepath):
+                if thumb_filepath:
                     return send_file(thumb_filepath, mimetype='image/png')
 
             # 返回原图
-            filepath = os.path.join(history_root, task_id, filename)
-
             if not os.path.exists(filepath):
                 return jsonify({
                     "success": False,
@@ -357,15 +372,9 @@ def create_image_blueprint():
                 }), 404
 
             # 不返回封面图片数据（太大）
-            safe_state = {
-                "generated": state.get("generated", {}),
-                "failed": state.get("failed", {}),
-                "has_cover": state.get("cover_image") is not None
-            }
-
             return jsonify({
                 "success": True,
-                "state": safe_state
+                "state": state.public_state()
             }), 200
 
         except Exception as e:
@@ -0,0 +1,273 @@
+"""
+运行状态监控相关 API 路由
+
+包含功能：
+- 获取服务商并发控制状态
+- 获取任务状态存储情况
+- 获取图片生成缓存统计
+- 获取图片处理引擎状态
+- 获取服务商熔断器状态
+- 获取图片服务商路由状态
+- 获取 API Key 池使用情况
+- 获取 HTTP 连接池状态
+- 获取图片提示词大小统计
+"""
+
+import logging
+from flask import Blueprint, jsonify
+from .utils import log_error
+
+logger = logging.getLogger(__name__)
+
+
+def create_metrics_blueprint():
+    """创建监控路由蓝图（工厂函数，支持多次调用）"""
+    metrics_bp = Blueprint('metrics', __name__)
+
+    @metrics_bp.route('/metrics/concurrency', methods=['GET'])
+    def get_concurrency():
+        """
+        获取图片服务商的自适应并发状态（进程内全局，所有任务共享）
+
+        返回：
+        - success: 是否成功
+        - providers: 各服务商的并发状态
+          - limit: 当前并发上限
+          - in_flight: 正在执行的请求数
+          - queued: 排队等待并发额度的请求数
+          - min_limit / max_limit: 并发上下限
+          - latency_baseline_ms: 延迟基线
+          - rate_limited: 触发限流次数
+        - latency: 各服务商最近成功请求的耗时分位数（对冲请求的触发依据）
+        """
+        try:
+            from backend.utils.concurrency import get_all_limiter_states
+            from backend.utils.hedging import get_all_latency_stats
+            return jsonify({
+                "success": True,
+                "providers": get_all_limiter_states(),
+                "latency": get_all_latency_stats()
+            }), 200
+
+        except Exception as e:
+            log_error('/metrics/concurrency', e)
+            return jsonify({
+                "success": False,
+                "error": f"获取并发状态失败。\n错误详情: {str(e)}"
+            }), 500
+
+    @metrics_bp.route('/metrics/task-states', methods=['GET'])
+    def get_task_states():
+        """
+        获取任务状态存储情况（用于重试的任务上下文）
+
+        返回：
+        - success: 是否成功
+        - store: 存储状态
+          - entries / bytes: 内存中的任务数和估算大小
+          - pinned: 正在生成（不可移出）的任务数
+          - hits / loads / misses: 内存命中、从磁盘加载、不存在的次数
+          - spills: 移出内存并落盘的次数
+        """
+        try:
+            from backend.services.task_store import get_task_state_store
+            return jsonify({
+                "success": True,
+                "store": get_task_state_store().stats()
+            }), 200
+
+        except Exception as e:
+            log_error('/metrics/task-states', e)
+            return jsonify({
+                "success": False,
+                "error": f"获取任务状态存储情况失败。\n错误详情: {str(e)}"
+            }), 500
+
+    @metrics_bp.route('/metrics/image-cache', methods=['GET'])
+    def get_image_cache_metrics():
+        """
+        获取图片生成缓存统计
+
+        返回：
+        - success: 是否成功
+        - enabled: 是否已启用（有服务商配置了 cache: true）
+        - cache: 缓存统计（entries、bytes、hits、misses、hit_rate、evictions）
+        """
+        try:
+            from backend.utils.image_cache import get_image_cache_stats
+            stats = get_image_cache_stats()
+            return jsonify({
+                "success": True,
+                "enabled": stats is not None,
+                "cache": stats
+            }), 200
+
+        except Exception as e:
+            log_error('/metrics/image-cache', e)
+            return jsonify({
+                "success": False,
+                "error": f"获取图片缓存统计失败。\n错误详情: {str(e)}"
+            }), 500
+
+    @metrics_bp.route('/metrics/image-processing', methods=['GET'])
+    def get_image_processing_metrics():
+        """
+        获取图片处理引擎状态（进程池）
+
+        返回：
+        - success: 是否成功
+        - processor: 引擎状态
+          - mode: process_pool / inline
+          - workers / pending / max_pending: 工作进程数、未完成任务数、排队上限
+          - operations: 按操作统计的次数、平均/最大执行耗时、平均排队耗时
+        """
+        try:
+            from backend.utils.image_processor import get_image_processor
+            return jsonify({
+                "success": True,
+                "processor": get_image_processor().stats()
+            }), 200
+
+        except Exception as e:
+            log_error('/metrics/image-processing', e)
+            return jsonify({
+                "success": False,
+                "error": f"获取图片处理引擎状态失败。\n错误详情: {str(e)}"
+            }), 500
+
+    @metrics_bp.route('/metrics/breakers', methods=['GET'])
+    def get_breakers():
+        """
+        获取服务商熔断器状态（进程内全局，图片和文本服务商分别统计）
+
+        返回：
+        - success: 是否成功
+        - breakers: 各熔断器状态，键为 image:<服务商> / text:<服务商>
+          - state: closed / open / half_open
+          - retry_in: 距离开始探测恢复的秒数
+          - window / failures: 统计窗口内的调用数和失败数
+          - opened_count / rejected: 熔断次数、熔断期间拒绝的调用数
+          - last_error: 最近一次计入统计的错误
+        """
+        try:
+            from backend.utils.circuit_breaker import get_all_breaker_stats
+            return jsonify({
+                "success": True,
+                "breakers": get_all_breaker_stats()
+            }), 200
+
+        except Exception as e:
+            log_error('/metrics/breakers', e)
+            return jsonify({
+                "success": False,
+                "error": f"获取熔断器状态失败。\n错误详情: {str(e)}"
+            }), 500
+
+    @metrics_bp.route('/metrics/routing', methods=['GET'])
+    def get_routing():
+        """
+        获取图片服务商路由状态
+
+        返回：
+        - success: 是否成功
+        - enabled: 是否启用了多服务商路由（image_providers.yaml 的 routing 配置）
+        - routing: 路由状态
+          - primary: 主服务商（active_provider）
+          - providers: 各服务商的权重、生成页数、切走次数、熔断状态和耗时中位数
+        """
+        try:
+            from backend.services.provider_router import get_router_stats
+            stats = get_router_stats()
+            return jsonify({
+                "success": True,
+                "enabled": stats is not None,
+                "routing": stats
+            }), 200
+
+        except Exception as e:
+            log_error('/metrics/routing', e)
+            return jsonify({
+                "success": False,
+                "error": f"获取路由状态失败。\n错误详情: {str(e)}"
+            }), 500
+
+    @metrics_bp.route('/metrics/keys', methods=['GET'])
+    def get_key_pools():
+        """
+        获取各服务商 API Key 池的使用情况（Key 已脱敏）
+
+        返回：
+        - success: 是否成功
+        - pools: 各 Key 池（image:服务商名 / text:服务商名）
+          - requests_per_minute: 单个 Key 的 RPM 上限（未配置为 null）
+          - keys: 各 Key 的状态（active / cooldown / disabled）、冷却剩余秒数、进行中请求数、
+            总请求数、最近一分钟请求数、成功/失败/限流次数、停用原因
+        """
+        try:
+            from backend.utils.key_pool import get_all_key_pool_stats
+            return jsonify({
+                "success": True,
+                "pools": get_all_key_pool_stats()
+            }), 200
+
+        except Exception as e:
+            log_error('/metrics/keys', e)
+            return jsonify({
+                "success": False,
+                "error": f"获取 API Key 使用情况失败。\n错误详情: {str(e)}"
+            }), 500
+
+    @metrics_bp.route('/metrics/http', methods=['GET'])
+    def get_http_pools():
+        """
+        获取共享 HTTP 客户端的连接池状态（按主机）
+
+        返回：
+        - success: 是否成功
+        - pools: 各主机的连接池
+          - maxsize: 连接池大小
+          - in_use / idle: 使用中、空闲（可复用）的连接数
+          - created: 累计建立的连接数（远小于 requests 说明长连接在复用）
+          - requests: 累计请求数
+        """
+        try:
+            from backend.utils.http_client import get_http_client
+            return jsonify({
+                "success": True,
+                "pools": get_http_client().stats()
+            }), 200
+
+        except Exception as e:
+            log_error('/metrics/http', e)
+            return jsonify({
+                "success": False,
+                "error": f"获取 HTTP 连接池状态失败。\n错误详情: {str(e)}"
+            }), 500
+
+    @metrics_bp.route('/metrics/prompts', methods=['GET'])
+    def get_prompt_metrics():
+        """
+        获取图片提示词大小统计（按提示词模式，进程内累计；单个任务每页的大小见任务状态的 prompt_sizes）
+
+        返回：
+        - success: 是否成功
+        - modes: 各提示词模式（full / compact / short）
+          - pages: 构建的提示词数
+          - chars / tokens: 累计字符数、估算 token 数
+          - avg_chars / avg_tokens: 每页平均值
+        """
+        try:
+            from backend.services.prompt_builder import get_prompt_stats
+            return jsonify({
+                "success": True,
+                "modes": get_prompt_stats().stats()
+            }), 200
+
+        except Exception as e:
+            log_error('/metrics/prompts', e)
+            return jsonify({
+                "success": False,
+                "error": f"获取提示词统计失败。\n错误详情: {str(e)}"
+            }), 500
+
+    return metrics_bp
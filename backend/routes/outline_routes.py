@@ -8,11 +8,10 @@
 
 import time
 import base64
-import json
 import logging
 from flask import Blueprint, request, jsonify, Response
 from backend.services.outline import get_outline_service
-from .utils import log_request, log_error
+from .utils import log_request, log_error, stream_text_events, requested_stream_protocol, SSE_HEADERS
 
 logger = logging.getLogger(__name__)
 
@@ -61,24 +60,12 @@ def create_outline_blueprint():
             logger.info(f"🔄 开始流式生成大纲，主题: {topic[:50]}...")
             outline_service = get_outline_service()
 
-            def generate():
-                """SSE 事件生成器"""
-                for event in outline_service.generate_outline_stream(topic, images, use_search):
-                    event_type = event["event"]
-                    event_data = event["data"]
-
-                    # 格式化为 SSE 格式
-                    yield f"event: {event_type}\n"
-                    yield f"data: {json.dumps(event_data, ensure_ascii=False)}\n\n"
-
-            # 返回 SSE 流
+            # 返回 SSE 流（protocol=2 时只发送增量文本，见 stream_text_events）
+            events = outline_service.generate_outline_stream(topic, images, use_search)
             return Response(
-                generate(),
+                stream_text_events(events, requested_stream_protocol()),
                 mimetype='text/event-stream',
-                headers={
-                    'Cache-Control': 'no-cache',
-                    'X-Accel-Buffering': 'no',
-                }
+                headers=SSE_HEADERS
             )
 
         except Exception as e:
@@ -181,27 +168,15 @@ def create_outline_blueprint():
             from backend.services.copywriting import get_copywriting_service
             copywriting_service = get_copywriting_service()
 
-            def generate():
-                """SSE 事件生成器"""
-                for event in copywriting_service.generate_copywriting_stream(
-                    topic=topic,
-                    outline=outline
-                ):
-                    event_type = event["event"]
-                    event_data = event["data"]
-
-                    # 格式化为 SSE 格式
-                    yield f"event: {event_type}\n"
-                    yield f"data: {json.dumps(event_data, ensure_ascii=False)}\n\n"
-
-            # 返回 SSE 流
+            # 返回 SSE 流（protocol=2 时只发送增量文本，见 stream_text_events）
+            events = copywriting_service.generate_copywriting_stream(
+                topic=topic,
+                outline=outline
+            )
             return Response(
-                generate(),
+                stream_text_events(events, requested_stream_protocol()),
                 mimetype='text/event-stream',
-                headers={
-                    'Cache-Control': 'no-cache',
-                    'X-Accel-Buffering': 'no',
-                }
+                headers=SSE_HEADERS
             )
 
         except Exception as e:
@@ -222,10 +197,13 @@ def create_outline_blueprint():
           - topic: 原始主题
           - current_outline: {raw: str, pages: []}
           - instruction: 修改指令
+          - mode: rewrite（默认，输出完整大纲）/ patch（只输出受影响页面的补丁）
 
         返回：SSE 事件流
         - progress: 开始修改
-        - text: 文本块（打字机效果）
+        - text: 文本块（打字机效果，rewrite 模式）
+        - page: 页面解析完成（rewrite 模式）
+        - patch: 单页补丁 {op: replace/insert/delete, page/after, content, type}（patch 模式）
         - complete: 修改完成
         - error: 错误
         """
@@ -245,6 +223,7 @@ def create_outline_blueprint():
             topic = data.get('topic')
             current_outline = data.get('current_outline')
             instruction = data.get('instruction')
+            mode = data.get('mode', 'rewrite')
 
             # 验证必填参数
             if not topic:
@@ -268,9 +247,17 @@ def create_outline_blueprint():
                     "error": "参数错误：instruction 不能为空。"
                 }), 400
 
+            if mode not in ('rewrite', 'patch'):
+                logger.warning(f"大纲修改请求的 mode 参数无效: {mode}")
+                return jsonify({
+                    "success": False,
+                    "error": "参数错误：mode 只能是 rewrite 或 patch。"
+                }), 400
+
             log_request('/outline/modify/stream', {
                 'topic': topic,
                 'instruction': instruction,
+                'mode': mode,
                 'current_pages': len(current_outline.get('pages', []))
             })
 
@@ -279,24 +266,12 @@ def create_outline_blueprint():
             from backend.services.outline_modify import get_outline_modify_service
             modify_service = get_outline_modify_service()
 
-            def generate():
-                """SSE 事件生成器"""
-                for event in modify_service.modify_outline_stream(topic, current_outline, instruction):
-                    event_type = event["event"]
-                    event_data = event["data"]
-
-                    # 格式化为 SSE 格式
-                    yield f"event: {event_type}\n"
-                    yield f"data: {json.dumps(event_data, ensure_ascii=False)}\n\n"
-
-            # 返回 SSE 流
+            # 返回 SSE 流（protocol=2 时只发送增量文本，见 stream_text_events）
+            events = modify_service.modify_outline_stream(topic, current_outline, instruction, mode=mode)
             return Response(
-                generate(),
+                stream_text_events(events, requested_stream_protocol()),
                 mimetype='text/event-stream',
-                headers={
-                    'Cache-Control': 'no-cache',
-                    'X-Accel-Buffering': 'no',
-                }
+                headers=SSE_HEADERS
             )
 
         except Exception as e:
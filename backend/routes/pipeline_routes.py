@@ -0,0 +1,252 @@
+"""
+流水线生成相关 API 路由
+
+包含功能：
+- 大纲 + 图片流水线生成（大纲生成过程中即开始生成图片，后台任务）
+- 同步用户对页面的编辑（已生成但内容有变化的页面标记为需要重新生成）
+- 完整内容流水线（大纲 -> 文案 + 图片并发 -> 历史记录，后台任务）
+"""
+
+import logging
+import uuid
+from flask import Blueprint, request, jsonify, Response
+from backend.services.image import get_image_service
+from backend.services.outline import get_outline_service
+from backend.services.pipeline import build_content_pipeline
+from backend.services.task_context import STALE_PAGE_ERROR
+from backend.services.task_manager import get_task_manager
+from .outline_routes import _parse_outline_request
+from .task_routes import sse_task_stream
+from .utils import log_request, log_error, SSE_HEADERS
+
+logger = logging.getLogger(__name__)
+
+
+def create_pipeline_blueprint():
+    """创建流水线路由蓝图（工厂函数，支持多次调用）"""
+    pipeline_bp = Blueprint('pipeline', __name__)
+
+    @pipeline_bp.route('/pipeline', methods=['POST'])
+    def start_pipeline():
+        """
+        大纲 + 图片流水线生成（后台任务）
+
+        第一个页面闭合时立即开始生成封面，其余页面解析出来后（封面完成后）立即提交生成，
+        不必等大纲全部生成、再单独调用 /generate。
+
+        请求体（multipart/form-data 或 application/json，同 /outline/stream）：
+        - topic: 主题（必填）
+        - images: 参考图片
+        - use_search: 是否联网搜索
+        - task_id: 任务 ID（可选，不传则自动生成）
+        - async: 为 true 时立即返回 task_id，不在本连接上推送事件（默认 false）
+
+        返回：
+        - async=true: {success, task_id, events_url}（202）
+        - 否则：SSE 事件流（与 /tasks/<task_id>/events 相同），包含以下事件类型：
+          - outline_progress / outline_text / outline_page / outline_complete / outline_error: 大纲生成
+          - progress / complete / error: 图片生成（同 /generate）
+          - page_invalidated: 页面在生成期间被修改，图片需要重新生成
+          - finish: 全部完成
+        """
+        try:
+            topic, images, use_search = _parse_outline_request()
+            options = request.form if request.form else (request.get_json(silent=True) or {})
+            task_id = options.get('task_id') or f"task_{uuid.uuid4().hex[:8]}"
+            run_async = str(options.get('async', 'false')).lower() == 'true'
+
+            log_request('/pipeline', {
+                'topic': topic,
+                'images': images,
+                'use_search': use_search,
+                'task_id': task_id,
+                'async': run_async
+            })
+
+            if not topic:
+                logger.warning("流水线生成请求缺少 topic 参数")
+                return jsonify({
+                    "success": False,
+                    "error": "参数错误：topic 不能为空。\n请提供要生成图文的主题内容。"
+                }), 400
+
+            logger.info(f"🔄 开始流水线生成: {task_id}, 主题: {topic[:50]}...")
+            outline_service = get_outline_service()
+            image_service = get_image_service()
+
+            def run():
+                outline_events = outline_service.generate_outline_stream(topic, images or None, use_search)
+                return image_service.generate_images_from_outline(
+                    outline_events, task_id,
+                    user_topic=topic,
+                    user_images=images or None
+                )
+
+            try:
+                job = get_task_manager().submit(task_id, 'pipeline', run)
+            except RuntimeError as e:
+                return jsonify({
+                    "success": False,
+                    "error": f"{str(e)}\n请等待当前任务完成，或订阅 /api/tasks/{task_id}/events 查看进度。"
+                }), 409
+
+            if run_async:
+                return jsonify({
+                    "success": True,
+                    "task_id": task_id,
+                    "events_url": f"/api/tasks/{task_id}/events"
+                }), 202
+
+            return Response(
+                sse_task_stream(task_id, job.first_event_id - 1),
+                mimetype='text/event-stream',
+                headers=SSE_HEADERS
+            )
+
+        except Exception as e:
+            log_error('/pipeline', e)
+            return jsonify({
+                "success": False,
+                "error": f"流水线生成异常。\n错误详情: {str(e)}\n建议：检查后端日志获取更多信息"
+            }), 500
+
+    @pipeline_bp.route('/pipeline/<task_id>/pages', methods=['POST'])
+    def update_pipeline_pages(task_id):
+        """
+        同步用户对页面的编辑
+
+        已生成图片但内容（或类型）有变化的页面标记为需要重新生成（出现在任务的 failed 中，
+        可通过 /retry-failed 或 /regenerate 重新生成）；仍在生成中的页面在生成完成时作废。
+
+        路径参数：
+        - task_id: 任务 ID
+
+        请求体：
+        - pages: 编辑后的页面列表（按 index 对应）
+
+        返回：
+        - success: 是否成功
+        - invalidated: 图片已失效的页码
+        """
+        try:
+            data = request.get_json() or {}
+            pages = data.get('pages')
+
+            if not pages:
+                return jsonify({
+                    "success": False,
+                    "error": "参数错误：pages 不能为空。"
+                }), 400
+
+            invalidated = get_image_service().update_task_pages(task_id, pages)
+            if invalidated is None:
+                return jsonify({
+                    "success": False,
+                    "error": f"任务不存在：{task_id}"
+                }), 404
+
+            # 通知仍在订阅该任务事件的客户端
+            job = get_task_manager().get_job(task_id)
+            if job is not None:
+                for index in invalidated:
+                    job.append("page_invalidated", {"index": index, "message": STALE_PAGE_ERROR})
+
+            return jsonify({
+                "success": True,
+                "invalidated": invalidated
+            }), 200
+
+        except Exception as e:
+            log_error(f'/pipeline/{task_id}/pages', e)
+            return jsonify({
+                "success": False,
+                "error": f"更新页面失败。\n错误详情: {str(e)}"
+            }), 500
+
+    @pipeline_bp.route('/pipeline/run', methods=['POST'])
+    def run_content_pipeline():
+        """
+        完整内容流水线（后台任务）
+
+        大纲完成后文案和图片并发生成，全部完成后写入历史记录；各阶段输出按输入哈希缓存，
+        同一 task_id 重新运行时输入未变化的阶段直接复用（如只改了文案相关参数时不重新生图）。
+
+        请求体（multipart/form-data 或 application/json，同 /outline/stream）：
+        - topic: 主题（必填）
+        - images: 参考图片
+        - use_search: 是否联网搜索
+        - outline: 已有的大纲 {raw, pages}（可选，JSON 请求；传入时跳过大纲生成）
+        - record_id: 已有的历史记录 ID（可选，传入时更新该记录）
+        - task_id: 任务 ID（可选，不传则自动生成）
+        - async: 为 true 时立即返回 task_id，不在本连接上推送事件（默认 false）
+
+        返回：
+        - async=true: {success, task_id, events_url}（202）
+        - 否则：SSE 事件流（与 /tasks/<task_id>/events 相同），包含以下事件类型：
+          - stage_start / stage_complete / stage_error / stage_skipped: 阶段状态（stage_complete.cached 表示复用）
+          - 各阶段自身的事件（数据中带 stage 字段：outline / copywriting / images / history）
+          - pipeline_finish: 全部结束，带各阶段状态和输出
+        """
+        try:
+            topic, images, use_search = _parse_outline_request()
+            options = request.form if request.form else (request.get_json(silent=True) or {})
+            task_id = options.get('task_id') or f"task_{uuid.uuid4().hex[:8]}"
+            run_async = str(options.get('async', 'false')).lower() == 'true'
+            outline = options.get('outline') if isinstance(options.get('outline'), dict) else None
+            record_id = options.get('record_id')
+
+            log_request('/pipeline/run', {
+                'topic': topic,
+                'images': images,
+                'use_search': use_search,
+                'task_id': task_id,
+                'has_outline': outline is not None,
+                'record_id': record_id,
+                'async': run_async
+            })
+
+            if not topic:
+                logger.warning("流水线请求缺少 topic 参数")
+                return jsonify({
+                    "success": False,
+                    "error": "参数错误：topic 不能为空。\n请提供要生成图文的主题内容。"
+                }), 400
+
+            logger.info(f"🔄 开始内容流水线: {task_id}, 主题: {topic[:50]}...")
+            engine = build_content_pipeline(
+                task_id, topic,
+                images=images or None,
+                use_search=use_search,
+                outline=outline,
+                record_id=record_id
+            )
+
+            try:
+                job = get_task_manager().submit(task_id, 'pipeline_run', engine.run)
+            except RuntimeError as e:
+                return jsonify({
+                    "success": False,
+                    "error": f"{str(e)}\n请等待当前任务完成，或订阅 /api/tasks/{task_id}/events 查看进度。"
+                }), 409
+
+            if run_async:
+                return jsonify({
+                    "success": True,
+                    "task_id": task_id,
+                    "events_url": f"/api/tasks/{task_id}/events"
+                }), 202
+
+            return Response(
+                sse_task_stream(task_id, job.first_event_id - 1),
+                mimetype='text/event-stream',
+                headers=SSE_HEADERS
+            )
+
+        except Exception as e:
+            log_error('/pipeline/run', e)
+            return jsonify({
+                "success": False,
+                "error": f"内容流水线异常。\n错误详情: {str(e)}\n建议：检查后端日志获取更多信息"
+            }), 500
+
+    return pipeline_bp
@@ -0,0 +1,121 @@
+"""
+后台任务相关 API 路由
+
+包含功能：
+- 获取后台任务状态
+- 订阅任务事件流（SSE，支持 Last-Event-ID 断线续传）
+"""
+
+import logging
+from typing import Optional
+from flask import Blueprint, request, jsonify, Response
+from backend.services.task_manager import get_task_manager
+from .utils import format_sse, SSE_HEADERS, log_error
+
+logger = logging.getLogger(__name__)
+
+
+def create_task_blueprint():
+    """创建后台任务路由蓝图（工厂函数，支持多次调用）"""
+    task_bp = Blueprint('task', __name__)
+
+    @task_bp.route('/tasks/<task_id>', methods=['GET'])
+    def get_task(task_id):
+        """
+        获取后台任务状态
+
+        路径参数：
+        - task_id: 任务 ID
+
+        返回：
+        - success: 是否成功
+        - task: 任务概要（状态、事件 ID 范围等）
+        """
+        manager = get_task_manager()
+        job = manager.get_job(task_id)
+
+        if job is None:
+            if manager.has_event_log(task_id):
+                return jsonify({
+                    "success": True,
+                    "task": {"task_id": task_id, "status": "archived"}
+                }), 200
+            return jsonify({
+                "success": False,
+                "error": f"任务不存在：{task_id}"
+            }), 404
+
+        return jsonify({
+            "success": True,
+            "task": job.summary()
+        }), 200
+
+    @task_bp.route('/tasks/<task_id>/events', methods=['GET'])
+    def stream_task_events(task_id):
+        """
+        订阅任务事件流（SSE）
+
+        路径参数：
+        - task_id: 任务 ID
+
+        请求头 / 查询参数：
+        - Last-Event-ID / last_event_id: 从该事件之后开始回放（可选，默认回放本次运行的全部事件）
+
+        返回：
+        SSE 事件流，每条事件带 id，可用于断线重连
+        """
+        try:
+            manager = get_task_manager()
+            if manager.get_job(task_id) is None and not manager.has_event_log(task_id):
+                return jsonify({
+                    "success": False,
+                    "error": f"任务不存在：{task_id}"
+                }), 404
+
+            after_id = _parse_last_event_id()
+            logger.info(f"📡 订阅任务事件: task_id={task_id}, last_event_id={after_id}")
+
+            return Response(
+                sse_task_stream(task_id, after_id),
+                mimetype='text/event-stream',
+                headers=SSE_HEADERS
+            )
+
+        except Exception as e:
+            log_error(f'/tasks/{task_id}/events', e)
+            return jsonify({
+                "success": False,
+                "error": f"订阅任务事件失败。\n错误详情: {str(e)}"
+            }), 500
+
+    return task_bp
+
+
+def sse_task_stream(task_id: str, after_id: Optional[int] = None):
+    """
+    把任务事件转换为 SSE 文本流
+
+    Args:
+        task_id: 任务 ID
+        after_id: 从该事件 ID 之后开始（None 表示本次运行开头）
+
+    Yields:
+        SSE 消息文本
+    """
+    for record in get_task_manager().iter_events(task_id, after_id):
+        if record is None:
+            # 心跳，防止代理因空闲断开连接
+            yield ": keep-alive\n\n"
+            continue
+        yield format_sse(record["event"], record["data"], record["id"])
+
+
+def _parse_last_event_id() -> Optional[int]:
+    """从请求头或查询参数中解析 Last-Event-ID"""
+    raw = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if not raw:
+        return None
+    try:
+        return int(raw)
+    except ValueError:
+        return None
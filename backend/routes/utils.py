@@ -4,12 +4,207 @@ API 路由工具函数
 包含通用的日志记录、错误处理等辅助函数
 """
 
+import json
 import logging
+import queue
+import threading
+import time
 import traceback
+import zlib
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from flask import request
+
+from backend.utils.key_pool import provider_api_keys
 
 logger = logging.getLogger(__name__)
 
 
+def format_sse(event: str, data: Any, event_id: Optional[int] = None) -> str:
+    """
+    格式化一条 SSE 消息
+
+    id 字段放在 data 之后，兼容只按 "event/data" 前两行解析的旧客户端
+
+    Args:
+        event: 事件类型
+        data: 事件数据（JSON 序列化）
+        event_id: 事件 ID（可选，用于断线重连的 Last-Event-ID）
+
+    Returns:
+        str: SSE 消息文本
+    """
+    message = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n"
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    return message + "\n"
+
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no',
+}
+
+# 流式文本接口的协议版本：
+# 1 - 每个文本块一个 text 事件，携带 chunk 和完整的 accumulated（默认，兼容旧客户端）
+# 2 - 只发送新增文本（delta 事件，带序号），定期发送校验点（checkpoint 事件）
+STREAM_PROTOCOL_V1 = 1
+STREAM_PROTOCOL_V2 = 2
+
+
+def requested_stream_protocol() -> int:
+    """客户端请求的流式协议版本（查询参数 protocol 或请求头 X-Stream-Protocol）"""
+    value = request.args.get('protocol') or request.headers.get('X-Stream-Protocol')
+    try:
+        return STREAM_PROTOCOL_V2 if int(value) >= STREAM_PROTOCOL_V2 else STREAM_PROTOCOL_V1
+    except (TypeError, ValueError):
+        return STREAM_PROTOCOL_V1
+
+
+class DeltaTextEncoder:
+    """
+    把服务层的 text 事件编码为 v2 增量事件
+
+    v1 每个文本块都携带完整的累积文本，传输量和序列化开销随输出长度平方增长。v2：
+    - delta: {seq, delta} 只包含新增文本；细碎的文本块合并后按时间或大小发送（模型暂停输出时，
+      由 stream_text_events 按 flush_timeout() 定时调用 flush_due()，缓冲的文本不会等到下一个文本块才发送）
+    - checkpoint: {seq, length, crc32} 已发送文本的长度（字符数）和 UTF-8 CRC32，
+      客户端据此校验拼接结果；每发送 CHECKPOINT_CHARS 个字符一次，流结束前再发一次
+    - 其他事件原样发送；complete 事件仍携带完整文本，校验失败时以它为准
+    """
+
+    # 距上次发送超过该时间（秒）立即发送，否则先缓冲
+    FLUSH_INTERVAL = 0.05
+    # 缓冲的字符数达到该值立即发送
+    FLUSH_CHARS = 256
+    # 每发送多少字符发一次校验点
+    CHECKPOINT_CHARS = 2048
+    # 结束事件（之前发送最终校验点）
+    TERMINAL_EVENTS = ("complete", "error")
+
+    def __init__(self):
+        self._buffer = []
+        self._buffered = 0
+        self._last_flush = 0.0
+        self._seq = 0
+        self._sent_chars = 0
+        self._crc = 0
+        self._checkpoint_at = 0
+
+    def _flush(self) -> Iterator[str]:
+        if not self._buffered:
+            return
+        delta = ''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+        self._seq += 1
+        self._sent_chars += len(delta)
+        self._crc = zlib.crc32(delta.encode('utf-8'), self._crc)
+        yield format_sse("delta", {"seq": self._seq, "delta": delta}, self._seq)
+        if self._sent_chars - self._checkpoint_at >= self.CHECKPOINT_CHARS:
+            yield self._checkpoint()
+
+    def _checkpoint(self) -> str:
+        self._checkpoint_at = self._sent_chars
+        return format_sse("checkpoint", {
+            "seq": self._seq,
+            "length": self._sent_chars,
+            "crc32": self._crc
+        })
+
+    def flush_timeout(self) -> Optional[float]:
+        """距离缓冲的文本应当发送还有多少秒（没有缓冲的文本时为 None）"""
+        if not self._buffered:
+            return None
+        return max(0.0, self.FLUSH_INTERVAL - (time.monotonic() - self._last_flush))
+
+    def flush_due(self) -> Iterator[str]:
+        """缓冲的文本已到发送时间时发送（没有新的文本块到达时定时调用）"""
+        if self._buffered and time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL:
+            yield from self._flush()
+
+    def encode(self, event: str, data: Dict[str, Any]) -> Iterator[str]:
+        """编码一个服务层事件，返回需要发送的 SSE 消息（每条消息一次写出）"""
+        if event == "text":
+            chunk = data.get("chunk") or ""
+            self._buffer.append(chunk)
+            self._buffered += len(chunk)
+            if (self._buffered >= self.FLUSH_CHARS
+                    or time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL):
+                yield from self._flush()
+            return
+
+        # 其他事件之前先把缓冲的文本发完，保证事件顺序；结束事件之前再发送最终校验点
+        if event in self.TERMINAL_EVENTS:
+            yield from self.finish()
+        else:
+            yield from self._flush()
+        yield format_sse(event, data)
+
+    def finish(self) -> Iterator[str]:
+        """发送缓冲中的文本和最终校验点"""
+        yield from self._flush()
+        if self._seq and self._checkpoint_at != self._sent_chars:
+            yield self._checkpoint()
+
+
+def stream_text_events(events: Iterable[Dict[str, Any]], protocol: int = STREAM_PROTOCOL_V1) -> Iterator[str]:
+    """
+    把流式文本服务的事件转换为 SSE 消息
+
+    Args:
+        events: 服务层事件（{"event", "data"}）
+        protocol: 流式协议版本（STREAM_PROTOCOL_V1 / STREAM_PROTOCOL_V2）
+
+    Yields:
+        SSE 消息（每个事件一次写出）
+    """
+    if protocol < STREAM_PROTOCOL_V2:
+        for event in events:
+            yield format_sse(event["event"], event["data"])
+        return
+
+    # 服务层事件在读取线程中消费，当前线程在等待下一个事件时按时间发送缓冲的文本
+    pending: "queue.Queue[Any]" = queue.Queue()
+    end = object()
+    stopped = threading.Event()
+
+    def read_events():
+        try:
+            for event in events:
+                pending.put(event)
+                if stopped.is_set():
+                    break
+        except Exception as e:
+            pending.put(e)
+        finally:
+            # 客户端断开时在读取线程中关闭服务层生成器，停止上游的模型调用
+            close = getattr(events, "close", None)
+            if stopped.is_set() and close is not None:
+                close()
+            pending.put(end)
+
+    threading.Thread(target=read_events, name="sse-text-stream", daemon=True).start()
+
+    encoder = DeltaTextEncoder()
+    try:
+        while True:
+            try:
+                item = pending.get(timeout=encoder.flush_timeout())
+            except queue.Empty:
+                yield from encoder.flush_due()
+                continue
+            if item is end:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield from encoder.encode(item["event"], item["data"])
+        yield from encoder.finish()
+    finally:
+        stopped.set()
+
+
 def log_request(endpoint: str, data: dict = None):
     """
     记录 API 请求日志
@@ -71,7 +266,7 @@ def prepare_providers_for_response(providers: dict) -> dict:
     """
     准备返回给前端的 providers 数据
 
-    将 api_key 替换为脱敏版本，避免泄露
+    将 api_key / api_keys 替换为脱敏版本，避免泄露
 
     Args:
         providers: 原始服务商配置字典
@@ -83,14 +278,12 @@ def prepare_providers_for_response(providers: dict) -> dict:
     for name, config in providers.items():
         provider_copy = config.copy()
 
-        # 返回脱敏的 api_key
-        if 'api_key' in provider_copy and provider_copy['api_key']:
-            provider_copy['api_key_masked'] = mask_api_key(provider_copy['api_key'])
-            # 不返回实际值，前端用空字符串表示"不修改"
-            provider_copy['api_key'] = ''
-        else:
-            provider_copy['api_key_masked'] = ''
-            provider_copy['api_key'] = ''
+        # 返回脱敏的 api_key（配置了多个 Key 时逐个脱敏，用逗号分隔）
+        keys = provider_api_keys(provider_copy)
+        provider_copy['api_key_masked'] = ', '.join(mask_api_key(key) for key in keys)
+        # 不返回实际值，前端用空字符串表示"不修改"
+        provider_copy['api_key'] = ''
+        provider_copy.pop('api_keys', None)
 
         result[name] = provider_copy
 
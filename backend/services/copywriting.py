@@ -6,6 +6,8 @@ import yaml
 from pathlib import Path
 from typing import Dict, List, Any, Optional, Generator
 from backend.utils.text_client import get_text_chat_client
+from backend.utils.key_pool import provider_api_keys
+from backend.utils.service_registry import get_service_registry, text_service_fingerprint
 
 logger = logging.getLogger(__name__)
 
@@ -78,7 +80,7 @@ class CopywritingService:
 
         provider_config = providers.get(active_provider, {})
 
-        if not provider_config.get('api_key'):
+        if not provider_api_keys(provider_config):
             logger.error(f"文本服务商 [{active_provider}] 未配置 API Key")
             raise ValueError(
                 f"文本服务商 {active_provider} 未配置 API Key\n"
@@ -86,7 +88,7 @@ class CopywritingService:
             )
 
         logger.info(f"使用文本服务商: {active_provider} (type={provider_config.get('type')})")
-        return get_text_chat_client(provider_config)
+        return get_text_chat_client(provider_config, active_provider)
 
     def _load_prompt_template(self) -> str:
         """加载文案生成提示词模板"""
@@ -312,11 +314,12 @@ class CopywritingService:
             error_msg = str(e)
             logger.error(f"文案生成失败: {error_msg}")
 
-            # 发送错误事件
+            # 发送错误事件（附带服务商熔断状态）
             yield {
                 "event": "error",
                 "data": {
-                    "error": error_msg
+                    "error": error_msg,
+                    "breaker": self.client.breaker.snapshot()
                 }
             }
 
@@ -337,6 +340,10 @@ class CopywritingService:
 def get_copywriting_service() -> CopywritingService:
     """
     获取文案生成服务实例
-    每次调用都创建新实例以确保配置是最新的
+    按配置指纹缓存：文本服务商配置或提示词模板变化后自动重建
     """
-    return CopywritingService()
+    return get_service_registry().get_or_create(
+        "copywriting",
+        text_service_fingerprint(["copywriting_prompt.txt"]),
+        CopywritingService
+    )
@@ -1,14 +1,33 @@
 """图片生成服务"""
+import hashlib
 import logging
 import os
 import uuid
 import time
+import queue
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, Any, Generator, List, Optional, Tuple
-from backend.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, Generator, Iterable, List, Optional, Tuple
+from backend.config import Config, ConfigSnapshot
 from backend.generators.factory import ImageGeneratorFactory
-from backend.utils.image_compressor import compress_image
+from backend.utils.image_processor import get_image_processor
+from backend.utils.circuit_breaker import get_circuit_breaker
+from backend.utils.concurrency import get_provider_limiter
+from backend.utils.hedging import get_latency_tracker, hedged_call
+from backend.utils.image_cache import get_image_cache, image_cache_key
+from backend.utils.key_pool import get_key_pool
+from backend.utils.reference_payload import ReferenceImage
+from backend.utils.retry import RetryPolicy, classify_error, retry_call
+from backend.services.task_context import STALE_PAGE_ERROR, TaskContext, page_input_hash
+from backend.services.page_manifest import page_inputs_hash
+from backend.services.prompt_builder import ImagePromptBuilder
+from backend.services.style_descriptor import (
+    format_style_descriptor, get_style_descriptor_service, resolve_style_reference
+)
+from backend.services.task_store import get_task_state_store
+from backend.services.provider_router import ProviderRouter, set_active_router, should_failover
+from backend.services.thumbnail import get_thumbnail_service
+from backend.utils.fs import write_file_atomic
 
 logger = logging.getLogger(__name__)
 
@@ -16,41 +35,83 @@ logger = logging.getLogger(__name__)
 class ImageService:
     """图片生成服务类"""
 
-    # 并发配置
-    MAX_CONCURRENT = 15  # 最大并发数
-    AUTO_RETRY_COUNT = 3  # 自动重试次数
+    # 对冲请求默认配置
+    HEDGE_PERCENTILE = 95  # 超过最近耗时的该分位数时补发请求
+    HEDGE_MAX_EXTRA = 3  # 每个任务最多额外发出的请求数
 
-    def __init__(self, provider_name: str = None):
+    def __init__(
+        self,
+        provider_name: str = None,
+        enable_routing: bool = True,
+        snapshot: Optional[ConfigSnapshot] = None
+    ):
         """
         初始化图片生成服务
 
         Args:
             provider_name: 服务商名称，如果为None则使用配置文件中的激活服务商
+            enable_routing: 是否按 routing 配置在多个服务商之间分配请求（路由内部的服务实例为 False）
+            snapshot: 配置快照（路由、对冲创建的服务实例沿用主服务的快照），默认使用最新配置
         """
         logger.debug("初始化 ImageService...")
 
+        # 配置快照：服务实例的整个生命周期都使用这一版本的配置
+        self.config_snapshot = snapshot or Config.current()
+        self.config_version = self.config_snapshot.version
+
         # 获取服务商配置
         if provider_name is None:
-            provider_name = Config.get_active_image_provider()
+            provider_name = Config.get_active_image_provider(self.config_snapshot)
 
         logger.info(f"使用图片服务商: {provider_name}")
-        provider_config = Config.get_image_provider_config(provider_name)
+        provider_config = Config.get_image_provider_config(provider_name, self.config_snapshot)
+
+        # API Key 池（配置多个 Key 时请求在 Key 之间轮换，限流 / 失效的 Key 自动跳过）
+        self.key_pool = get_key_pool("image", provider_name, provider_config)
 
-        # 创建生成器实例
+        # 创建生成器实例（每个 Key 一个生成器）
         provider_type = provider_config.get('type', provider_name)
-        logger.debug(f"创建生成器: type={provider_type}")
-        self.generator = ImageGeneratorFactory.create(provider_type, provider_config)
+        logger.debug(f"创建生成器: type={provider_type}, keys={len(self.key_pool.keys)}")
+        self._generators = {
+            key: ImageGeneratorFactory.create(provider_type, {**provider_config, 'api_key': key})
+            for key in self.key_pool.keys
+        }
+        self.generator = next(iter(self._generators.values()))
 
         # 保存配置信息
         self.provider_name = provider_name
         self.provider_config = provider_config
 
-        # 检查是否启用短 prompt 模式
-        self.use_short_prompt = provider_config.get('short_prompt', False)
+        # 重试策略（总尝试次数和耗时预算，可通过 retry_max_attempts / retry_budget_seconds 配置）
+        self.retry_policy = RetryPolicy.from_config(provider_config)
+
+        # 熔断器（服务商持续故障时快速失败，进程内按服务商共享）
+        self.breaker = get_circuit_breaker("image", provider_name, provider_config)
+
+        # 自适应并发控制（进程内按服务商共享，所有任务的生成/重试/重新生成共用同一预算）
+        self.concurrency = get_provider_limiter(provider_name, provider_config)
 
-        # 加载提示词模板
-        self.prompt_template = self._load_prompt_template()
-        self.prompt_template_short = self._load_prompt_template(short=True)
+        # 对冲请求：页面耗时超过最近耗时的 hedge_percentile 分位时补发一个请求（可发往 hedge_provider），
+        # 封面可一开始就并行发出 cover_parallel_attempts 个请求；额外请求数每个任务不超过 hedge_max_extra
+        self.latency = get_latency_tracker(provider_name)
+        self.hedge_enabled = provider_config.get('hedge', False)
+        self.hedge_percentile = provider_config.get('hedge_percentile', self.HEDGE_PERCENTILE)
+        self.hedge_max_extra = provider_config.get('hedge_max_extra', self.HEDGE_MAX_EXTRA)
+        self.cover_parallel_attempts = max(1, int(provider_config.get('cover_parallel_attempts', 1)))
+        self._hedge_service: Optional["ImageService"] = None
+        self._hedge_lock = threading.Lock()
+
+        # 生成结果缓存（按服务商配置 cache: true 开启）
+        self.image_cache = None
+        if provider_config.get('cache', False):
+            self.image_cache = get_image_cache(provider_config.get('cache_max_mb'))
+            logger.info(f"已启用图片生成缓存: provider={provider_name}")
+
+        # 提示词构建（prompt_mode: full / compact / short，旧配置 short_prompt: true 等价于 short）
+        self.prompt_builder = ImagePromptBuilder.from_config(provider_config)
+
+        # 内容页的封面参考方式（style_reference: image / descriptor / both）
+        self.style_reference = resolve_style_reference(provider_config)
 
         # 历史记录根目录
         self.history_root_dir = os.path.join(
@@ -59,170 +120,484 @@ class ImageService:
         )
         os.makedirs(self.history_root_dir, exist_ok=True)
 
-        # 当前任务的输出目录（每个任务一个子文件夹）
-        self.current_task_dir = None
+        # 任务上下文存储（用于重试；进程内全局、有内存上限，不随服务重建而清空）
+        self._task_states = get_task_state_store()
 
-        # 存储任务状态（用于重试）
-        self._task_states: Dict[str, Dict] = {}
+        # 多服务商路由（配置 routing 后按权重和实测耗时分配页面，故障时自动切换）
+        self.router: Optional[ProviderRouter] = None
+        if enable_routing:
+            self.router = ProviderRouter.from_config(self)
+            set_active_router(self.router)
 
-        logger.info(f"ImageService 初始化完成: provider={provider_name}, type={provider_type}")
-
-    def _load_prompt_template(self, short: bool = False) -> str:
-        """加载 Prompt 模板"""
-        filename = "image_prompt_short.txt" if short else "image_prompt.txt"
-        prompt_path = os.path.join(
-            os.path.dirname(os.path.dirname(__file__)),
-            "prompts",
-            filename
+        logger.info(
+            f"ImageService 初始化完成: provider={provider_name}, type={provider_type}, "
+            f"config_version={self.config_version}"
         )
-        if not os.path.exists(prompt_path):
-            # 如果短模板不存在，返回空字符串
-            return ""
-        with open(prompt_path, "r", encoding="utf-8") as f:
-            return f.read()
 
-    def _save_image(self, image_data: bytes, filename: str, task_dir: str = None) -> str:
+    def _save_image(self, image_data: bytes, filename: str, task_dir: str) -> str:
         """
-        保存图片到本地，同时生成缩略图
+        保存图片到本地，缩略图交给后台生成
 
         Args:
             image_data: 图片二进制数据
             filename: 文件名
-            task_dir: 任务目录（如果为None则使用当前任务目录）
+            task_dir: 任务目录
 
         Returns:
             保存的文件路径
         """
-        if task_dir is None:
-            task_dir = self.current_task_dir
-
-        if task_dir is None:
+        if not task_dir:
             raise ValueError("任务目录未设置")
 
-        # 保存原图
+        # 保存原图（落盘后再返回，之后即可发送完成事件）
         filepath = os.path.join(task_dir, filename)
-        with open(filepath, "wb") as f:
-            f.write(image_data)
+        write_file_atomic(filepath, image_data, durable=True)
 
-        # 生成缩略图（50KB左右）
-        thumbnail_data = compress_image(image_data, max_size_kb=50)
-        thumbnail_filename = f"thumb_{filename}"
-        thumbnail_path = os.path.join(task_dir, thumbnail_filename)
-        with open(thumbnail_path, "wb") as f:
-            f.write(thumbnail_data)
+        # 缩略图（50KB左右）在后台生成，未完成前首次请求时会按需生成
+        get_thumbnail_service().schedule(filepath)
 
         return filepath
 
+    def _generator_kwargs(
+        self,
+        reference_image: Optional[ReferenceImage] = None,
+        user_images: Optional[List[ReferenceImage]] = None
+    ) -> Dict[str, Any]:
+        """
+        按服务商类型组装生成器参数（不含提示词）
+
+        Args:
+            reference_image: 参考图片（封面图）
+            user_images: 用户上传的参考图片列表
+
+        Returns:
+            传给 generate_image 的参数
+        """
+        if self.provider_config.get('type') == 'google_genai':
+            return {
+                "aspect_ratio": self.provider_config.get('default_aspect_ratio', '3:4'),
+                "temperature": self.provider_config.get('temperature', 1.0),
+                "model": self.provider_config.get('model', 'gemini-3-pro-image-preview'),
+                "reference_image": reference_image,
+            }
+        elif self.provider_config.get('type') == 'image_api':
+            # Image API 支持多张参考图片
+            # 组合参考图片：用户上传的图片 + 封面图
+            reference_images = []
+            if user_images:
+                reference_images.extend(user_images)
+            if reference_image:
+                reference_images.append(reference_image)
+
+            return {
+                "aspect_ratio": self.provider_config.get('default_aspect_ratio', '3:4'),
+                "temperature": self.provider_config.get('temperature', 1.0),
+                "model": self.provider_config.get('model', 'nano-banana-2'),
+                "reference_images": reference_images if reference_images else None,
+            }
+        else:
+            return {
+                "size": self.provider_config.get('default_size', '1024x1024'),
+                "model": self.provider_config.get('model'),
+                "quality": self.provider_config.get('quality', 'standard'),
+            }
+
+    def _generator_for(self, api_key: str):
+        """获取 Key 对应的生成器（配置更新后 Key 池里出现的新 Key 按需创建）"""
+        generator = self._generators.get(api_key)
+        if generator is None:
+            provider_type = self.provider_config.get('type', self.provider_name)
+            generator = ImageGeneratorFactory.create(provider_type, {**self.provider_config, 'api_key': api_key})
+            self._generators[api_key] = generator
+        return generator
+
+    def _call_generator(
+        self,
+        prompt: str,
+        reference_image: Optional[ReferenceImage] = None,
+        user_images: Optional[List[ReferenceImage]] = None
+    ) -> bytes:
+        """
+        按服务商类型组装参数并调用生成器
+
+        Args:
+            prompt: 最终提示词
+            reference_image: 参考图片（封面图）
+            user_images: 用户上传的参考图片列表
+
+        Returns:
+            图片二进制数据
+        """
+        logger.debug(f"  调用生成器: type={self.provider_config.get('type')}")
+        kwargs = self._generator_kwargs(reference_image, user_images)
+        return self.key_pool.call(
+            lambda api_key: self._generator_for(api_key).generate_image(prompt=prompt, **kwargs)
+        )
+
+    def _timed_generate(
+        self,
+        prompt: str,
+        reference_image: Optional[ReferenceImage] = None,
+        user_images: Optional[List[ReferenceImage]] = None
+    ) -> bytes:
+        """调用生成器并记录成功耗时（对冲阈值的依据）"""
+        start = time.monotonic()
+        image_data = self._call_generator(prompt, reference_image, user_images)
+        self.latency.record(time.monotonic() - start)
+        return image_data
+
+    def _hedge_target(self, service: Optional["ImageService"] = None) -> "ImageService":
+        """
+        对冲请求发往的服务
+
+        优先使用配置的 hedge_provider；启用路由时选择主请求之外得分最高的服务商；
+        否则发往主请求所在的服务商
+        """
+        service = service or self
+        name = self.provider_config.get('hedge_provider')
+        if not name and self.router is not None:
+            others = self.router.candidates(exclude={service.provider_name})
+            return others[0] if others else service
+        if not name or name == service.provider_name:
+            return service
+        if name == self.provider_name:
+            return self
+        with self._hedge_lock:
+            if self._hedge_service is None:
+                try:
+                    self._hedge_service = ImageService(name, enable_routing=False, snapshot=self.config_snapshot)
+                except Exception as e:
+                    logger.warning(f"⚠️ 备用服务商 {name} 不可用，对冲请求改发当前服务商: {e}")
+                    self._hedge_service = self
+            return self._hedge_service
+
+    def _cache_key(
+        self,
+        prompt: str,
+        reference_image: Optional[ReferenceImage] = None,
+        user_images: Optional[List[ReferenceImage]] = None
+    ) -> Optional[str]:
+        """计算生成请求的缓存键（未启用缓存时返回 None）"""
+        if self.image_cache is None:
+            return None
+        provider_type = self.provider_config.get('type', self.provider_name)
+        return image_cache_key(provider_type, prompt, self._generator_kwargs(reference_image, user_images))
+
+    def _page_inputs_hash(self, page: Dict, ctx: TaskContext, reference_image: Optional[bytes]) -> str:
+        """页面生成输入的哈希（用于页面清单，判断页面是否需要重新生成）"""
+        prompt_mode = self.prompt_builder.mode
+        if self.style_reference != "image":
+            prompt_mode = f"{prompt_mode}/{self.style_reference}"
+        # 参考图单独计入，生成器参数中去掉
+        params = {
+            k: v for k, v in self._generator_kwargs().items()
+            if k not in ("reference_image", "reference_images")
+        }
+        template = self.prompt_builder.templates.get(self.prompt_builder.mode, "")
+        generation = {
+            "provider_type": self.provider_config.get('type', self.provider_name),
+            "params": params,
+            "context_budget": self.prompt_builder.context_budget,
+            "template": hashlib.sha1(template.encode("utf-8")).hexdigest()
+        }
+        return page_inputs_hash(page, ctx.user_topic, prompt_mode, ctx.user_images, reference_image, generation)
+
+    def _extract_style_descriptor(self, cover_image: bytes) -> str:
+        """提取封面风格描述文本，失败时返回空字符串（内容页改为上传封面图）"""
+        try:
+            return format_style_descriptor(get_style_descriptor_service().extract(cover_image))
+        except Exception as e:
+            logger.warning(f"⚠️ 提取封面风格描述失败，内容页改为上传封面图: {str(e)[:200]}")
+            return ""
+
+    def _reuse_pages(self, pages: List[Dict], ctx: TaskContext, reference_image: Optional[bytes]) -> Dict[int, str]:
+        """
+        按页面清单复用生成输入未变化的页面（页码变化时复制到新页码）
+
+        先读出全部可复用的图片再写入，避免插入 / 删除页面后，复制到新页码时覆盖了其他页面要复用的原文件。
+
+        Args:
+            pages: 页面列表
+            ctx: 任务上下文
+            reference_image: 本次生成会使用的参考图
+
+        Returns:
+            页码 -> 复用的文件名
+        """
+        found = []
+        for page in pages:
+            inputs_hash = self._page_inputs_hash(page, ctx, reference_image)
+            source_path = ctx.manifest.find(page["index"], inputs_hash)
+            if source_path is None:
+                continue
+            with open(source_path, "rb") as f:
+                found.append((page["index"], inputs_hash, source_path, f.read()))
+
+        reused = {}
+        for index, inputs_hash, source_path, image_data in found:
+            filename = f"{index}.png"
+            if os.path.abspath(source_path) != os.path.abspath(os.path.join(ctx.task_dir, filename)):
+                self._save_image(image_data, filename, ctx.task_dir)
+            ctx.manifest.record(index, inputs_hash, filename, image_data)
+            ctx.mark_generated(index, filename)
+            ctx.mark_provider(index, "reused")
+            logger.info(f"⚡ 图片 [{index}] 生成输入未变化，复用已有图片: {os.path.basename(source_path)}")
+            reused[index] = filename
+        return reused
+
     def _generate_single_image(
         self,
         page: Dict,
-        task_id: str,
+        ctx: TaskContext,
         reference_image: Optional[bytes] = None,
-        retry_count: int = 0,
-        full_outline: str = "",
-        user_images: Optional[List[bytes]] = None,
-        user_topic: str = ""
+        on_status: Optional[Callable[[str, Dict[str, Any]], None]] = None
     ) -> Tuple[int, bool, Optional[str], Optional[str]]:
         """
-        生成单张图片（带自动重试）
+        生成单张图片（按重试策略自动重试）
 
         Args:
             page: 页面数据
-            task_id: 任务ID
-            reference_image: 参考图片（封面图）
-            retry_count: 当前重试次数
-            full_outline: 完整的大纲文本
-            user_images: 用户上传的参考图片列表
-            user_topic: 用户原始输入
+            ctx: 任务上下文（提供输出目录、大纲、用户输入和用户参考图）
+            reference_image: 参考图片（封面图），生成封面时为 None
+            on_status: 状态回调 (status, extra)，status 为 queued（排队等待并发额度）、generating、
+                retrying（本次尝试失败，等待后重试）或 cached
 
         Returns:
             (index, success, filename, error_message)
         """
         index = page["index"]
         page_type = page["type"]
-        page_content = page["content"]
 
-        max_retries = self.AUTO_RETRY_COUNT
+        # 生成输入的哈希（记录到页面清单）
+        inputs_hash = self._page_inputs_hash(page, ctx, reference_image)
+
+        # 封面风格描述（每张封面只提取一次）；只使用风格描述时不再上传封面，提取失败时仍上传封面
+        style_descriptor = None
+        if reference_image and self.style_reference != "image":
+            style_descriptor = ctx.cover_style_descriptor(reference_image, self._extract_style_descriptor) or None
+        if style_descriptor and self.style_reference == "descriptor":
+            reference_image = None
+
+        # 参考图在任务内只压缩、编码一次，所有页面和重试共用同一份载荷
+        reference = ctx.reference_payloads.get(reference_image) if reference_image else None
+        user_references = ctx.reference_payloads.get_many(ctx.user_images) or None
+
+        try:
+            # 按提示词模式构建（完整 / 紧凑上下文 / 短），同时记录提示词大小
+            prompt = self.prompt_builder.build(
+                page, ctx, style_descriptor,
+                cover_attached=reference_image is not None
+            )
 
-        for attempt in range(max_retries):
-            try:
-                logger.debug(f"生成图片 [{index}]: type={page_type}, attempt={attempt + 1}/{max_retries}")
-
-                # 根据配置选择模板（短 prompt 或完整 prompt）
-                if self.use_short_prompt and self.prompt_template_short:
-                    # 短 prompt 模式：只包含页面类型和内容
-                    prompt = self.prompt_template_short.format(
-                        page_content=page_content,
-                        page_type=page_type
-                    )
-                    logger.debug(f"  使用短 prompt 模式 ({len(prompt)} 字符)")
-                else:
-                    # 完整 prompt 模式：包含大纲和用户需求
-                    prompt = self.prompt_template.format(
-                        page_content=page_content,
-                        page_type=page_type,
-                        full_outline=full_outline,
-                        user_topic=user_topic if user_topic else "未提供"
-                    )
+            # 完全相同的请求命中缓存时直接使用，不占用并发额度
+            cache_key = self._cache_key(prompt, reference, user_references)
+            image_data = self.image_cache.get(cache_key) if cache_key else None
 
-                # 调用生成器生成图片
-                if self.provider_config.get('type') == 'google_genai':
-                    logger.debug(f"  使用 Google GenAI 生成器")
-                    image_data = self.generator.generate_image(
-                        prompt=prompt,
-                        aspect_ratio=self.provider_config.get('default_aspect_ratio', '3:4'),
-                        temperature=self.provider_config.get('temperature', 1.0),
-                        model=self.provider_config.get('model', 'gemini-3-pro-image-preview'),
-                        reference_image=reference_image,
-                    )
-                elif self.provider_config.get('type') == 'image_api':
-                    logger.debug(f"  使用 Image API 生成器")
-                    # Image API 支持多张参考图片
-                    # 组合参考图片：用户上传的图片 + 封面图
-                    reference_images = []
-                    if user_images:
-                        reference_images.extend(user_images)
-                    if reference_image:
-                        reference_images.append(reference_image)
-
-                    image_data = self.generator.generate_image(
-                        prompt=prompt,
-                        aspect_ratio=self.provider_config.get('default_aspect_ratio', '3:4'),
-                        temperature=self.provider_config.get('temperature', 1.0),
-                        model=self.provider_config.get('model', 'nano-banana-2'),
-                        reference_images=reference_images if reference_images else None,
-                    )
-                else:
-                    logger.debug(f"  使用 OpenAI 兼容生成器")
-                    image_data = self.generator.generate_image(
-                        prompt=prompt,
-                        size=self.provider_config.get('default_size', '1024x1024'),
-                        model=self.provider_config.get('model'),
-                        quality=self.provider_config.get('quality', 'standard'),
+            if image_data is not None:
+                logger.info(f"⚡ 图片 [{index}] 命中生成缓存")
+                ctx.mark_provider(index, "cache")
+                if on_status:
+                    on_status("cached", {})
+            else:
+                # 封面阻塞其他所有页面，可以一开始就并行发出多个请求
+                parallel = self.cover_parallel_attempts if page_type == "cover" else 1
+                image_data, provider_name = self._generate_with_retry(
+                    index, prompt, ctx, reference, user_references, on_status, parallel=parallel
+                )
+                ctx.mark_provider(index, provider_name)
+
+                if cache_key:
+                    try:
+                        self.image_cache.put(cache_key, image_data)
+                    except OSError as e:
+                        logger.warning(f"⚠️ 写入图片缓存失败: {e}")
+
+            # 保存图片（写入该任务自己的目录）
+            filename = f"{index}.png"
+            self._save_image(image_data, filename, ctx.task_dir)
+            ctx.manifest.record(index, inputs_hash, filename, image_data)
+            logger.info(f"✅ 图片 [{index}] 生成成功: {filename}")
+
+            return (index, True, filename, None)
+
+        except Exception as e:
+            logger.error(f"❌ 图片 [{index}] 生成失败: {str(e)[:200]}")
+            return (index, False, None, str(e))
+
+    def _generate_with_retry(
+        self,
+        index: int,
+        prompt: str,
+        ctx: TaskContext,
+        reference: Optional[ReferenceImage],
+        user_references: Optional[List[ReferenceImage]],
+        on_status: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+        parallel: int = 1
+    ) -> Tuple[bytes, str]:
+        """
+        按服务商的重试策略调用生成器
+
+        每次尝试占用一个并发槽位（结果反馈给并发控制器），重试前的等待在槽位外进行；
+        每次尝试的结果记录到任务上下文。启用对冲时，每次尝试内部可能额外发出请求，
+        先成功的结果胜出。启用路由时，每次尝试按路由顺序选择服务商，服务商自身的
+        故障会立即切换到下一个服务商。
+
+        Args:
+            parallel: 每次尝试一开始就并行发出的请求数（封面使用）
+
+        Returns:
+            (图片二进制数据, 生成该图片的服务商名称)
+        """
+        attempt_no = 0
+
+        def on_wait(position: int):
+            if on_status:
+                on_status("queued", {"queue_position": position})
+
+        def run_primary(service: "ImageService", started: Optional[threading.Event] = None) -> Tuple[bytes, str]:
+            # 熔断时直接失败，不排队等待并发额度
+            with service.breaker.guard(), service.concurrency.slot(on_wait=on_wait):
+                # 取得槽位后才开始对冲计时
+                if started is not None:
+                    started.set()
+                if on_status:
+                    on_status("generating", {"attempt": attempt_no, "provider": service.provider_name})
+                ctx.record_attempt()
+                return service._timed_generate(prompt, reference, user_references), service.provider_name
+
+        def hedge_factory(service: "ImageService"):
+            def next_hedge(hedge_no: int) -> Optional[Callable[[], Tuple[bytes, str]]]:
+                target = self._hedge_target(service)
+                if target.breaker.state != "closed":
+                    return None
+                if not ctx.reserve_extra_request(self.hedge_max_extra):
+                    return None
+                # 额外请求不排队：服务商没有空闲并发额度时不发
+                if not target.concurrency.try_acquire():
+                    ctx.release_extra_request()
+                    return None
+                if on_status:
+                    on_status("hedging", {"attempt": attempt_no, "hedge": hedge_no, "provider": target.provider_name})
+                ctx.record_attempt()
+
+                def run() -> Tuple[bytes, str]:
+                    # 与 run_primary 相同，熔断器在外层：熔断时的 CircuitOpenError 不计入并发控制器的失败，
+                    # 只归还已取得的槽位
+                    guarded = False
+                    try:
+                        with target.breaker.guard():
+                            guarded = True
+                            with target.concurrency.slot(acquired=True):
+                                return target._timed_generate(prompt, reference, user_references), target.provider_name
+                    finally:
+                        if not guarded:
+                            target.concurrency.release()
+                return run
+            return next_hedge
+
+        def attempt_on(service: "ImageService") -> Tuple[bytes, str]:
+            hedge_after = service.latency.percentile(self.hedge_percentile) if self.hedge_enabled else None
+            if parallel <= 1 and hedge_after is None:
+                return run_primary(service)
+            started = threading.Event()
+            return hedged_call(
+                lambda: run_primary(service, started),
+                hedge_factory(service),
+                hedge_after=hedge_after,
+                parallel=parallel,
+                max_hedges=(parallel - 1) + (1 if hedge_after is not None else 0),
+                primary_started=started
+            )
+
+        def attempt() -> Tuple[bytes, str]:
+            nonlocal attempt_no
+            attempt_no += 1
+            if self.router is None:
+                return attempt_on(self)
+
+            candidates = self.router.candidates()
+            for position, service in enumerate(candidates):
+                try:
+                    result = attempt_on(service)
+                except Exception as e:
+                    if not should_failover(e) or position == len(candidates) - 1:
+                        raise
+                    next_service = candidates[position + 1]
+                    self.router.record_failover(service.provider_name)
+                    logger.warning(
+                        f"⚠️ 图片 [{index}] 在 {service.provider_name} 生成失败（{classify_error(e)}），"
+                        f"切换到 {next_service.provider_name}"
                     )
+                    if on_status:
+                        on_status("failover", {
+                            "attempt": attempt_no,
+                            "provider": service.provider_name,
+                            "next_provider": next_service.provider_name,
+                            "error_kind": classify_error(e)
+                        })
+                    continue
+                self.router.record_routed(result[1])
+                return result
+
+        def on_retry(failed_attempt: int, error: Exception, wait: float):
+            if on_status:
+                on_status("retrying", {
+                    "attempt": failed_attempt,
+                    "error_kind": classify_error(error),
+                    "retry_in": round(wait, 1)
+                })
+
+        attempts: List[Dict[str, Any]] = []
+        try:
+            return retry_call(
+                attempt,
+                policy=self.retry_policy,
+                on_retry=on_retry,
+                attempts=attempts,
+                label=f"图片 [{index}] 生成"
+            )
+        finally:
+            ctx.record_attempt_log(index, attempts)
 
-                # 保存图片（使用当前任务目录）
-                filename = f"{index}.png"
-                self._save_image(image_data, filename, self.current_task_dir)
-                logger.info(f"✅ 图片 [{index}] 生成成功: {filename}")
+    def _run_pages_concurrently(
+        self,
+        pages: List[Dict],
+        worker: Callable[[Dict, Callable[[str, Dict[str, Any]], None]], Tuple[int, bool, Optional[str], Optional[str]]]
+    ) -> Generator[Tuple[str, Dict, Any], None, None]:
+        """
+        并发执行多个页面的生成，并在当前线程中按发生顺序产出状态和结果
 
-                return (index, True, filename, None)
+        工作线程通过队列回传排队/开始生成的状态，调用方（SSE 生成器）可以实时转发
 
+        Args:
+            pages: 页面列表
+            worker: 工作函数 (page, on_status) -> (index, success, filename, error)
+
+        Yields:
+            ("status", page, (status, extra)) 或 ("result", page, result_tuple)
+        """
+        events: "queue.Queue[Tuple[str, Dict, Any]]" = queue.Queue()
+
+        def run(page: Dict):
+            def on_status(status: str, extra: Dict[str, Any]):
+                events.put(("status", page, (status, extra)))
+            try:
+                result = worker(page, on_status)
             except Exception as e:
-                error_msg = str(e)
-                logger.warning(f"图片 [{index}] 生成失败 (尝试 {attempt + 1}/{max_retries}): {error_msg[:200]}")
-
-                if attempt < max_retries - 1:
-                    # 等待后重试
-                    wait_time = 2 ** attempt
-                    logger.debug(f"  等待 {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
-                    continue
+                result = (page["index"], False, None, str(e))
+            events.put(("result", page, result))
 
-                logger.error(f"❌ 图片 [{index}] 生成失败，已达最大重试次数")
-                return (index, False, None, error_msg)
+        # 线程池按最大并发数创建，实际同时请求数由全局并发控制器决定
+        with ThreadPoolExecutor(max_workers=self.concurrency.max_limit) as executor:
+            for page in pages:
+                executor.submit(run, page)
 
-        return (index, False, None, "超过最大重试次数")
+            remaining = len(pages)
+            while remaining > 0:
+                item = events.get()
+                if item[0] == "result":
+                    remaining -= 1
+                yield item
 
     def generate_images(
         self,
@@ -251,32 +626,39 @@ class ImageService:
 
         logger.info(f"开始图片生成任务: task_id={task_id}, pages={len(pages)}")
 
-        # 创建任务专属目录
-        self.current_task_dir = os.path.join(self.history_root_dir, task_id)
-        os.makedirs(self.current_task_dir, exist_ok=True)
-        logger.debug(f"任务目录: {self.current_task_dir}")
+        # 压缩用户上传的参考图到200KB以内（减少内存和传输开销）
+        compressed_user_images = None
+        if user_images:
+            compressed_user_images = get_image_processor().compress_many(user_images, max_size_kb=200)
 
+        # 创建任务上下文和任务专属目录
+        ctx = TaskContext(
+            task_id,
+            os.path.join(self.history_root_dir, task_id),
+            pages=pages,
+            full_outline=full_outline,
+            user_topic=user_topic,
+            user_images=compressed_user_images
+        )
+        ctx.config_version = self.config_version
+        ctx.ensure_dir()
+        logger.debug(f"任务目录: {ctx.task_dir}")
+
+        # 生成期间钉住上下文，避免被移出内存
+        with self._task_states.hold(task_id):
+            self._task_states.put(ctx)
+            yield from self._generate_task_images(ctx)
+
+    def _generate_task_images(self, ctx: TaskContext) -> Generator[Dict[str, Any], None, None]:
+        """按任务上下文生成全部页面：先生成封面，然后并发生成其他页面"""
+        task_id = ctx.task_id
+        pages = ctx.pages
         total = len(pages)
         generated_images = []
         failed_pages = []
+        reused_indices = []
         cover_image_data = None
 
-        # 压缩用户上传的参考图到200KB以内（减少内存和传输开销）
-        compressed_user_images = None
-        if user_images:
-            compressed_user_images = [compress_image(img, max_size_kb=200) for img in user_images]
-
-        # 初始化任务状态
-        self._task_states[task_id] = {
-            "pages": pages,
-            "generated": {},
-            "failed": {},
-            "cover_image": None,
-            "full_outline": full_outline,
-            "user_images": compressed_user_images,
-            "user_topic": user_topic
-        }
-
         # ==================== 第一阶段：生成封面 ====================
         cover_page = None
         other_pages = []
@@ -292,7 +674,28 @@ class ImageService:
             cover_page = pages[0]
             other_pages = pages[1:]
 
-        if cover_page:
+        # 封面内容未变化时复用（页面清单中有相同生成输入的结果）
+        cover_filename = self._reuse_pages([cover_page], ctx, None).get(cover_page["index"]) if cover_page else None
+
+        if cover_filename:
+            generated_images.append(cover_filename)
+            reused_indices.append(cover_page["index"])
+            with open(os.path.join(ctx.task_dir, cover_filename), "rb") as f:
+                cover_image_data = get_image_processor().compress(f.read(), max_size_kb=200)
+            ctx.cover_image = cover_image_data
+
+            yield {
+                "event": "complete",
+                "data": {
+                    "index": cover_page["index"],
+                    "status": "done",
+                    "image_url": ctx.image_url(cover_filename),
+                    "provider": ctx.page_providers.get(cover_page["index"]),
+                    "phase": "cover",
+                    "reused": True
+                }
+            }
+        elif cover_page:
             # 发送封面生成进度
             yield {
                 "event": "progress",
@@ -307,36 +710,59 @@ class ImageService:
             }
 
             # 生成封面（使用用户上传的图片作为参考）
-            index, success, filename, error = self._generate_single_image(
-                cover_page, task_id, reference_image=None, full_outline=full_outline,
-                user_images=compressed_user_images, user_topic=user_topic
-            )
+            def cover_worker(page, on_status):
+                return self._generate_single_image(page, ctx, reference_image=None, on_status=on_status)
+
+            for kind, _, payload in self._run_pages_concurrently([cover_page], cover_worker):
+                if kind == "status":
+                    status, extra = payload
+                    if status in ("queued", "retrying"):
+                        # 封面需要排队等待全局并发额度、或失败后等待重试时通知前端
+                        if status == "queued":
+                            message = f"服务商繁忙，封面排队中（第 {extra['queue_position']} 位）..."
+                        else:
+                            message = f"封面生成失败，{extra['retry_in']:.0f} 秒后重试..."
+                        yield {
+                            "event": "progress",
+                            "data": {
+                                "index": cover_page["index"],
+                                "status": status,
+                                "message": message,
+                                "current": 1,
+                                "total": total,
+                                "phase": "cover",
+                                **extra
+                            }
+                        }
+                    continue
+                index, success, filename, error = payload
 
             if success:
                 generated_images.append(filename)
-                self._task_states[task_id]["generated"][index] = filename
+                ctx.mark_generated(index, filename)
 
                 # 读取封面图片作为参考，并立即压缩到200KB以内
-                cover_path = os.path.join(self.current_task_dir, filename)
+                cover_path = os.path.join(ctx.task_dir, filename)
                 with open(cover_path, "rb") as f:
                     cover_image_data = f.read()
 
                 # 压缩封面图（减少内存占用和后续传输开销）
-                cover_image_data = compress_image(cover_image_data, max_size_kb=200)
-                self._task_states[task_id]["cover_image"] = cover_image_data
+                cover_image_data = get_image_processor().compress(cover_image_data, max_size_kb=200)
+                ctx.cover_image = cover_image_data
 
                 yield {
                     "event": "complete",
                     "data": {
                         "index": index,
                         "status": "done",
-                        "image_url": f"/api/images/{task_id}/{filename}",
+                        "image_url": ctx.image_url(filename),
+                        "provider": ctx.page_providers.get(index),
                         "phase": "cover"
                     }
                 }
             else:
                 failed_pages.append(cover_page)
-                self._task_states[task_id]["failed"][index] = error
+                ctx.mark_failed(index, error)
 
                 yield {
                     "event": "error",
@@ -345,171 +771,117 @@ class ImageService:
                         "status": "error",
                         "message": error,
                         "retryable": True,
+                        "breaker": self.breaker.snapshot(),
                         "phase": "cover"
                     }
                 }
 
         # ==================== 第二阶段：生成其他页面 ====================
-        if other_pages:
-            # 检查是否启用高并发模式
-            high_concurrency = self.provider_config.get('high_concurrency', False)
-
-            if high_concurrency:
-                # 高并发模式：并行生成
-                yield {
-                    "event": "progress",
-                    "data": {
-                        "status": "batch_start",
-                        "message": f"开始并发生成 {len(other_pages)} 页内容...",
-                        "current": len(generated_images),
-                        "total": total,
-                        "phase": "content"
-                    }
+        # 内容和参考图（封面）都未变化的页面直接复用
+        pages_to_generate = []
+        content_reused = []
+        reusable = self._reuse_pages(other_pages, ctx, cover_image_data)
+        for page in other_pages:
+            filename = reusable.get(page["index"])
+            if filename is None:
+                pages_to_generate.append(page)
+                continue
+            generated_images.append(filename)
+            content_reused.append(page["index"])
+            yield {
+                "event": "complete",
+                "data": {
+                    "index": page["index"],
+                    "status": "done",
+                    "image_url": ctx.image_url(filename),
+                    "provider": ctx.page_providers.get(page["index"]),
+                    "phase": "content",
+                    "reused": True
                 }
+            }
+        reused_indices.extend(content_reused)
 
-                # 使用线程池并发生成
-                with ThreadPoolExecutor(max_workers=self.MAX_CONCURRENT) as executor:
-                    # 提交所有任务
-                    future_to_page = {
-                        executor.submit(
-                            self._generate_single_image,
-                            page,
-                            task_id,
-                            cover_image_data,  # 使用封面作为参考
-                            0,  # retry_count
-                            full_outline,  # 传入完整大纲
-                            compressed_user_images,  # 用户上传的参考图片（已压缩）
-                            user_topic  # 用户原始输入
-                        ): page
-                        for page in other_pages
-                    }
-
-                    # 发送每个页面的进度
-                    for page in other_pages:
-                        yield {
-                            "event": "progress",
-                            "data": {
-                                "index": page["index"],
-                                "status": "generating",
-                                "current": len(generated_images) + 1,
-                                "total": total,
-                                "phase": "content"
-                            }
-                        }
+        if reused_indices:
+            yield {
+                "event": "progress",
+                "data": {
+                    "status": "reused",
+                    "message": f"{len(reused_indices)} 页内容未变化，已复用之前的图片",
+                    "reused": reused_indices,
+                    "current": len(generated_images),
+                    "total": total
+                }
+            }
+        other_pages = pages_to_generate
 
-                    # 收集结果
-                    for future in as_completed(future_to_page):
-                        page = future_to_page[future]
-                        try:
-                            index, success, filename, error = future.result()
-
-                            if success:
-                                generated_images.append(filename)
-                                self._task_states[task_id]["generated"][index] = filename
-
-                                yield {
-                                    "event": "complete",
-                                    "data": {
-                                        "index": index,
-                                        "status": "done",
-                                        "image_url": f"/api/images/{task_id}/{filename}",
-                                        "phase": "content"
-                                    }
-                                }
-                            else:
-                                failed_pages.append(page)
-                                self._task_states[task_id]["failed"][index] = error
-
-                                yield {
-                                    "event": "error",
-                                    "data": {
-                                        "index": index,
-                                        "status": "error",
-                                        "message": error,
-                                        "retryable": True,
-                                        "phase": "content"
-                                    }
-                                }
-
-                        except Exception as e:
-                            failed_pages.append(page)
-                            error_msg = str(e)
-                            self._task_states[task_id]["failed"][page["index"]] = error_msg
-
-                            yield {
-                                "event": "error",
-                                "data": {
-                                    "index": page["index"],
-                                    "status": "error",
-                                    "message": error_msg,
-                                    "retryable": True,
-                                    "phase": "content"
-                                }
-                            }
-            else:
-                # 顺序模式：逐个生成
-                yield {
-                    "event": "progress",
-                    "data": {
-                        "status": "batch_start",
-                        "message": f"开始顺序生成 {len(other_pages)} 页内容...",
-                        "current": len(generated_images),
-                        "total": total,
-                        "phase": "content"
-                    }
+        if other_pages:
+            # 并发生成：线程池按最大并发数创建，实际同时请求数由自适应并发控制器决定
+            yield {
+                "event": "progress",
+                "data": {
+                    "status": "batch_start",
+                    "message": f"开始生成 {len(other_pages)} 页内容（当前并发上限 {self.concurrency.limit}）...",
+                    "current": len(generated_images),
+                    "total": total,
+                    "phase": "content",
+                    "concurrency_limit": self.concurrency.limit
                 }
+            }
 
-                for page in other_pages:
-                    # 发送生成进度
+            def content_worker(page, on_status):
+                return self._generate_single_image(
+                    page,
+                    ctx,
+                    cover_image_data,  # 使用封面作为参考
+                    on_status=on_status
+                )
+
+            for kind, page, payload in self._run_pages_concurrently(other_pages, content_worker):
+                if kind == "status":
+                    status, extra = payload
                     yield {
                         "event": "progress",
                         "data": {
                             "index": page["index"],
-                            "status": "generating",
+                            "status": status,
                             "current": len(generated_images) + 1,
                             "total": total,
-                            "phase": "content"
+                            "phase": "content",
+                            **extra
                         }
                     }
+                    continue
 
-                    # 生成单张图片
-                    index, success, filename, error = self._generate_single_image(
-                        page,
-                        task_id,
-                        cover_image_data,
-                        0,
-                        full_outline,
-                        compressed_user_images,
-                        user_topic
-                    )
-
-                    if success:
-                        generated_images.append(filename)
-                        self._task_states[task_id]["generated"][index] = filename
+                index, success, filename, error = payload
+                if success:
+                    generated_images.append(filename)
+                    ctx.mark_generated(index, filename)
 
-                        yield {
-                            "event": "complete",
-                            "data": {
-                                "index": index,
-                                "status": "done",
-                                "image_url": f"/api/images/{task_id}/{filename}",
-                                "phase": "content"
-                            }
+                    yield {
+                        "event": "complete",
+                        "data": {
+                            "index": index,
+                            "status": "done",
+                            "image_url": ctx.image_url(filename),
+                            "provider": ctx.page_providers.get(index),
+                            "phase": "content"
                         }
-                    else:
-                        failed_pages.append(page)
-                        self._task_states[task_id]["failed"][index] = error
+                    }
+                else:
+                    failed_pages.append(page)
+                    ctx.mark_failed(index, error)
 
-                        yield {
-                            "event": "error",
-                            "data": {
-                                "index": index,
-                                "status": "error",
-                                "message": error,
-                                "retryable": True,
-                                "phase": "content"
-                            }
+                    yield {
+                        "event": "error",
+                        "data": {
+                            "index": index,
+                            "status": "error",
+                            "message": error,
+                            "retryable": True,
+                            "breaker": self.breaker.snapshot(),
+                            "phase": "content"
                         }
+                    }
 
         # ==================== 完成 ====================
         yield {
@@ -521,7 +893,254 @@ class ImageService:
                 "total": total,
                 "completed": len(generated_images),
                 "failed": len(failed_pages),
-                "failed_indices": [p["index"] for p in failed_pages]
+                "failed_indices": [p["index"] for p in failed_pages],
+                "reused": reused_indices,
+                "config_version": self.config_version
+            }
+        }
+
+    def generate_images_from_outline(
+        self,
+        outline_events: Iterable[Dict[str, Any]],
+        task_id: str = None,
+        user_topic: str = "",
+        user_images: Optional[List[bytes]] = None
+    ) -> Generator[Dict[str, Any], None, None]:
+        """
+        流水线模式：边生成大纲边生成图片（生成器，支持 SSE 流式返回）
+
+        普通流程要等大纲全部生成、前端再调用 /generate 后才开始生成封面。这里直接消费大纲服务的
+        事件流：第一个页面闭合时立即开始生成封面，之后解析出的页面在封面完成后（需要封面作为参考图）
+        立即提交，大纲阶段和图片阶段重叠。
+
+        页面在大纲生成完之前提交时，提示词中的完整大纲为当时已生成的部分。
+        生成期间页面被用户修改（update_task_pages）时，生成结果作废并标记为需要重新生成。
+
+        Args:
+            outline_events: 大纲服务的事件流（OutlineService.generate_outline_stream）
+            task_id: 任务 ID（可选）
+            user_topic: 用户原始输入
+            user_images: 用户上传的参考图片列表（可选）
+
+        Yields:
+            进度事件字典：大纲事件加 outline_ 前缀（outline_text 只携带新增文本），
+            图片事件与 generate_images 相同（progress / complete / error / finish），
+            另有 page_invalidated（页面在生成期间被修改）
+        """
+        if task_id is None:
+            task_id = f"task_{uuid.uuid4().hex[:8]}"
+
+        logger.info(f"开始流水线图片生成任务: task_id={task_id}")
+
+        compressed_user_images = None
+        if user_images:
+            compressed_user_images = get_image_processor().compress_many(user_images, max_size_kb=200)
+
+        ctx = TaskContext(
+            task_id,
+            os.path.join(self.history_root_dir, task_id),
+            pages=[],
+            user_topic=user_topic,
+            user_images=compressed_user_images
+        )
+        ctx.config_version = self.config_version
+        ctx.ensure_dir()
+
+        with self._task_states.hold(task_id):
+            self._task_states.put(ctx)
+            yield from self._pipeline_task_images(ctx, outline_events)
+
+    def _pipeline_task_images(
+        self,
+        ctx: TaskContext,
+        outline_events: Iterable[Dict[str, Any]]
+    ) -> Generator[Dict[str, Any], None, None]:
+        """流水线模式的调度：大纲读取线程和页面生成线程的结果汇总到同一个队列，在当前线程中按顺序产出"""
+        events: "queue.Queue[Tuple[str, Optional[Dict], Any]]" = queue.Queue()
+
+        def read_outline():
+            try:
+                for event in outline_events:
+                    events.put(("outline", None, event))
+            except Exception as e:
+                events.put(("outline", None, {"event": "error", "data": {"error": str(e)}}))
+            finally:
+                events.put(("outline_end", None, None))
+
+        generated_images = []
+        failed_indices = []
+        cover_index: Optional[int] = None
+        cover_done = False
+        pending_pages: List[Dict] = []
+        outline_ok = False
+        outline_done = False
+        in_flight = 0
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency.max_limit)
+
+        def submit(page: Dict, reference_image: Optional[bytes]):
+            nonlocal in_flight
+            in_flight += 1
+
+            def run():
+                # 按提交时的最新内容生成，并记录输入哈希，用于发现生成期间的修改
+                used = ctx.get_page(page["index"]) or page
+                input_hash = page_input_hash(used)
+
+                def on_status(status: str, extra: Dict[str, Any]):
+                    events.put(("status", used, (status, extra)))
+                try:
+                    result = self._generate_single_image(used, ctx, reference_image, on_status=on_status)
+                except Exception as e:
+                    result = (used["index"], False, None, str(e))
+                events.put(("result", used, (result, input_hash)))
+
+            executor.submit(run)
+
+        def start_cover(page: Dict) -> Dict[str, Any]:
+            """提交封面，返回封面开始生成的进度事件"""
+            nonlocal cover_index
+            cover_index = page["index"]
+            submit(page, None)
+            return {
+                "event": "progress",
+                "data": {
+                    "index": cover_index,
+                    "status": "generating",
+                    "message": "正在生成封面...",
+                    "current": 1,
+                    "total": ctx.total,
+                    "phase": "cover"
+                }
+            }
+
+        threading.Thread(target=read_outline, name=f"outline-{ctx.task_id}", daemon=True).start()
+
+        try:
+            while not outline_done or in_flight > 0:
+                kind, page, payload = events.get()
+
+                if kind == "outline_end":
+                    outline_done = True
+                    if cover_index is None and pending_pages:
+                        # 大纲中没有封面页：与批量模式相同，第一页作为封面
+                        pending_pages.sort(key=lambda p: p["index"])
+                        yield start_cover(pending_pages.pop(0))
+                    continue
+
+                if kind == "outline":
+                    event, data = payload["event"], payload["data"]
+                    if event == "text":
+                        chunk = data.get("chunk", "")
+                        ctx.full_outline += chunk
+                        yield {"event": "outline_text", "data": {"chunk": chunk}}
+                        continue
+
+                    if event == "page":
+                        ctx.add_page(data)
+                        yield {"event": "outline_page", "data": data}
+
+                        if cover_index is None and data.get("type") == "cover":
+                            # 封面页（与批量模式相同按页面类型判断），立即开始生成
+                            yield start_cover(data)
+                        elif cover_done:
+                            submit(data, ctx.cover_image)
+                        else:
+                            # 内容页需要封面作为参考图，封面完成后提交；
+                            # 大纲结束仍没有封面页时，第一页作为封面
+                            pending_pages.append(data)
+                        continue
+
+                    if event == "complete":
+                        outline_ok = True
+                        ctx.full_outline = data.get("outline", ctx.full_outline)
+                    yield {"event": f"outline_{event}", "data": data}
+                    continue
+
+                phase = "cover" if page["index"] == cover_index else "content"
+
+                if kind == "status":
+                    status, extra = payload
+                    if phase == "cover" and status not in ("queued", "retrying"):
+                        # 封面开始生成的进度已在提交时发送
+                        continue
+                    yield {
+                        "event": "progress",
+                        "data": {
+                            "index": page["index"],
+                            "status": status,
+                            "current": len(generated_images) + 1,
+                            "total": ctx.total,
+                            "phase": phase,
+                            **extra
+                        }
+                    }
+                    continue
+
+                in_flight -= 1
+                (index, success, filename, error), input_hash = payload
+
+                if success and ctx.get_page(index) is not None and page_input_hash(ctx.get_page(index)) != input_hash:
+                    # 生成期间页面被修改，结果作废
+                    ctx.mark_failed(index, STALE_PAGE_ERROR)
+                    failed_indices.append(index)
+                    logger.info(f"图片 [{index}] 生成期间页面被修改，结果已作废")
+                    yield {
+                        "event": "page_invalidated",
+                        "data": {"index": index, "message": STALE_PAGE_ERROR, "phase": phase}
+                    }
+                elif success:
+                    generated_images.append(filename)
+                    ctx.mark_generated(index, filename)
+                    if phase == "cover":
+                        with open(os.path.join(ctx.task_dir, filename), "rb") as f:
+                            ctx.cover_image = get_image_processor().compress(f.read(), max_size_kb=200)
+                    yield {
+                        "event": "complete",
+                        "data": {
+                            "index": index,
+                            "status": "done",
+                            "image_url": ctx.image_url(filename),
+                            "provider": ctx.page_providers.get(index),
+                            "phase": phase
+                        }
+                    }
+                else:
+                    failed_indices.append(index)
+                    ctx.mark_failed(index, error)
+                    yield {
+                        "event": "error",
+                        "data": {
+                            "index": index,
+                            "status": "error",
+                            "message": error,
+                            "retryable": True,
+                            "breaker": self.breaker.snapshot(),
+                            "phase": phase
+                        }
+                    }
+
+                if phase == "cover":
+                    # 封面完成（失败时内容页不使用参考图），提交等待中的内容页
+                    cover_done = True
+                    for pending in pending_pages:
+                        submit(pending, ctx.cover_image)
+                    pending_pages = []
+        finally:
+            executor.shutdown(wait=False)
+
+        yield {
+            "event": "finish",
+            "data": {
+                "success": outline_ok and not failed_indices,
+                "task_id": ctx.task_id,
+                "images": generated_images,
+                "total": ctx.total,
+                "completed": len(generated_images),
+                "failed": len(failed_indices),
+                "failed_indices": failed_indices,
+                "outline_success": outline_ok,
+                "config_version": self.config_version
             }
         }
 
@@ -546,60 +1165,41 @@ class ImageService:
         Returns:
             生成结果
         """
-        self.current_task_dir = os.path.join(self.history_root_dir, task_id)
-        os.makedirs(self.current_task_dir, exist_ok=True)
-
-        reference_image = None
-        user_images = None
-
-        # 首先尝试从任务状态中获取上下文
-        if task_id in self._task_states:
-            task_state = self._task_states[task_id]
-            if use_reference:
-                reference_image = task_state.get("cover_image")
-            # 如果没有传入上下文，则使用任务状态中的
-            if not full_outline:
-                full_outline = task_state.get("full_outline", "")
-            if not user_topic:
-                user_topic = task_state.get("user_topic", "")
-            user_images = task_state.get("user_images")
-
-        # 如果任务状态中没有封面图，尝试从文件系统加载
-        if use_reference and reference_image is None:
-            cover_path = os.path.join(self.current_task_dir, "0.png")
-            if os.path.exists(cover_path):
-                with open(cover_path, "rb") as f:
-                    cover_data = f.read()
-                # 压缩封面图到 200KB
-                reference_image = compress_image(cover_data, max_size_kb=200)
+        # 重试期间钉住上下文，避免被移出内存
+        with self._task_states.hold(task_id):
+            ctx = self._get_or_create_context(task_id, full_outline, user_topic)
 
-        index, success, filename, error = self._generate_single_image(
-            page,
-            task_id,
-            reference_image,
-            0,
-            full_outline,
-            user_images,
-            user_topic
-        )
+            reference_image = ctx.cover_image if use_reference else None
 
-        if success:
-            if task_id in self._task_states:
-                self._task_states[task_id]["generated"][index] = filename
-                if index in self._task_states[task_id]["failed"]:
-                    del self._task_states[task_id]["failed"][index]
+            # 如果任务状态中没有封面图，尝试从文件系统加载
+            if use_reference and reference_image is None:
+                reference_image = self._load_cover_reference(ctx)
+
+            index, success, filename, error = self._generate_single_image(
+                page,
+                ctx,
+                reference_image
+            )
 
+            if success:
+                ctx.mark_generated(index, filename)
+            else:
+                ctx.mark_failed(index, error)
+
+        if success:
             return {
                 "success": True,
                 "index": index,
-                "image_url": f"/api/images/{task_id}/{filename}"
+                "image_url": ctx.image_url(filename),
+                "provider": ctx.page_providers.get(index)
             }
         else:
             return {
                 "success": False,
                 "index": index,
                 "error": error,
-                "retryable": True
+                "retryable": True,
+                "breaker": self.breaker.snapshot()
             }
 
     def retry_failed_images(
@@ -617,10 +1217,17 @@ class ImageService:
         Yields:
             进度事件
         """
+        # 重试期间钉住上下文，避免被移出内存
+        with self._task_states.hold(task_id):
+            ctx = self._get_or_create_context(task_id)
+            yield from self._retry_task_images(ctx, pages)
+
+    def _retry_task_images(self, ctx: TaskContext, pages: List[Dict]) -> Generator[Dict[str, Any], None, None]:
+        """按任务上下文并发重试指定页面"""
         # 获取参考图
-        reference_image = None
-        if task_id in self._task_states:
-            reference_image = self._task_states[task_id].get("cover_image")
+        reference_image = ctx.cover_image
+        if reference_image is None:
+            reference_image = self._load_cover_reference(ctx)
 
         total = len(pages)
         success_count = 0
@@ -634,68 +1241,55 @@ class ImageService:
             }
         }
 
-        # 并发重试
-        # 从任务状态中获取完整大纲
-        full_outline = ""
-        if task_id in self._task_states:
-            full_outline = self._task_states[task_id].get("full_outline", "")
-
-        with ThreadPoolExecutor(max_workers=self.MAX_CONCURRENT) as executor:
-            future_to_page = {
-                executor.submit(
-                    self._generate_single_image,
-                    page,
-                    task_id,
-                    reference_image,
-                    0,  # retry_count
-                    full_outline  # 传入完整大纲
-                ): page
-                for page in pages
-            }
-
-            for future in as_completed(future_to_page):
-                page = future_to_page[future]
-                try:
-                    index, success, filename, error = future.result()
+        # 并发重试（大纲、用户输入和用户参考图都来自任务上下文）
+        def retry_worker(page, on_status):
+            return self._generate_single_image(
+                page,
+                ctx,
+                reference_image,
+                on_status=on_status
+            )
 
-                    if success:
-                        success_count += 1
-                        if task_id in self._task_states:
-                            self._task_states[task_id]["generated"][index] = filename
-                            if index in self._task_states[task_id]["failed"]:
-                                del self._task_states[task_id]["failed"][index]
+        for kind, page, payload in self._run_pages_concurrently(pages, retry_worker):
+            if kind == "status":
+                status, extra = payload
+                yield {
+                    "event": "progress",
+                    "data": {
+                        "index": page["index"],
+                        "status": status,
+                        **extra
+                    }
+                }
+                continue
 
-                        yield {
-                            "event": "complete",
-                            "data": {
-                                "index": index,
-                                "status": "done",
-                                "image_url": f"/api/images/{task_id}/{filename}"
-                            }
-                        }
-                    else:
-                        failed_count += 1
-                        yield {
-                            "event": "error",
-                            "data": {
-                                "index": index,
-                                "status": "error",
-                                "message": error,
-                                "retryable": True
-                            }
-                        }
+            index, success, filename, error = payload
+            if success:
+                success_count += 1
+                ctx.mark_generated(index, filename)
 
-                except Exception as e:
-                    failed_count += 1
-                    yield {
-                        "event": "error",
-                        "data": {
-                            "index": page["index"],
-                            "status": "error",
-                            "message": str(e),
-                            "retryable": True
-                        }
+                yield {
+                    "event": "complete",
+                    "data": {
+                        "index": index,
+                        "status": "done",
+                        "image_url": ctx.image_url(filename),
+                        "provider": ctx.page_providers.get(index)
+                    }
+                }
+            else:
+                failed_count += 1
+                ctx.mark_failed(index, error)
+                yield {
+                    "event": "error",
+                    "data": {
+                        "index": index,
+                        "status": "error",
+                        "message": error,
+                        "retryable": True,
+                        "breaker": self.breaker.snapshot()
                     }
+                }
 
         yield {
             "event": "retry_finish",
@@ -748,27 +1342,109 @@ class ImageService:
         task_dir = os.path.join(self.history_root_dir, task_id)
         return os.path.join(task_dir, filename)
 
-    def get_task_state(self, task_id: str) -> Optional[Dict]:
-        """获取任务状态"""
+    def _get_or_create_context(
+        self,
+        task_id: str,
+        full_outline: str = "",
+        user_topic: str = ""
+    ) -> TaskContext:
+        """
+        获取任务上下文，不存在时（如服务重启后重试）按任务目录新建
+
+        Args:
+            task_id: 任务ID
+            full_outline: 完整大纲文本（非空时覆盖上下文中的值）
+            user_topic: 用户原始输入（非空时覆盖上下文中的值）
+
+        Returns:
+            任务上下文
+        """
+        ctx = self._task_states.get(task_id)
+        if ctx is None:
+            ctx = TaskContext(task_id, os.path.join(self.history_root_dir, task_id))
+            self._task_states.put(ctx)
+
+        if full_outline:
+            ctx.full_outline = full_outline
+        if user_topic:
+            ctx.user_topic = user_topic
+
+        # 任务状态与配置版本无关：配置更新后的重试接回原任务状态，按当前配置生成
+        if ctx.config_version is not None and ctx.config_version != self.config_version:
+            logger.info(
+                f"任务 {task_id} 创建于配置版本 {ctx.config_version}，"
+                f"本次重试使用配置版本 {self.config_version}"
+            )
+        ctx.config_version = self.config_version
+
+        ctx.ensure_dir()
+        return ctx
+
+    def _load_cover_reference(self, ctx: TaskContext) -> Optional[bytes]:
+        """从任务目录加载封面图作为参考（压缩到200KB），并缓存到上下文"""
+        cover_path = os.path.join(ctx.task_dir, "0.png")
+        if not os.path.exists(cover_path):
+            return None
+
+        with open(cover_path, "rb") as f:
+            cover_data = f.read()
+        ctx.cover_image = get_image_processor().compress(cover_data, max_size_kb=200)
+        return ctx.cover_image
+
+    def update_task_pages(self, task_id: str, pages: List[Dict]) -> Optional[List[int]]:
+        """
+        用户编辑页面后同步到任务上下文，已生成但内容有变化的页面标记为需要重新生成
+
+        Args:
+            task_id: 任务ID
+            pages: 编辑后的页面列表
+
+        Returns:
+            图片已失效的页码；任务不存在时返回 None
+        """
+        with self._task_states.hold(task_id):
+            ctx = self._task_states.get(task_id)
+            if ctx is None:
+                return None
+            invalidated = ctx.update_pages(pages)
+
+        if invalidated:
+            logger.info(f"任务 {task_id} 的页面 {invalidated} 内容已修改，图片需要重新生成")
+        return invalidated
+
+    def get_task_state(self, task_id: str) -> Optional[TaskContext]:
+        """获取任务上下文"""
         return self._task_states.get(task_id)
 
+    def get_concurrency_state(self) -> Dict[str, Any]:
+        """获取当前服务商的并发控制状态"""
+        return self.concurrency.snapshot()
+
     def cleanup_task(self, task_id: str):
         """清理任务状态（释放内存）"""
-        if task_id in self._task_states:
-            del self._task_states[task_id]
+        self._task_states.discard(task_id)
 
 
-# 全局服务实例
+# 全局服务实例（绑定创建时的配置版本）
 _service_instance = None
+_service_lock = threading.Lock()
 
 def get_image_service() -> ImageService:
-    """获取全局图片生成服务实例"""
+    """
+    获取全局图片生成服务实例
+
+    配置文件变化后按新版本配置创建新实例；旧实例不会被修改，
+    正在运行的任务持有旧实例，在原配置下完成
+    """
     global _service_instance
-    if _service_instance is None:
-        _service_instance = ImageService()
-    return _service_instance
+    snapshot = Config.current()
+    with _service_lock:
+        if _service_instance is None or _service_instance.config_version != snapshot.version:
+            _service_instance = ImageService(snapshot=snapshot)
+        return _service_instance
 
 def reset_image_service():
-    """重置全局服务实例（配置更新后调用）"""
+    """重置全局服务实例（下次获取时按最新配置重新创建）"""
     global _service_instance
-    _service_instance = None
+    with _service_lock:
+        _service_instance = None
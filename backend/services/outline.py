@@ -1,11 +1,13 @@
 import logging
 import os
-import re
 import base64
 import yaml
 from pathlib import Path
 from typing import Dict, List, Any, Optional, Generator
 from backend.utils.text_client import get_text_chat_client
+from backend.utils.key_pool import provider_api_keys
+from backend.utils.service_registry import get_service_registry, text_service_fingerprint
+from backend.utils.outline_parser import IncrementalOutlineParser, parse_outline
 
 logger = logging.getLogger(__name__)
 
@@ -76,7 +78,7 @@ class OutlineService:
 
         provider_config = providers.get(active_provider, {})
 
-        if not provider_config.get('api_key'):
+        if not provider_api_keys(provider_config):
             logger.error(f"文本服务商 [{active_provider}] 未配置 API Key")
             raise ValueError(
                 f"文本服务商 {active_provider} 未配置 API Key\n"
@@ -84,7 +86,7 @@ class OutlineService:
             )
 
         logger.info(f"使用文本服务商: {active_provider} (type={provider_config.get('type')})")
-        return get_text_chat_client(provider_config)
+        return get_text_chat_client(provider_config, active_provider)
 
     def _load_prompt_template(self) -> str:
         prompt_path = os.path.join(
@@ -95,40 +97,6 @@ class OutlineService:
         with open(prompt_path, "r", encoding="utf-8") as f:
             return f.read()
 
-    def _parse_outline(self, outline_text: str) -> List[Dict[str, Any]]:
-        # 按 <page> 分割页面（兼容旧的 --- 分隔符）
-        if '<page>' in outline_text:
-            pages_raw = re.split(r'<page>', outline_text, flags=re.IGNORECASE)
-        else:
-            # 向后兼容：如果没有 <page> 则使用 ---
-            pages_raw = outline_text.split("---")
-
-        pages = []
-
-        for index, page_text in enumerate(pages_raw):
-            page_text = page_text.strip()
-            if not page_text:
-                continue
-
-            page_type = "content"
-            type_match = re.match(r"\[(\S+)\]", page_text)
-            if type_match:
-                type_cn = type_match.group(1)
-                type_mapping = {
-                    "封面": "cover",
-                    "内容": "content",
-                    "总结": "summary",
-                }
-                page_type = type_mapping.get(type_cn, "content")
-
-            pages.append({
-                "index": index,
-                "type": page_type,
-                "content": page_text
-            })
-
-        return pages
-
     def generate_outline(
         self,
         topic: str,
@@ -192,7 +160,7 @@ class OutlineService:
             )
 
             logger.debug(f"API 返回文本长度: {len(outline_text)} 字符")
-            pages = self._parse_outline(outline_text)
+            pages = parse_outline(outline_text)
             logger.info(f"大纲解析完成，共 {len(pages)} 页")
 
             return {
@@ -366,8 +334,9 @@ class OutlineService:
                 stream=True  # 启用流式
             )
 
-            # 累积文本
+            # 累积文本，每个页面闭合时立即解析
             accumulated_text = ""
+            parser = IncrementalOutlineParser()
 
             for chunk in stream_generator:
                 accumulated_text += chunk
@@ -381,10 +350,16 @@ class OutlineService:
                     }
                 }
 
+                # 发送已完整的页面
+                for page in parser.feed(chunk):
+                    yield {"event": "page", "data": page}
+
             logger.debug(f"流式API返回文本长度: {len(accumulated_text)} 字符")
 
-            # 生成完成后解析页面
-            pages = self._parse_outline(accumulated_text)
+            # 最后一页在流结束时闭合
+            for page in parser.finish():
+                yield {"event": "page", "data": page}
+            pages = parser.pages
             logger.info(f"流式大纲生成完成，共 {len(pages)} 页")
 
             # 发送完成事件
@@ -403,11 +378,12 @@ class OutlineService:
             error_msg = str(e)
             logger.error(f"流式大纲生成失败: {error_msg}")
 
-            # 发送错误事件
+            # 发送错误事件（附带服务商熔断状态）
             yield {
                 "event": "error",
                 "data": {
-                    "error": error_msg
+                    "error": error_msg,
+                    "breaker": self.client.breaker.snapshot()
                 }
             }
 
@@ -415,6 +391,10 @@ class OutlineService:
 def get_outline_service() -> OutlineService:
     """
     获取大纲生成服务实例
-    每次调用都创建新实例以确保配置是最新的
+    按配置指纹缓存：文本服务商配置或提示词模板变化后自动重建
     """
-    return OutlineService()
+    return get_service_registry().get_or_create(
+        "outline",
+        text_service_fingerprint(["outline_prompt2.txt"]),
+        OutlineService
+    )
@@ -2,15 +2,21 @@
 大纲修改服务
 
 提供AI辅助修改大纲功能，支持流式输出
+- rewrite 模式：模型输出修改后的完整大纲
+- patch 模式：模型只输出受影响页面的补丁，输出长度和耗时随修改范围而不是大纲长度增长
 """
 
 import logging
 import os
-import re
 import yaml
 from pathlib import Path
 from typing import Dict, List, Any, Optional, Generator
 from backend.utils.text_client import get_text_chat_client
+from backend.utils.key_pool import provider_api_keys
+from backend.utils.service_registry import get_service_registry, text_service_fingerprint
+from backend.utils.outline_parser import (
+    IncrementalOutlineParser, IncrementalPatchParser, apply_outline_patches, parse_outline
+)
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +27,7 @@ class OutlineModifyService:
         self.text_config = self._load_text_config()
         self.client = self._get_client()
         self.modify_prompt_template = self._load_modify_prompt_template()
+        self.patch_prompt_template = self._load_patch_prompt_template()
         logger.info(f"OutlineModifyService 初始化完成，使用服务商: {self.text_config.get('active_provider')}")
 
     def _load_text_config(self) -> dict:
@@ -81,7 +88,7 @@ class OutlineModifyService:
 
         provider_config = providers.get(active_provider, {})
 
-        if not provider_config.get('api_key'):
+        if not provider_api_keys(provider_config):
             logger.error(f"文本服务商 [{active_provider}] 未配置 API Key")
             raise ValueError(
                 f"文本服务商 {active_provider} 未配置 API Key\n"
@@ -89,7 +96,7 @@ class OutlineModifyService:
             )
 
         logger.info(f"使用文本服务商: {active_provider} (type={provider_config.get('type')})")
-        return get_text_chat_client(provider_config)
+        return get_text_chat_client(provider_config, active_provider)
 
     def _load_modify_prompt_template(self) -> str:
         """加载修改提示词模板"""
@@ -118,48 +125,33 @@ class OutlineModifyService:
 请直接输出修改后的大纲，使用 <page> 标签分割页面。
 """
 
-    def _parse_outline(self, outline_text: str) -> List[Dict[str, Any]]:
-        """
-        解析大纲文本为页面列表（复用OutlineService的_parse_outline方法）
+    def _load_patch_prompt_template(self) -> str:
+        """加载补丁模式提示词模板"""
+        prompt_path = os.path.join(
+            os.path.dirname(os.path.dirname(__file__)),
+            "prompts",
+            "outline_patch_prompt.txt"
+        )
+        try:
+            with open(prompt_path, "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            logger.error(f"补丁模式提示词模板不存在: {prompt_path}")
+            # 返回备用提示词
+            return """你是一个小红书内容优化专家。请根据指令只修改受影响的页面。
 
-        Args:
-            outline_text: 大纲文本
+【原始主题】
+{topic}
 
-        Returns:
-            页面列表
-        """
-        # 按 <page> 分割页面（兼容旧的 --- 分隔符）
-        if '<page>' in outline_text:
-            pages_raw = re.split(r'<page>', outline_text, flags=re.IGNORECASE)
-        else:
-            # 向后兼容：如果没有 <page> 则使用 ---
-            pages_raw = outline_text.split("---")
-
-        pages = []
-
-        for index, page_text in enumerate(pages_raw):
-            page_text = page_text.strip()
-            if not page_text:
-                continue
-
-            page_type = "content"
-            type_match = re.match(r"\[(\S+)\]", page_text)
-            if type_match:
-                type_cn = type_match.group(1)
-                type_mapping = {
-                    "封面": "cover",
-                    "内容": "content",
-                    "总结": "summary",
-                }
-                page_type = type_mapping.get(type_cn, "content")
+【当前大纲】（共 {page_count} 页）
+{numbered_outline}
 
-            pages.append({
-                "index": index,
-                "type": page_type,
-                "content": page_text
-            })
+【用户修改指令】
+{instruction}
 
-        return pages
+只输出需要变化的页面：修改第 N 页用 <patch op="replace" page="N">新内容</patch>，
+删除用 <patch op="delete" page="N"></patch>，在第 N 页后插入用 <patch op="insert" after="N">新内容</patch>。
+"""
 
     def _generate_modify_summary(self, original_pages: List[Dict], modified_pages: List[Dict], instruction: str) -> str:
         """
@@ -184,11 +176,30 @@ class OutlineModifyService:
         else:
             return f"保持 {original_count} 页，优化了内容"
 
+    def _generate_patch_summary(self, patches: List[Dict[str, Any]]) -> str:
+        """
+        生成补丁模式的修改摘要
+
+        Args:
+            patches: 补丁列表
+
+        Returns:
+            修改摘要文本
+        """
+        labels = {"replace": "修改", "insert": "新增", "delete": "删除"}
+        parts = []
+        for op, label in labels.items():
+            count = sum(1 for patch in patches if patch["op"] == op)
+            if count:
+                parts.append(f"{label} {count} 页")
+        return "，".join(parts) if parts else "未修改任何页面"
+
     def modify_outline_stream(
         self,
         topic: str,
         current_outline: Dict[str, Any],
-        instruction: str
+        instruction: str,
+        mode: str = "rewrite"
     ) -> Generator[Dict[str, Any], None, None]:
         """
         流式修改大纲
@@ -197,10 +208,11 @@ class OutlineModifyService:
             topic: 原始主题
             current_outline: 当前大纲 {raw: str, pages: []}
             instruction: 用户修改指令
+            mode: rewrite（输出完整大纲）或 patch（只输出受影响页面的补丁）
 
         Yields:
             SSE事件字典
-            - event: "progress" | "text" | "complete" | "error"
+            - event: "progress" | "text" | "page" | "patch" | "complete" | "error"
             - data: 事件数据
         """
         try:
@@ -228,6 +240,10 @@ class OutlineModifyService:
                 }
                 return
 
+            if mode == "patch":
+                yield from self._patch_outline_stream(topic, current_outline_text, current_pages, instruction)
+                return
+
             # 构建修改提示词
             prompt = self.modify_prompt_template.format(
                 topic=topic,
@@ -267,8 +283,9 @@ class OutlineModifyService:
                 stream=True  # 启用流式
             )
 
-            # 累积文本
+            # 累积文本，每个页面闭合时立即解析
             accumulated_text = ""
+            parser = IncrementalOutlineParser()
 
             for chunk in stream_generator:
                 accumulated_text += chunk
@@ -282,10 +299,16 @@ class OutlineModifyService:
                     }
                 }
 
+                # 发送已完整的页面
+                for page in parser.feed(chunk):
+                    yield {"event": "page", "data": page}
+
             logger.debug(f"流式修改API返回文本长度: {len(accumulated_text)} 字符")
 
-            # 生成完成后解析页面
-            modified_pages = self._parse_outline(accumulated_text)
+            # 最后一页在流结束时闭合
+            for page in parser.finish():
+                yield {"event": "page", "data": page}
+            modified_pages = parser.pages
             logger.info(f"流式大纲修改完成，共 {len(modified_pages)} 页")
 
             # 生成修改摘要
@@ -305,14 +328,105 @@ class OutlineModifyService:
             error_msg = str(e)
             logger.error(f"流式大纲修改失败: {error_msg}")
 
-            # 发送错误事件
+            # 发送错误事件（附带服务商熔断状态）
             yield {
                 "event": "error",
                 "data": {
-                    "error": error_msg
+                    "error": error_msg,
+                    "breaker": self.client.breaker.snapshot()
                 }
             }
 
+    def _patch_outline_stream(
+        self,
+        topic: str,
+        current_outline_text: str,
+        current_pages: List[Dict[str, Any]],
+        instruction: str
+    ) -> Generator[Dict[str, Any], None, None]:
+        """
+        补丁模式修改大纲：模型只输出受影响页面的补丁，每个补丁闭合时立即发送 patch 事件，
+        结束后把补丁应用到原页面列表
+
+        Args:
+            topic: 原始主题
+            current_outline_text: 当前大纲文本
+            current_pages: 当前页面列表（为空时从大纲文本解析）
+            instruction: 用户修改指令
+
+        Yields:
+            SSE事件字典（progress / patch / complete）
+        """
+        pages = current_pages or parse_outline(current_outline_text)
+        numbered_outline = "\n\n".join(
+            f"【第{position}页】\n{page.get('content', '').strip()}"
+            for position, page in enumerate(pages, start=1)
+        )
+        prompt = self.patch_prompt_template.format(
+            topic=topic,
+            page_count=len(pages),
+            numbered_outline=numbered_outline,
+            instruction=instruction
+        )
+
+        active_provider = self.text_config.get('active_provider', 'google_gemini')
+        provider_config = self.text_config.get('providers', {}).get(active_provider, {})
+
+        model = provider_config.get('model', 'gemini-2.0-flash-exp')
+        temperature = provider_config.get('temperature', 1.0)
+        max_output_tokens = provider_config.get('max_output_tokens', 8000)
+
+        logger.info(f"调用流式文本修改 API（补丁模式）: model={model}, pages={len(pages)}")
+
+        yield {
+            "event": "progress",
+            "data": {
+                "status": "starting",
+                "message": "正在分析修改指令..."
+            }
+        }
+
+        stream_generator = self.client.generate_text(
+            prompt=prompt,
+            model=model,
+            temperature=temperature,
+            max_output_tokens=max_output_tokens,
+            images=None,
+            stream=True
+        )
+
+        parser = IncrementalPatchParser()
+        for chunk in stream_generator:
+            for patch in parser.feed(chunk):
+                yield {"event": "patch", "data": patch}
+
+        if not parser.patches and '<page>' in parser.text:
+            # 模型没有按补丁格式输出，而是输出了完整大纲：按整体重写处理
+            logger.warning("补丁模式未解析到补丁，按完整大纲处理")
+            modified_pages = parse_outline(parser.text)
+            outline_text = parser.text
+            summary = self._generate_modify_summary(pages, modified_pages, instruction)
+        else:
+            modified_pages = apply_outline_patches(pages, parser.patches)
+            outline_text = "\n\n<page>\n\n".join(page["content"] for page in modified_pages)
+            summary = self._generate_patch_summary(parser.patches)
+
+        logger.info(
+            f"补丁模式修改完成: {len(parser.patches)} 个补丁，模型输出 {len(parser.text)} 字符"
+            f"（原大纲 {len(current_outline_text)} 字符），共 {len(modified_pages)} 页"
+        )
+
+        yield {
+            "event": "complete",
+            "data": {
+                "outline": outline_text,
+                "pages": modified_pages,
+                "summary": summary,
+                "mode": "patch",
+                "patches": parser.patches
+            }
+        }
+
     def _reconstruct_raw_from_pages(self, pages: list) -> str:
         """
         从 pages 数组重建 raw 文本
@@ -348,6 +462,10 @@ class OutlineModifyService:
 def get_outline_modify_service() -> OutlineModifyService:
     """
     获取大纲修改服务实例
-    每次调用都创建新实例以确保配置是最新的
+    按配置指纹缓存：文本服务商配置或提示词模板变化后自动重建
     """
-    return OutlineModifyService()
+    return get_service_registry().get_or_create(
+        "outline_modify",
+        text_service_fingerprint(["outline_modify_prompt.txt", "outline_patch_prompt.txt"]),
+        OutlineModifyService
+    )
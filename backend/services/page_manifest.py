@@ -0,0 +1,131 @@
+"""
+任务页面清单
+
+编辑大纲后重新生成时，原来会把封面和未修改的页面全部重新生成一遍。任务目录下的 manifest.json
+记录每页"生成输入的哈希 -> 生成结果"：
+- 生成输入包括页面类型和内容、用户原始输入、提示词模式、用户参考图、参考图（封面），
+  以及生成参数（服务商类型、模型、尺寸/比例、温度等生成器参数、上下文预算、当前模板内容的摘要）
+- 完整大纲文本不计入：编辑任意一页都会改变完整大纲，计入后所有页面都会被判定为已修改
+- 重新生成时输入哈希相同、且图片文件内容与记录一致的页面直接复用（页码变化时复制到新页码）
+- 封面重新生成后，内容页的参考图随之变化，内容页也会重新生成
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+from backend.utils.fs import write_file_atomic
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "manifest.json"
+
+
+def _digest(data: Optional[bytes]) -> Optional[str]:
+    return hashlib.sha1(data).hexdigest() if data is not None else None
+
+
+def page_inputs_hash(
+    page: Dict[str, Any],
+    user_topic: str,
+    prompt_mode: str,
+    user_images: Optional[List[bytes]] = None,
+    reference_image: Optional[bytes] = None,
+    generation: Optional[Dict[str, Any]] = None
+) -> str:
+    """
+    页面生成输入的哈希
+
+    Args:
+        page: 页面数据
+        user_topic: 用户原始输入
+        prompt_mode: 提示词模式
+        user_images: 用户参考图（已压缩）
+        reference_image: 参考图（封面，已压缩）
+        generation: 生成参数（服务商类型、生成器参数、上下文预算、模板摘要等，不含参考图）
+
+    Returns:
+        哈希值
+    """
+    raw = json.dumps({
+        "type": page.get("type"),
+        "content": page.get("content"),
+        "user_topic": user_topic,
+        "prompt_mode": prompt_mode,
+        "user_images": [_digest(image) for image in user_images or []],
+        "reference": _digest(reference_image),
+        "generation": generation or {}
+    }, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class PageManifest:
+    """任务目录下的页面清单：页码 -> {inputs_hash, filename, image_hash}"""
+
+    def __init__(self, task_dir: str):
+        self.path = os.path.join(task_dir, MANIFEST_FILENAME)
+        self._lock = threading.Lock()
+        self._pages: Dict[int, Dict[str, Any]] = self._load()
+
+    def _load(self) -> Dict[int, Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            # JSON 的键都是字符串，还原为页码
+            return {int(k): v for k, v in data.get("pages", {}).items()}
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"⚠️ 读取页面清单失败，全部页面重新生成: {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        """调用方持有锁"""
+        data = json.dumps({"pages": self._pages}, ensure_ascii=False, indent=2).encode("utf-8")
+        try:
+            write_file_atomic(self.path, data)
+        except OSError as e:
+            logger.warning(f"⚠️ 写入页面清单失败: {self.path}: {e}")
+
+    def record(self, index: int, inputs_hash: str, filename: str, image_data: bytes):
+        """记录页面的生成结果"""
+        with self._lock:
+            self._pages[index] = {
+                "inputs_hash": inputs_hash,
+                "filename": filename,
+                "image_hash": _digest(image_data)
+            }
+            self._save()
+
+    def find(self, index: int, inputs_hash: str) -> Optional[str]:
+        """
+        查找输入哈希相同、且图片文件未被改动的生成结果（优先同一页码）
+
+        Args:
+            index: 页码
+            inputs_hash: 生成输入的哈希
+
+        Returns:
+            可复用的图片文件路径，没有时返回 None
+        """
+        with self._lock:
+            candidates = sorted(
+                (i for i, entry in self._pages.items() if entry.get("inputs_hash") == inputs_hash),
+                key=lambda i: i != index
+            )
+            entries = [self._pages[i] for i in candidates]
+
+        task_dir = os.path.dirname(self.path)
+        for entry in entries:
+            path = os.path.join(task_dir, entry["filename"])
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                continue
+            # 文件可能已被其他页面的生成结果覆盖
+            if _digest(data) == entry.get("image_hash"):
+                return path
+        return None
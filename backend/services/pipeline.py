@@ -0,0 +1,375 @@
+"""
+内容生成流水线
+
+前端原来把大纲、文案、图片、历史记录作为用户依次触发的独立步骤，而文案和图片都只依赖完成的大纲。
+这里用一个按依赖关系调度的流水线引擎在后台一次完成：
+- 阶段声明依赖，依赖全部完成的阶段立即开始，互不依赖的阶段（文案、图片）并发执行
+- 阶段输出按"阶段名 + 参数 + 依赖阶段输出"的哈希缓存在任务目录（pipeline_stages.json），
+  同一任务重新运行时输入未变化的阶段直接复用上次的输出
+- 所有阶段的事件汇总到同一个事件流，事件数据带 stage 字段
+"""
+import hashlib
+import json
+import logging
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Generator, Iterable, List, Optional, Tuple
+
+from backend.utils.fs import write_file_atomic
+from backend.utils.service_registry import config_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# 阶段函数：(依赖阶段的输出, 事件回调) -> 本阶段输出（需可 JSON 序列化）
+StageFunc = Callable[[Dict[str, Any], Callable[[str, Dict[str, Any]], None]], Any]
+
+
+class PipelineStage:
+    """流水线阶段"""
+
+    def __init__(
+        self,
+        name: str,
+        run: StageFunc,
+        depends_on: Iterable[str] = (),
+        params: Optional[Dict[str, Any]] = None,
+        cache: bool = True,
+        cache_if: Optional[Callable[[Any], bool]] = None,
+        required: bool = True
+    ):
+        """
+        Args:
+            name: 阶段名称
+            run: 阶段函数
+            depends_on: 依赖的阶段名称
+            params: 影响输出的参数（参与缓存键计算）
+            cache: 是否缓存输出
+            cache_if: 输出满足条件时才缓存（如图片全部生成成功）
+            required: 为 False 时本阶段失败不影响后续阶段（后续阶段收到的输出为 None）
+        """
+        self.name = name
+        self.run = run
+        self.depends_on = list(depends_on)
+        self.params = params or {}
+        self.cache = cache
+        self.cache_if = cache_if
+        self.required = required
+
+
+class PipelineEngine:
+    """按依赖关系并发执行阶段的流水线引擎"""
+
+    # 阶段输出缓存文件（位于任务目录）
+    CACHE_FILENAME = "pipeline_stages.json"
+
+    # 阶段状态
+    STATUS_DONE = "done"
+    STATUS_CACHED = "cached"
+    STATUS_FAILED = "failed"
+    STATUS_SKIPPED = "skipped"
+
+    def __init__(self, stages: List[PipelineStage], cache_dir: Optional[str] = None):
+        """
+        Args:
+            stages: 阶段列表（依赖的阶段必须在列表中）
+            cache_dir: 阶段输出缓存目录（None 时不缓存）
+        """
+        names = {stage.name for stage in stages}
+        for stage in stages:
+            missing = [dep for dep in stage.depends_on if dep not in names]
+            if missing:
+                raise ValueError(f"流水线阶段 {stage.name} 依赖的阶段不存在: {', '.join(missing)}")
+        self.stages = {stage.name: stage for stage in stages}
+        self.cache_path = os.path.join(cache_dir, self.CACHE_FILENAME) if cache_dir else None
+
+    def _load_cache(self) -> Dict[str, Dict[str, Any]]:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"⚠️ 读取流水线缓存失败，全部阶段重新执行: {e}")
+            return {}
+
+    def _save_cache(self, cache: Dict[str, Dict[str, Any]]):
+        if not self.cache_path:
+            return
+        try:
+            data = json.dumps(cache, ensure_ascii=False, indent=2).encode("utf-8")
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            write_file_atomic(self.cache_path, data)
+        except (OSError, TypeError) as e:
+            logger.warning(f"⚠️ 写入流水线缓存失败: {e}")
+
+    def run(self) -> Generator[Dict[str, Any], None, None]:
+        """
+        执行流水线
+
+        Yields:
+            事件字典：
+            - stage_start / stage_complete / stage_error / stage_skipped: 阶段状态
+            - 各阶段自身的事件（数据中带 stage 字段）
+            - pipeline_finish: 全部结束，带各阶段状态和输出
+        """
+        events: "queue.Queue[Tuple[str, str, Any]]" = queue.Queue()
+        cache = self._load_cache()
+        outputs: Dict[str, Any] = {}
+        status: Dict[str, str] = {}
+        started: Dict[str, float] = {}
+        input_hashes: Dict[str, str] = {}
+        running = 0
+
+        executor = ThreadPoolExecutor(max_workers=max(1, len(self.stages)), thread_name_prefix="pipeline")
+
+        def ready_stages() -> List[PipelineStage]:
+            ready = []
+            for stage in self.stages.values():
+                if stage.name in status or stage.name in started:
+                    continue
+                if all(dep in status for dep in stage.depends_on):
+                    ready.append(stage)
+            return ready
+
+        def blocking_failure(stage: PipelineStage) -> Optional[str]:
+            for dep in stage.depends_on:
+                if status[dep] in (self.STATUS_FAILED, self.STATUS_SKIPPED) and self.stages[dep].required:
+                    return dep
+            return None
+
+        def start(stage: PipelineStage):
+            nonlocal running
+            inputs = {dep: outputs.get(dep) for dep in stage.depends_on}
+            input_hash = config_fingerprint(stage.name, stage.params, inputs)
+            input_hashes[stage.name] = input_hash
+            started[stage.name] = time.monotonic()
+            running += 1
+
+            entry = cache.get(stage.name) if stage.cache else None
+            if entry and entry.get("input_hash") == input_hash:
+                events.put(("cached", stage.name, entry.get("output")))
+                return
+
+            def emit(event: str, data: Dict[str, Any]):
+                events.put(("event", stage.name, (event, data)))
+
+            def work():
+                try:
+                    events.put(("done", stage.name, stage.run(inputs, emit)))
+                except Exception as e:
+                    events.put(("failed", stage.name, str(e)))
+
+            events.put(("start", stage.name, None))
+            executor.submit(work)
+
+        try:
+            while True:
+                # 跳过的阶段可能使后续阶段也变为可调度，直到没有新的可调度阶段
+                ready = ready_stages()
+                while ready:
+                    for stage in ready:
+                        failed_dep = blocking_failure(stage)
+                        if failed_dep is not None:
+                            status[stage.name] = self.STATUS_SKIPPED
+                            yield {
+                                "event": "stage_skipped",
+                                "data": {"stage": stage.name, "reason": f"依赖的阶段 {failed_dep} 未完成"}
+                            }
+                            continue
+                        start(stage)
+                    ready = ready_stages()
+
+                if running == 0 and all(name in status for name in self.stages):
+                    break
+
+                kind, name, payload = events.get()
+                stage = self.stages[name]
+
+                if kind == "start":
+                    yield {"event": "stage_start", "data": {"stage": name}}
+                    continue
+
+                if kind == "event":
+                    event, data = payload
+                    yield {"event": event, "data": {**data, "stage": name}}
+                    continue
+
+                running -= 1
+                duration_ms = int((time.monotonic() - started[name]) * 1000)
+
+                if kind == "failed":
+                    status[name] = self.STATUS_FAILED
+                    logger.error(f"❌ 流水线阶段失败: {name}, error={payload}")
+                    yield {
+                        "event": "stage_error",
+                        "data": {"stage": name, "error": payload, "required": stage.required}
+                    }
+                    continue
+
+                outputs[name] = payload
+                if kind == "cached":
+                    status[name] = self.STATUS_CACHED
+                    logger.info(f"⚡ 流水线阶段输入未变化，复用上次输出: {name}")
+                else:
+                    status[name] = self.STATUS_DONE
+                    logger.info(f"✅ 流水线阶段完成: {name} ({duration_ms}ms)")
+                    if stage.cache and (stage.cache_if is None or stage.cache_if(payload)):
+                        cache[name] = {"input_hash": input_hashes[name], "output": payload}
+                        self._save_cache(cache)
+
+                yield {
+                    "event": "stage_complete",
+                    "data": {"stage": name, "cached": kind == "cached", "duration_ms": duration_ms}
+                }
+        finally:
+            executor.shutdown(wait=False)
+
+        yield {
+            "event": "pipeline_finish",
+            "data": {
+                "success": all(
+                    state in (self.STATUS_DONE, self.STATUS_CACHED) for state in status.values()
+                ),
+                "stages": status,
+                "outputs": outputs
+            }
+        }
+
+
+def _images_digest(images: Optional[List[bytes]]) -> List[str]:
+    """参考图片的哈希（作为阶段参数，不把图片数据写入缓存键）"""
+    return [hashlib.sha1(image).hexdigest() for image in images or []]
+
+
+def build_content_pipeline(
+    task_id: str,
+    topic: str,
+    images: Optional[List[bytes]] = None,
+    use_search: bool = False,
+    outline: Optional[Dict[str, Any]] = None,
+    record_id: Optional[str] = None
+) -> PipelineEngine:
+    """
+    创建"大纲 -> 文案 + 图片（并发） -> 历史记录"流水线
+
+    Args:
+        task_id: 任务 ID（图片和阶段缓存都保存在 history/<task_id>/）
+        topic: 主题
+        images: 用户上传的参考图片
+        use_search: 生成大纲时是否联网搜索
+        outline: 已有的大纲 {raw, pages}（传入时跳过大纲生成，如用户编辑后重新运行）
+        record_id: 已有的历史记录 ID（传入时更新该记录，否则新建）
+
+    Returns:
+        PipelineEngine
+    """
+    from backend.services.copywriting import get_copywriting_service
+    from backend.services.history import get_history_service
+    from backend.services.image import get_image_service
+    from backend.services.outline import get_outline_service
+
+    image_service = get_image_service()
+
+    def run_outline(inputs, emit):
+        if outline is not None:
+            return {"outline": outline.get("raw", ""), "pages": outline.get("pages", [])}
+
+        result = None
+        for event in get_outline_service().generate_outline_stream(topic, images or None, use_search):
+            name, data = event["event"], event["data"]
+            if name == "text":
+                # 事件日志只记录新增文本，不重复累积文本
+                emit("text", {"chunk": data.get("chunk", "")})
+                continue
+            if name == "error":
+                raise RuntimeError(data.get("error", "大纲生成失败"))
+            if name == "complete":
+                result = {"outline": data["outline"], "pages": data["pages"]}
+            emit(name, data)
+
+        if not result or not result["pages"]:
+            raise RuntimeError("大纲生成结果为空")
+        return result
+
+    def run_copywriting(inputs, emit):
+        generated = inputs["outline"]
+        result = None
+        events = get_copywriting_service().generate_copywriting_stream(
+            topic=topic,
+            outline={"raw": generated["outline"], "pages": generated["pages"]}
+        )
+        for event in events:
+            name, data = event["event"], event["data"]
+            if name == "text":
+                emit("text", {"chunk": data.get("chunk", "")})
+                continue
+            if name == "error":
+                raise RuntimeError(data.get("error", "文案生成失败"))
+            if name == "complete":
+                result = data
+            emit(name, data)
+        return result
+
+    def run_images(inputs, emit):
+        generated = inputs["outline"]
+        result = None
+        events = image_service.generate_images(
+            generated["pages"], task_id, generated["outline"],
+            user_images=images or None,
+            user_topic=topic
+        )
+        for event in events:
+            if event["event"] == "finish":
+                result = event["data"]
+            emit(event["event"], event["data"])
+        return result
+
+    def run_history(inputs, emit):
+        generated = inputs["outline"]
+        copywriting = inputs.get("copywriting")
+        image_result = inputs["images"]
+        history = get_history_service()
+
+        images_done = [name for name in image_result.get("images", []) if name]
+        if image_result.get("failed"):
+            status = "partial" if images_done else "draft"
+        else:
+            status = "completed"
+        outline_data = {"raw": generated["outline"], "pages": generated["pages"]}
+
+        target_id = record_id
+        if not target_id or history.get_record(target_id) is None:
+            target_id = history.create_record(topic, outline_data, task_id, copywriting)
+        history.update_record(
+            target_id,
+            outline=outline_data,
+            copywriting=copywriting,
+            images={"task_id": task_id, "generated": images_done},
+            status=status,
+            thumbnail=images_done[0] if images_done else None
+        )
+        emit("history_saved", {"record_id": target_id, "status": status})
+        return {"record_id": target_id, "status": status}
+
+    stages = [
+        PipelineStage(
+            "outline", run_outline,
+            params={"topic": topic, "use_search": use_search, "images": _images_digest(images), "outline": outline}
+        ),
+        PipelineStage("copywriting", run_copywriting, depends_on=["outline"], params={"topic": topic}, required=False),
+        PipelineStage(
+            "images", run_images, depends_on=["outline"],
+            params={"topic": topic, "images": _images_digest(images), "config_version": image_service.config_version},
+            # 有失败页面时不缓存，重新运行时重新生成
+            cache_if=lambda result: bool(result) and not result.get("failed")
+        ),
+        PipelineStage(
+            "history", run_history, depends_on=["outline", "copywriting", "images"],
+            params={"topic": topic, "record_id": record_id},
+            # 只为写入历史记录这一副作用而存在：每次都写入，记录可能已被删除或编辑
+            cache=False
+        ),
+    ]
+    return PipelineEngine(stages, cache_dir=os.path.join(image_service.history_root_dir, task_id))
@@ -0,0 +1,303 @@
+"""
+图片提示词构建
+
+完整模板（image_prompt.txt）把完整大纲和用户原始需求嵌入每一页的提示词，15 页的任务要把整份大纲发送 15 次。
+提示词模式按服务商配置 prompt_mode 分级：
+- full: 完整模板，嵌入完整大纲和用户需求（默认，与原来一致）
+- compact: 紧凑模板，嵌入任务上下文块（用户需求 + 风格要点 + 大纲概要），大小受 prompt_context_budget 限制；
+  上下文块每个任务只构建一次（大纲变化时重建）
+- short: 短模板，只包含页面类型和内容（旧配置 short_prompt: true 等价于此模式）
+
+每页提示词的大小记录在任务上下文（prompt_sizes）和全局统计（/api/metrics/prompts）中。
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+from backend.services.task_context import TaskContext
+from backend.utils.outline_parser import parse_outline
+
+logger = logging.getLogger(__name__)
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "prompts")
+
+# 提示词模式 -> 模板文件
+PROMPT_TEMPLATES = {
+    "full": "image_prompt.txt",
+    "compact": "image_prompt_compact.txt",
+    "short": "image_prompt_short.txt",
+}
+DEFAULT_PROMPT_MODE = "full"
+
+# 任务上下文块的默认 token 预算
+DEFAULT_CONTEXT_BUDGET = 300
+
+# 封面中描述整体风格的行（作为风格要点）
+STYLE_KEYWORDS = ("风格", "配色", "色调", "背景", "字体", "氛围", "视觉")
+
+# 大纲概要中每页摘要的字符上限（超出预算时依次缩短）
+SUMMARY_LINE_LIMITS = (40, 24, 12)
+
+# 模板中 {cover_reference} 的内容：封面图附在请求中时参考最后一张图片；只使用风格描述时封面图不在请求中，
+# 最后一张图片可能是用户的参考图，改为按文末的风格描述
+COVER_IMAGE_REFERENCE = "如果当前页面类型不是封面页的话，你要参考最后一张图片作为封面的样式"
+COVER_DESCRIPTOR_REFERENCE = (
+    "如果当前页面类型不是封面页的话，请严格按照文末的封面风格描述保持与封面一致的样式"
+    "（本次没有附带封面图，用户提供的参考图片不代表封面的样式）"
+)
+
+# 封面风格描述（内容页使用风格描述时追加到提示词末尾）
+STYLE_DESCRIPTOR_SECTION = "\n\n封面风格描述（内容页必须严格保持以下风格，与封面统一）：\n{style_descriptor}\n"
+
+# 摘要时跳过的行首标签
+LABEL_PREFIX = re.compile(r"^(标题|副标题|主题)[:：]\s*")
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的 token 数（中日韩字符按 1 个 token，其他字符按 4 个字符 1 个 token）"""
+    cjk = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """截断到 token 预算以内（按估算值，超出时末尾加省略号）"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 二分查找能放下的最长前缀
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) + 1 <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low].rstrip() + "…"
+
+
+def resolve_prompt_mode(provider_config: Dict[str, Any]) -> str:
+    """
+    服务商配置的提示词模式
+
+    Args:
+        provider_config: 服务商配置（prompt_mode，兼容旧的 short_prompt 开关）
+
+    Returns:
+        full / compact / short
+    """
+    mode = provider_config.get('prompt_mode')
+    if mode is None:
+        return "short" if provider_config.get('short_prompt', False) else DEFAULT_PROMPT_MODE
+    mode = str(mode).lower()
+    if mode not in PROMPT_TEMPLATES:
+        logger.warning(f"⚠️ 未知的提示词模式 {mode}，使用 {DEFAULT_PROMPT_MODE}")
+        return DEFAULT_PROMPT_MODE
+    return mode
+
+
+def _page_summary(page: Dict[str, Any], limit: int) -> str:
+    """页面摘要：类型标记后的第一行（去掉"标题："等标签）"""
+    lines = [line.strip() for line in page.get("content", "").splitlines() if line.strip()]
+    if lines and re.match(r"^\[\S+\]$", lines[0]):
+        lines = lines[1:]
+    summary = LABEL_PREFIX.sub("", lines[0]) if lines else ""
+    if len(summary) > limit:
+        summary = summary[:limit].rstrip() + "…"
+    return summary
+
+
+def _style_notes(pages: List[Dict[str, Any]]) -> List[str]:
+    """从封面中提取描述整体风格的行"""
+    cover = next((page for page in pages if page.get("type") == "cover"), None)
+    if cover is None:
+        return []
+    return [
+        line.strip() for line in cover.get("content", "").splitlines()
+        if any(keyword in line for keyword in STYLE_KEYWORDS)
+    ]
+
+
+def build_task_context(full_outline: str, user_topic: str, budget: int = DEFAULT_CONTEXT_BUDGET) -> str:
+    """
+    构建紧凑的任务上下文块：用户需求 + 风格要点 + 大纲概要
+
+    用户需求最多占预算的 1/3，风格要点最多占 1/4；大纲概要用剩余预算，放不下时缩短每页摘要，
+    仍放不下时只保留前面的页面。
+
+    Args:
+        full_outline: 完整大纲文本
+        user_topic: 用户原始输入
+        budget: token 预算
+
+    Returns:
+        上下文块文本
+    """
+    pages = parse_outline(full_outline) if full_outline else []
+    sections = []
+
+    topic = " ".join((user_topic or "").split())
+    if topic:
+        sections.append(f"用户需求：{_truncate(topic, max(budget // 3, 1))}")
+
+    notes = _style_notes(pages)
+    if notes:
+        sections.append(f"风格要点：{_truncate('；'.join(notes), max(budget // 4, 1))}")
+
+    remaining = budget - sum(estimate_tokens(section) + 1 for section in sections)
+    if pages and remaining > 0:
+        header = f"大纲概要（共 {len(pages)} 页）："
+        remaining -= estimate_tokens(header) + 1
+        lines: List[str] = []
+        for limit in SUMMARY_LINE_LIMITS:
+            lines = [f"{position}. {_page_summary(page, limit)}" for position, page in enumerate(pages, start=1)]
+            if sum(estimate_tokens(line) + 1 for line in lines) <= remaining:
+                break
+        else:
+            # 最短的摘要也放不下：只保留前面的页面
+            kept, used = [], estimate_tokens("……") + 1
+            for line in lines:
+                used += estimate_tokens(line) + 1
+                if used > remaining:
+                    break
+                kept.append(line)
+            lines = kept + ["……"]
+        sections.append("\n".join([header] + lines))
+
+    return "\n".join(sections)
+
+
+class PromptStats:
+    """各提示词模式的页数和提示词大小累计（进程内全局）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._modes: Dict[str, Dict[str, int]] = {}
+
+    def record(self, mode: str, chars: int, tokens: int):
+        with self._lock:
+            entry = self._modes.setdefault(mode, {"pages": 0, "chars": 0, "tokens": 0})
+            entry["pages"] += 1
+            entry["chars"] += chars
+            entry["tokens"] += tokens
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                mode: {
+                    **entry,
+                    "avg_chars": round(entry["chars"] / entry["pages"]),
+                    "avg_tokens": round(entry["tokens"] / entry["pages"])
+                }
+                for mode, entry in self._modes.items()
+            }
+
+
+_prompt_stats = PromptStats()
+
+
+def get_prompt_stats() -> PromptStats:
+    """获取全局提示词统计"""
+    return _prompt_stats
+
+
+class ImagePromptBuilder:
+    """按提示词模式构建页面提示词"""
+
+    def __init__(self, mode: str = DEFAULT_PROMPT_MODE, context_budget: int = DEFAULT_CONTEXT_BUDGET):
+        """
+        Args:
+            mode: 提示词模式（模板不存在时退回完整模板）
+            context_budget: compact 模式下任务上下文块的 token 预算
+        """
+        self.templates = {name: self._load_template(filename) for name, filename in PROMPT_TEMPLATES.items()}
+        if not self.templates.get(mode):
+            logger.warning(f"⚠️ 提示词模板 {PROMPT_TEMPLATES[mode]} 不存在，使用完整模板")
+            mode = "full"
+        self.mode = mode
+        self.context_budget = context_budget
+
+    @classmethod
+    def from_config(cls, provider_config: Dict[str, Any]) -> "ImagePromptBuilder":
+        """按服务商配置（prompt_mode / short_prompt / prompt_context_budget）创建"""
+        budget = int(provider_config.get('prompt_context_budget', DEFAULT_CONTEXT_BUDGET))
+        return cls(resolve_prompt_mode(provider_config), max(budget, 50))
+
+    @staticmethod
+    def _load_template(filename: str) -> str:
+        """加载提示词模板，不存在时返回空字符串"""
+        path = os.path.join(PROMPTS_DIR, filename)
+        if not os.path.exists(path):
+            return ""
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def task_context(self, ctx: TaskContext) -> str:
+        """
+        任务上下文块（按大纲和用户需求缓存在任务上下文中，流水线模式下大纲增长时重建）
+
+        Args:
+            ctx: 任务上下文
+
+        Returns:
+            上下文块文本
+        """
+        source = f"{self.context_budget}\n{ctx.user_topic}\n{ctx.full_outline}"
+        key = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        cached = ctx.prompt_context
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        block = build_task_context(ctx.full_outline, ctx.user_topic, self.context_budget)
+        ctx.prompt_context = (key, block)
+        logger.debug(f"任务上下文块 ({estimate_tokens(block)} tokens): {ctx.task_id}")
+        return block
+
+    def build(
+        self,
+        page: Dict[str, Any],
+        ctx: TaskContext,
+        style_descriptor: Optional[str] = None,
+        cover_attached: bool = True
+    ) -> str:
+        """
+        构建页面提示词，并记录提示词大小
+
+        Args:
+            page: 页面数据
+            ctx: 任务上下文
+            style_descriptor: 封面风格描述（内容页使用风格描述时传入）
+            cover_attached: 封面图是否附在请求中（只使用风格描述时为 False）
+
+        Returns:
+            提示词
+        """
+        template = self.templates[self.mode]
+        use_descriptor = bool(style_descriptor) and not cover_attached
+        cover_reference = COVER_DESCRIPTOR_REFERENCE if use_descriptor else COVER_IMAGE_REFERENCE
+        if self.mode == "short":
+            prompt = template.format(page_content=page["content"], page_type=page["type"])
+        elif self.mode == "compact":
+            prompt = template.format(
+                page_content=page["content"],
+                page_type=page["type"],
+                task_context=self.task_context(ctx),
+                cover_reference=cover_reference
+            )
+        else:
+            prompt = template.format(
+                page_content=page["content"],
+                page_type=page["type"],
+                full_outline=ctx.full_outline,
+                user_topic=ctx.user_topic if ctx.user_topic else "未提供",
+                cover_reference=cover_reference
+            )
+        if style_descriptor:
+            prompt += STYLE_DESCRIPTOR_SECTION.format(style_descriptor=style_descriptor)
+
+        tokens = estimate_tokens(prompt)
+        ctx.record_prompt_size(page["index"], self.mode, len(prompt), tokens)
+        _prompt_stats.record(self.mode, len(prompt), tokens)
+        logger.debug(f"  图片 [{page['index']}] 提示词: mode={self.mode}, {len(prompt)} 字符, 约 {tokens} tokens")
+        return prompt
@@ -0,0 +1,192 @@
+"""
+图片服务商路由
+
+默认整个图片服务只绑定 active_provider 一个服务商，单个服务商的限流就是吞吐上限。
+配置 routing 后，页面按权重和实测耗时分散到多个服务商：
+- 每次尝试按 权重 × 耗时系数 × 空闲系数 加权随机排出服务商顺序，熔断中的服务商不参与
+- 当前服务商因服务商自身的问题（限流、认证、5xx、网络、熔断等）失败时立即切换到下一个
+- 提示词本身的问题（安全过滤、参数错误）换服务商也不会成功，直接返回给重试策略
+
+配置示例（image_providers.yaml）：
+    routing:
+      enabled: true
+      providers:      # 参与路由的服务商及权重，active_provider 未列出时按权重 1 加入
+        gemini: 3
+        vertex: 1
+"""
+import logging
+import random
+import threading
+from collections import Counter
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set
+
+from backend.config import Config
+from backend.utils.retry import (
+    ERROR_AUTH, ERROR_NETWORK, ERROR_NOT_FOUND, ERROR_RATE_LIMIT, ERROR_SERVER, ERROR_UNKNOWN,
+    classify_error
+)
+from backend.utils.circuit_breaker import ERROR_CIRCUIT_OPEN, STATE_OPEN
+
+if TYPE_CHECKING:
+    from backend.services.image import ImageService
+
+logger = logging.getLogger(__name__)
+
+# 换一个服务商可能成功的错误类型
+FAILOVER_ERRORS = {
+    ERROR_RATE_LIMIT, ERROR_AUTH, ERROR_NOT_FOUND, ERROR_SERVER, ERROR_NETWORK, ERROR_UNKNOWN,
+    ERROR_CIRCUIT_OPEN
+}
+
+
+def should_failover(error: Exception) -> bool:
+    """错误是否值得换一个服务商重试"""
+    return classify_error(error) in FAILOVER_ERRORS
+
+
+class ProviderRouter:
+    """按权重和实测耗时在多个图片服务商之间分配请求"""
+
+    # 用于比较服务商快慢的耗时分位数
+    LATENCY_PERCENTILE = 50
+    # 没有空闲并发额度的服务商的权重系数
+    BUSY_FACTOR = 0.25
+
+    def __init__(self, primary: "ImageService", weights: Dict[str, float]):
+        """
+        Args:
+            primary: 主服务（active_provider）
+            weights: 服务商名称 -> 权重
+        """
+        self.primary = primary
+        self.weights = weights
+        self._services: Dict[str, "ImageService"] = {primary.provider_name: primary}
+        self._unavailable: Dict[str, str] = {}
+        self._routed: Counter = Counter()
+        self._failovers: Counter = Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, primary: "ImageService") -> Optional["ProviderRouter"]:
+        """按配置创建路由（未启用或只有一个服务商时返回 None）"""
+        weights = Config.get_image_routing(primary.config_snapshot)
+        if not weights:
+            return None
+        weights.setdefault(primary.provider_name, 1.0)
+        if len(weights) < 2:
+            return None
+        logger.info(f"已启用图片服务商路由: {weights}")
+        return cls(primary, weights)
+
+    def _service(self, name: str) -> Optional["ImageService"]:
+        """获取服务商对应的服务实例（按需创建，配置有误的服务商跳过）"""
+        with self._lock:
+            if name in self._services:
+                return self._services[name]
+            if name in self._unavailable:
+                return None
+
+        from backend.services.image import ImageService
+        try:
+            # 沿用主服务的配置快照，同一任务内各服务商的配置版本一致
+            service = ImageService(name, enable_routing=False, snapshot=self.primary.config_snapshot)
+        except Exception as e:
+            logger.warning(f"⚠️ 路由服务商 {name} 不可用，已跳过: {e}")
+            with self._lock:
+                self._unavailable[name] = str(e)[:200]
+            return None
+
+        with self._lock:
+            return self._services.setdefault(name, service)
+
+    def _score(self, service: "ImageService", fastest: Optional[float]) -> float:
+        """服务商的路由得分"""
+        score = float(self.weights.get(service.provider_name, 1.0))
+        latency = service.latency.percentile(self.LATENCY_PERCENTILE)
+        if fastest and latency:
+            score *= fastest / latency
+        if service.concurrency.in_flight >= service.concurrency.limit:
+            score *= self.BUSY_FACTOR
+        return score
+
+    def candidates(self, exclude: Optional[Set[str]] = None) -> List["ImageService"]:
+        """
+        本次请求的服务商顺序（加权随机，熔断中的服务商排除在外）
+
+        Args:
+            exclude: 不参与本次排序的服务商名称
+
+        Returns:
+            服务列表，第一个为首选；全部不可用时只包含主服务（由它报告错误）
+        """
+        services = []
+        for name in self.weights:
+            if exclude and name in exclude:
+                continue
+            service = self._service(name)
+            if service is not None and service.breaker.state != STATE_OPEN:
+                services.append(service)
+
+        if not services:
+            return [self.primary] if not exclude or self.primary.provider_name not in exclude else []
+
+        latencies = [s.latency.percentile(self.LATENCY_PERCENTILE) for s in services]
+        known = [latency for latency in latencies if latency]
+        fastest = min(known) if known else None
+
+        # 加权随机排列（Efraimidis-Spirakis）：得分越高越可能排在前面
+        keyed = []
+        for service in services:
+            score = max(self._score(service, fastest), 1e-6)
+            keyed.append((random.random() ** (1.0 / score), service))
+        keyed.sort(key=lambda item: item[0], reverse=True)
+        return [service for _, service in keyed]
+
+    def record_routed(self, provider_name: str):
+        """记录一次由该服务商完成的生成"""
+        with self._lock:
+            self._routed[provider_name] += 1
+
+    def record_failover(self, provider_name: str):
+        """记录一次从该服务商切走的失败"""
+        with self._lock:
+            self._failovers[provider_name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """路由状态（用于监控）"""
+        with self._lock:
+            services = dict(self._services)
+            result = {
+                "primary": self.primary.provider_name,
+                "providers": {}
+            }
+            for name, weight in self.weights.items():
+                entry = {
+                    "weight": weight,
+                    "generated": self._routed.get(name, 0),
+                    "failovers": self._failovers.get(name, 0)
+                }
+                if name in self._unavailable:
+                    entry["unavailable"] = self._unavailable[name]
+                result["providers"][name] = entry
+
+        for name, service in services.items():
+            result["providers"][name]["breaker"] = service.breaker.state
+            result["providers"][name]["latency_p50_ms"] = service.latency.stats()["p50_ms"]
+        return result
+
+
+# 当前图片服务使用的路由（仅用于监控）
+_active_router: Optional[ProviderRouter] = None
+
+
+def set_active_router(router: Optional[ProviderRouter]):
+    """登记当前图片服务使用的路由"""
+    global _active_router
+    _active_router = router
+
+
+def get_router_stats() -> Optional[Dict[str, Any]]:
+    """当前路由状态（未启用时返回 None）"""
+    router = _active_router
+    return router.stats() if router is not None else None
@@ -12,6 +12,8 @@ class SearchService:
 
     _instance = None
     _config = None
+    # 当前搜索配置对应的配置版本
+    _config_version = None
     active_provider_name = None
     active_provider = None
 
@@ -21,14 +23,18 @@ class SearchService:
         return cls._instance
 
     def __init__(self):
-        if self._config is None:
+        from backend.config import Config
+        # 配置文件变化后（新版本）重新加载
+        if self._config is None or self._config_version != Config.current().version:
             self.reload_config()
 
     @classmethod
     def reload_config(cls):
         """重新加载配置"""
         from backend.config import Config
-        cls._config = Config.load_search_providers_config()
+        snapshot = Config.current()
+        cls._config = snapshot.search
+        cls._config_version = snapshot.version
         cls.active_provider_name = cls._config.get('active_provider', 'duckduckgo')
         cls.active_provider = cls._get_active_provider()
         logger.info(f"搜索配置已重新加载: active={cls.active_provider_name}")
@@ -0,0 +1,163 @@
+"""
+封面风格描述提取
+
+内容页原来都把封面图（压缩后约 200KB，base64 编码后更大）作为参考图上传，15 页的任务要上传十几次。
+封面生成后调用一次多模态文本模型，提取结构化的风格描述（配色、背景、字体、版式、装饰元素、氛围），
+内容页的提示词改为使用风格描述。图片服务商的 style_reference 配置决定内容页使用哪种参考：
+- image: 上传封面图（默认，与原来一致）
+- descriptor: 只使用风格描述，不上传封面图
+- both: 同时使用
+"""
+import json
+import logging
+import os
+import re
+from typing import Any, Dict
+
+from backend.config import Config
+from backend.utils.text_client import get_text_chat_client
+from backend.utils.key_pool import provider_api_keys
+from backend.utils.service_registry import get_service_registry, text_service_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# 内容页的封面参考方式
+STYLE_REFERENCE_MODES = ("image", "descriptor", "both")
+DEFAULT_STYLE_REFERENCE = "image"
+
+# 风格描述字段 -> 提示词中的名称
+DESCRIPTOR_FIELDS = {
+    "palette": "配色",
+    "background": "背景",
+    "typography": "字体",
+    "layout": "版式",
+    "motifs": "装饰元素",
+    "mood": "整体氛围",
+}
+
+
+def resolve_style_reference(provider_config: Dict[str, Any]) -> str:
+    """
+    图片服务商配置的封面参考方式
+
+    Args:
+        provider_config: 图片服务商配置（style_reference）
+
+    Returns:
+        image / descriptor / both
+    """
+    mode = str(provider_config.get('style_reference', DEFAULT_STYLE_REFERENCE)).lower()
+    if mode not in STYLE_REFERENCE_MODES:
+        logger.warning(f"⚠️ 未知的封面参考方式 {mode}，使用 {DEFAULT_STYLE_REFERENCE}")
+        return DEFAULT_STYLE_REFERENCE
+    return mode
+
+
+def format_style_descriptor(descriptor: Dict[str, Any]) -> str:
+    """把风格描述转成提示词中使用的文本（每个字段一行，缺少的字段跳过）"""
+    lines = []
+    for field, label in DESCRIPTOR_FIELDS.items():
+        value = descriptor.get(field)
+        if isinstance(value, list):
+            value = "、".join(str(item).strip() for item in value if str(item).strip())
+        value = str(value or "").strip()
+        if value:
+            lines.append(f"- {label}：{value}")
+    return "\n".join(lines)
+
+
+class StyleDescriptorService:
+    """封面风格描述提取服务"""
+
+    def __init__(self):
+        logger.debug("初始化 StyleDescriptorService...")
+        self.text_config = Config.current().text or {}
+        self.client = self._get_client()
+        self.prompt_template = self._load_prompt_template()
+        logger.info(f"StyleDescriptorService 初始化完成，使用服务商: {self.text_config.get('active_provider')}")
+
+    def _get_client(self):
+        """根据配置获取客户端（复用OutlineService的逻辑）"""
+        active_provider = self.text_config.get('active_provider', 'google_gemini')
+        providers = self.text_config.get('providers', {})
+
+        if active_provider not in providers:
+            logger.error(f"文本服务商 [{active_provider}] 不存在，无法提取封面风格描述")
+            raise ValueError(
+                f"未找到文本生成服务商配置: {active_provider}\n"
+                "解决方案：在系统设置中选择一个可用的文本服务商"
+            )
+
+        provider_config = providers.get(active_provider, {})
+
+        if not provider_api_keys(provider_config):
+            logger.error(f"文本服务商 [{active_provider}] 未配置 API Key")
+            raise ValueError(
+                f"文本服务商 {active_provider} 未配置 API Key\n"
+                "解决方案：在系统设置页面编辑该服务商，填写 API Key"
+            )
+
+        return get_text_chat_client(provider_config, active_provider)
+
+    def _load_prompt_template(self) -> str:
+        """加载风格描述提取提示词模板"""
+        prompt_path = os.path.join(
+            os.path.dirname(os.path.dirname(__file__)),
+            "prompts",
+            "style_descriptor_prompt.txt"
+        )
+        with open(prompt_path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def _parse_descriptor(self, text: str) -> Dict[str, Any]:
+        """解析模型返回的 JSON（允许带 ```json 代码块）"""
+        json_match = re.search(r'```(?:json)?\s*(.+?)\s*```', text, re.DOTALL)
+        raw = json_match.group(1) if json_match else text[text.find("{"):text.rfind("}") + 1]
+        data = json.loads(raw)
+        if not isinstance(data, dict):
+            raise ValueError("风格描述不是 JSON 对象")
+        descriptor = {field: data[field] for field in DESCRIPTOR_FIELDS if data.get(field)}
+        if not descriptor:
+            raise ValueError("风格描述缺少所有字段")
+        return descriptor
+
+    def extract(self, cover_image: bytes) -> Dict[str, Any]:
+        """
+        从封面图提取风格描述
+
+        Args:
+            cover_image: 封面图（已压缩）
+
+        Returns:
+            风格描述 {palette, background, typography, layout, motifs, mood}（缺少的字段不出现）
+
+        Raises:
+            调用失败或返回内容无法解析时抛出异常
+        """
+        active_provider = self.text_config.get('active_provider', 'google_gemini')
+        provider_config = self.text_config.get('providers', {}).get(active_provider, {})
+        model = provider_config.get('model', 'gemini-2.0-flash-exp')
+
+        logger.info(f"🔄 提取封面风格描述: model={model}")
+        text = self.client.generate_text(
+            prompt=self.prompt_template,
+            model=model,
+            temperature=0.2,
+            max_output_tokens=1000,
+            images=[cover_image]
+        )
+        descriptor = self._parse_descriptor(text)
+        logger.info(f"✅ 封面风格描述提取完成: {', '.join(descriptor)}")
+        return descriptor
+
+
+def get_style_descriptor_service() -> StyleDescriptorService:
+    """
+    获取封面风格描述提取服务实例
+    按配置指纹缓存：文本服务商配置或提示词模板变化后自动重建
+    """
+    return get_service_registry().get_or_create(
+        "style_descriptor",
+        text_service_fingerprint(["style_descriptor_prompt.txt"]),
+        StyleDescriptorService
+    )
@@ -0,0 +1,290 @@
+"""图片生成任务上下文"""
+import hashlib
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from backend.services.page_manifest import PageManifest
+from backend.utils.reference_payload import ReferencePayloadCache
+
+# 页面内容修改后，已生成的图片标记为失败时使用的错误信息（可通过重试重新生成）
+STALE_PAGE_ERROR = "页面内容已修改，需要重新生成"
+
+
+def page_input_hash(page: Dict[str, Any]) -> str:
+    """页面生成输入（类型 + 内容）的哈希，用于判断页面在生成后是否被修改"""
+    raw = f"{page.get('type', '')}\n{page.get('content', '')}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class TaskContext:
+    """
+    单个图片生成任务的上下文
+
+    ImageService 是全局单例，多个任务会并发执行；任务相关的一切（输出目录、封面参考图、
+    大纲、用户参考图、生成结果）都放在各自的上下文对象里，沿生成调用链显式传递，
+    而不是挂在服务实例上。
+    """
+
+    def __init__(
+        self,
+        task_id: str,
+        task_dir: str,
+        pages: Optional[List[Dict]] = None,
+        full_outline: str = "",
+        user_topic: str = "",
+        user_images: Optional[List[bytes]] = None
+    ):
+        """
+        Args:
+            task_id: 任务ID
+            task_dir: 任务输出目录
+            pages: 页面列表
+            full_outline: 完整大纲文本
+            user_topic: 用户原始输入
+            user_images: 用户上传的参考图片（已压缩）
+        """
+        self.task_id = task_id
+        self.task_dir = task_dir
+        self.pages = pages or []
+        self.full_outline = full_outline
+        self.user_topic = user_topic
+        self.user_images = user_images
+
+        # 封面参考图（已压缩），封面生成后写入
+        self.cover_image: Optional[bytes] = None
+
+        # 参考图载荷缓存（压缩 + base64 结果，任务内所有页面共用；不落盘）
+        self.reference_payloads = ReferencePayloadCache()
+
+        # 生成结果：index -> 文件名 / 错误信息
+        self.generated: Dict[int, str] = {}
+        self.failed: Dict[int, str] = {}
+        # 每页由哪个服务商生成（命中生成缓存时为 cache）
+        self.page_providers: Dict[int, str] = {}
+
+        # 计数器
+        self.attempts = 0
+        # 对冲 / 封面并行发出的额外请求数（每个任务有上限）
+        self.extra_requests = 0
+
+        # 每页的尝试记录：index -> [{attempt, ok, kind, duration_ms, error, wait}, ...]
+        self.attempt_log: Dict[int, List[Dict[str, Any]]] = {}
+
+        # 每页提示词的大小：index -> {mode, chars, tokens}
+        self.prompt_sizes: Dict[int, Dict[str, Any]] = {}
+        # 紧凑提示词的任务上下文块：(来源哈希, 文本)，不落盘
+        self.prompt_context: Optional[Tuple[str, str]] = None
+        # 封面风格描述：{cover: 封面哈希, text: 描述文本}（只缓存提取成功的结果）
+        self.style_descriptor: Optional[Dict[str, str]] = None
+        self._descriptor_lock = threading.Lock()
+
+        # 最近一次生成 / 重试使用的配置版本
+        self.config_version: Optional[int] = None
+
+        self._manifest: Optional[PageManifest] = None
+        self._lock = threading.Lock()
+
+    @property
+    def total(self) -> int:
+        """任务总页数"""
+        return len(self.pages)
+
+    @property
+    def completed(self) -> int:
+        """已成功生成的页数"""
+        return len(self.generated)
+
+    @property
+    def manifest(self) -> PageManifest:
+        """任务目录下的页面清单（首次访问时加载）"""
+        with self._lock:
+            if self._manifest is None:
+                self._manifest = PageManifest(self.task_dir)
+            return self._manifest
+
+    def ensure_dir(self):
+        """确保任务目录存在"""
+        os.makedirs(self.task_dir, exist_ok=True)
+
+    def image_url(self, filename: str) -> str:
+        """图片访问 URL"""
+        return f"/api/images/{self.task_id}/{filename}"
+
+    def record_attempt(self):
+        """记录一次服务商调用尝试"""
+        with self._lock:
+            self.attempts += 1
+
+    def reserve_extra_request(self, limit: int) -> bool:
+        """占用一次额外请求额度，已达上限时返回 False"""
+        with self._lock:
+            if self.extra_requests >= limit:
+                return False
+            self.extra_requests += 1
+            return True
+
+    def release_extra_request(self):
+        """归还未实际发出的额外请求额度"""
+        with self._lock:
+            self.extra_requests = max(0, self.extra_requests - 1)
+
+    def record_attempt_log(self, index: int, records: List[Dict[str, Any]]):
+        """追加页面的尝试记录（重试 / 重新生成时累加）"""
+        if not records:
+            return
+        with self._lock:
+            self.attempt_log.setdefault(index, []).extend(records)
+
+    def record_prompt_size(self, index: int, mode: str, chars: int, tokens: int):
+        """记录页面提示词的大小（重试 / 重新生成时覆盖）"""
+        with self._lock:
+            self.prompt_sizes[index] = {"mode": mode, "chars": chars, "tokens": tokens}
+
+    def cover_style_descriptor(self, cover_image: bytes, extract: Callable[[bytes], str]) -> str:
+        """
+        封面的风格描述（每张封面成功提取一次，并发生成的页面等待同一次提取）
+
+        提取失败的结果不缓存：偶发的文本服务商错误不影响之后的页面、重试和重新生成，它们会再次尝试提取。
+
+        Args:
+            cover_image: 封面参考图（已压缩）
+            extract: 提取函数，失败时返回空字符串
+
+        Returns:
+            描述文本，提取失败时为空字符串
+        """
+        cover_hash = hashlib.sha1(cover_image).hexdigest()
+        with self._descriptor_lock:
+            if self.style_descriptor is not None and self.style_descriptor.get("cover") == cover_hash:
+                return self.style_descriptor["text"]
+            text = extract(cover_image)
+            if text:
+                self.style_descriptor = {"cover": cover_hash, "text": text}
+            return text
+
+    def mark_generated(self, index: int, filename: str):
+        """记录页面生成成功（清除之前的失败记录）"""
+        with self._lock:
+            self.generated[index] = filename
+            self.failed.pop(index, None)
+
+    def mark_provider(self, index: int, provider_name: str):
+        """记录生成该页的服务商"""
+        with self._lock:
+            self.page_providers[index] = provider_name
+
+    def mark_failed(self, index: int, error: str):
+        """记录页面生成失败"""
+        with self._lock:
+            self.failed[index] = error
+
+    def get_page(self, index: int) -> Optional[Dict]:
+        """按页码获取页面（返回副本）"""
+        with self._lock:
+            for page in self.pages:
+                if page.get("index") == index:
+                    return dict(page)
+        return None
+
+    def add_page(self, page: Dict):
+        """追加一个页面（流水线模式下大纲边生成边追加）"""
+        with self._lock:
+            self.pages.append(dict(page))
+
+    def update_pages(self, pages: List[Dict]) -> List[int]:
+        """
+        用户编辑页面后更新上下文，内容有变化且已生成图片的页面标记为需要重新生成
+
+        Args:
+            pages: 编辑后的页面列表（按 index 对应）
+
+        Returns:
+            图片已失效的页码
+        """
+        invalidated = []
+        with self._lock:
+            current = {page.get("index"): page for page in self.pages}
+            for page in pages:
+                index = page.get("index")
+                existing = current.get(index)
+                if existing is None:
+                    self.pages.append(dict(page))
+                    continue
+                if page_input_hash(existing) == page_input_hash(page):
+                    continue
+                existing.update(page)
+                if self.generated.pop(index, None) is not None:
+                    self.failed[index] = STALE_PAGE_ERROR
+                    invalidated.append(index)
+        return invalidated
+
+    def memory_size(self) -> int:
+        """估算上下文占用的内存字节数（图片数据为主）"""
+        size = len(self.cover_image or b"") + len(self.full_outline) + len(self.user_topic)
+        size += sum(len(img) for img in self.user_images or [])
+        size += sum(len(str(page.get("content", ""))) for page in self.pages)
+        size += self.reference_payloads.memory_size()
+        return size
+
+    def to_dict(self) -> Dict[str, Any]:
+        """导出可 JSON 序列化的字段（不含图片数据）"""
+        with self._lock:
+            return {
+                "task_id": self.task_id,
+                "pages": self.pages,
+                "full_outline": self.full_outline,
+                "user_topic": self.user_topic,
+                "generated": dict(self.generated),
+                "failed": dict(self.failed),
+                "page_providers": dict(self.page_providers),
+                "attempts": self.attempts,
+                "extra_requests": self.extra_requests,
+                "attempt_log": {k: list(v) for k, v in self.attempt_log.items()},
+                "prompt_sizes": dict(self.prompt_sizes),
+                "style_descriptor": self.style_descriptor,
+                "config_version": self.config_version
+            }
+
+    @classmethod
+    def from_dict(
+        cls,
+        data: Dict[str, Any],
+        task_dir: str,
+        cover_image: Optional[bytes] = None,
+        user_images: Optional[List[bytes]] = None
+    ) -> "TaskContext":
+        """从 to_dict() 的结果和图片数据还原上下文"""
+        ctx = cls(
+            data["task_id"],
+            task_dir,
+            pages=data.get("pages"),
+            full_outline=data.get("full_outline", ""),
+            user_topic=data.get("user_topic", ""),
+            user_images=user_images
+        )
+        ctx.cover_image = cover_image
+        # JSON 的键都是字符串，还原为页码
+        ctx.generated = {int(k): v for k, v in data.get("generated", {}).items()}
+        ctx.failed = {int(k): v for k, v in data.get("failed", {}).items()}
+        ctx.page_providers = {int(k): v for k, v in data.get("page_providers", {}).items()}
+        ctx.attempts = data.get("attempts", 0)
+        ctx.extra_requests = data.get("extra_requests", 0)
+        ctx.attempt_log = {int(k): v for k, v in data.get("attempt_log", {}).items()}
+        ctx.prompt_sizes = {int(k): v for k, v in data.get("prompt_sizes", {}).items()}
+        ctx.style_descriptor = data.get("style_descriptor")
+        ctx.config_version = data.get("config_version")
+        return ctx
+
+    def public_state(self) -> Dict[str, Any]:
+        """可返回给前端的任务状态（不含图片数据）"""
+        with self._lock:
+            return {
+                "generated": dict(self.generated),
+                "failed": dict(self.failed),
+                "page_providers": dict(self.page_providers),
+                "has_cover": self.cover_image is not None,
+                "attempt_log": {k: list(v) for k, v in self.attempt_log.items()},
+                "prompt_sizes": dict(self.prompt_sizes),
+                "config_version": self.config_version
+            }
@@ -0,0 +1,305 @@
+"""
+后台任务管理
+
+把长耗时的生成任务（如批量生图）从 HTTP 连接中剥离出来，放到后台线程池执行：
+- 提交任务后立即返回 task_id
+- 任务产生的事件按顺序编号，写入内存缓冲并追加到 history/<task_id>/events.jsonl
+- 客户端可随时通过事件流接口回放历史事件并继续接收实时事件（支持 Last-Event-ID）
+
+连接断开不会影响任务本身，已经发出的服务商请求不会被浪费。
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Generator, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationJob:
+    """单个后台任务：保存事件序列并通知等待中的订阅者"""
+
+    # 任务状态
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_FINISHED = "finished"
+    STATUS_FAILED = "failed"
+
+    def __init__(self, task_id: str, kind: str, events_path: str, start_id: int = 0):
+        """
+        Args:
+            task_id: 任务 ID
+            kind: 任务类型（如 generate）
+            events_path: 事件日志文件路径
+            start_id: 本次运行之前已存在的最后一个事件 ID（事件 ID 跨运行递增）
+        """
+        self.task_id = task_id
+        self.kind = kind
+        self.events_path = events_path
+        self.status = self.STATUS_QUEUED
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+        # 本次运行的第一个事件 ID（默认从这里开始回放）
+        self.first_event_id = start_id + 1
+        self._last_event_id = start_id
+        self._events: List[Dict[str, Any]] = []
+        self._cond = threading.Condition()
+
+    @property
+    def last_event_id(self) -> int:
+        return self._last_event_id
+
+    @property
+    def done(self) -> bool:
+        return self.status in (self.STATUS_FINISHED, self.STATUS_FAILED)
+
+    def append(self, event: str, data: Dict[str, Any]) -> int:
+        """追加一条事件，返回事件 ID"""
+        with self._cond:
+            self._last_event_id += 1
+            record = {"id": self._last_event_id, "event": event, "data": data}
+            self._events.append(record)
+            try:
+                with open(self.events_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            except OSError as e:
+                # 事件日志写入失败不影响任务本身，内存中仍可回放
+                logger.warning(f"写入事件日志失败: {self.events_path}: {e}")
+            self._cond.notify_all()
+            return record["id"]
+
+    def set_status(self, status: str, error: Optional[str] = None):
+        """更新任务状态并唤醒订阅者"""
+        with self._cond:
+            self.status = status
+            if error:
+                self.error = error
+            if self.done:
+                self.finished_at = time.time()
+            self._cond.notify_all()
+
+    def iter_events(
+        self,
+        after_id: Optional[int] = None,
+        heartbeat: float = 15.0
+    ) -> Generator[Optional[Dict[str, Any]], None, None]:
+        """
+        回放并持续订阅事件
+
+        Args:
+            after_id: 只返回 ID 大于该值的事件；None 表示从本次运行开头回放
+            heartbeat: 无新事件时每隔多少秒产出一次 None（用于发送心跳）
+
+        Yields:
+            事件记录 {"id", "event", "data"}，或 None 表示心跳
+        """
+        cursor = self.first_event_id - 1 if after_id is None else after_id
+
+        # 早于本次运行的事件只存在于日志文件中
+        if cursor < self.first_event_id - 1:
+            for record in read_event_log(self.events_path, cursor):
+                if record["id"] >= self.first_event_id:
+                    break
+                cursor = record["id"]
+                yield record
+
+        while True:
+            with self._cond:
+                pending = [e for e in self._events if e["id"] > cursor]
+                if not pending and not self.done:
+                    self._cond.wait(timeout=heartbeat)
+                    pending = [e for e in self._events if e["id"] > cursor]
+                finished = self.done
+
+            if not pending:
+                if finished:
+                    return
+                yield None
+                continue
+
+            for record in pending:
+                cursor = record["id"]
+                yield record
+
+    def summary(self) -> Dict[str, Any]:
+        """任务概要（不含事件内容）"""
+        return {
+            "task_id": self.task_id,
+            "kind": self.kind,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "first_event_id": self.first_event_id,
+            "last_event_id": self.last_event_id,
+        }
+
+
+def read_event_log(events_path: str, after_id: int = 0) -> Iterable[Dict[str, Any]]:
+    """从事件日志文件中读取 ID 大于 after_id 的事件"""
+    if not os.path.exists(events_path):
+        return
+    with open(events_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 进程中途退出时最后一行可能不完整
+                continue
+            if record.get("id", 0) > after_id:
+                yield record
+
+
+def _last_logged_event_id(events_path: str) -> int:
+    """读取日志中最后一个事件 ID，用于新一轮运行继续编号"""
+    last_id = 0
+    for record in read_event_log(events_path):
+        last_id = record["id"]
+    return last_id
+
+
+class TaskManager:
+    """后台任务管理器：有界线程池执行任务，按 task_id 管理事件"""
+
+    # 同时执行的后台任务数（超出的任务排队）
+    MAX_WORKERS = 8
+    # 已结束任务在内存中保留的时长（秒），之后只能从日志文件回放
+    FINISHED_TTL = 3600
+
+    def __init__(self, history_root_dir: Optional[str] = None, max_workers: Optional[int] = None):
+        self.history_root_dir = history_root_dir or os.path.join(
+            os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+            "history"
+        )
+        os.makedirs(self.history_root_dir, exist_ok=True)
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or self.MAX_WORKERS,
+            thread_name_prefix="redink-task"
+        )
+        self._jobs: Dict[str, GenerationJob] = {}
+        self._lock = threading.Lock()
+
+    def _events_path(self, task_id: str) -> str:
+        task_dir = os.path.join(self.history_root_dir, task_id)
+        os.makedirs(task_dir, exist_ok=True)
+        return os.path.join(task_dir, "events.jsonl")
+
+    def submit(
+        self,
+        task_id: str,
+        kind: str,
+        run: Callable[[], Iterable[Dict[str, Any]]]
+    ) -> GenerationJob:
+        """
+        提交后台任务
+
+        Args:
+            task_id: 任务 ID
+            kind: 任务类型
+            run: 无参可调用对象，返回事件迭代器（每项为 {"event", "data"}）
+
+        Returns:
+            GenerationJob
+
+        Raises:
+            RuntimeError: 同一 task_id 已有任务在执行
+        """
+        with self._lock:
+            self._evict_finished()
+
+            existing = self._jobs.get(task_id)
+            if existing is not None and not existing.done:
+                raise RuntimeError(f"任务正在执行中: {task_id}")
+
+            events_path = self._events_path(task_id)
+            start_id = existing.last_event_id if existing else _last_logged_event_id(events_path)
+            job = GenerationJob(task_id, kind, events_path, start_id=start_id)
+            self._jobs[task_id] = job
+
+        job.append("task_start", {"task_id": task_id, "kind": kind})
+        self._executor.submit(self._run_job, job, run)
+        logger.info(f"📋 后台任务已提交: task_id={task_id}, kind={kind}")
+        return job
+
+    def _run_job(self, job: GenerationJob, run: Callable[[], Iterable[Dict[str, Any]]]):
+        """在后台线程中执行任务，把产出的事件写入 job"""
+        job.set_status(GenerationJob.STATUS_RUNNING)
+        try:
+            for event in run():
+                job.append(event["event"], event["data"])
+            job.set_status(GenerationJob.STATUS_FINISHED)
+            logger.info(f"✅ 后台任务完成: task_id={job.task_id}")
+        except Exception as e:
+            error_msg = str(e)
+            logger.error(f"❌ 后台任务异常: task_id={job.task_id}, error={error_msg}")
+            job.append("error", {
+                "status": "error",
+                "message": error_msg,
+                "retryable": True
+            })
+            job.set_status(GenerationJob.STATUS_FAILED, error_msg)
+
+    def get_job(self, task_id: str) -> Optional[GenerationJob]:
+        """获取内存中的任务"""
+        with self._lock:
+            return self._jobs.get(task_id)
+
+    def has_event_log(self, task_id: str) -> bool:
+        """任务是否存在事件日志（用于服务重启后回放）"""
+        return os.path.exists(os.path.join(self.history_root_dir, task_id, "events.jsonl"))
+
+    def iter_events(
+        self,
+        task_id: str,
+        after_id: Optional[int] = None,
+        heartbeat: float = 15.0
+    ) -> Generator[Optional[Dict[str, Any]], None, None]:
+        """
+        订阅任务事件：内存中有任务时回放并继续实时推送，否则从日志文件回放
+
+        Args:
+            task_id: 任务 ID
+            after_id: Last-Event-ID
+            heartbeat: 心跳间隔（秒）
+        """
+        job = self.get_job(task_id)
+        if job is not None:
+            yield from job.iter_events(after_id, heartbeat=heartbeat)
+            return
+
+        events_path = os.path.join(self.history_root_dir, task_id, "events.jsonl")
+        yield from read_event_log(events_path, after_id or 0)
+
+    def _evict_finished(self):
+        """移除过期的已完成任务（调用方持有锁）"""
+        now = time.time()
+        expired = [
+            task_id for task_id, job in self._jobs.items()
+            if job.done and job.finished_at and now - job.finished_at > self.FINISHED_TTL
+        ]
+        for task_id in expired:
+            del self._jobs[task_id]
+
+
+# 全局任务管理器
+_manager_instance = None
+_manager_lock = threading.Lock()
+
+
+def get_task_manager() -> TaskManager:
+    """获取全局后台任务管理器"""
+    global _manager_instance
+    if _manager_instance is None:
+        with _manager_lock:
+            if _manager_instance is None:
+                _manager_instance = TaskManager()
+    return _manager_instance
@@ -0,0 +1,309 @@
+"""
+图片生成任务状态存储
+
+任务上下文（页面、完整大纲、用户参考图、封面图）是重试所必需的，但全部常驻内存会让
+长时间运行的实例随任务数无限增长。这里用一个有上限的 LRU 存储管理它们：
+- 内存中最多保留 MAX_ENTRIES 个任务、MAX_BYTES 字节（按图片数据估算）
+- 超过 IDLE_TTL 未被访问的任务也会移出内存
+- 移出内存的任务落盘到 history/<task_id>/task_state/，下次访问时透明加载
+- 正在生成的任务会被钉住（hold），不会被移出
+
+存储是进程内全局的，不随 reset_image_service()（保存配置）而清空。
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from backend.services.task_context import TaskContext
+from backend.utils.fs import write_file_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class TaskStateStore:
+    """有界的任务上下文存储：LRU + 空闲过期，移出的任务落盘保存"""
+
+    # 内存中最多保留的任务数
+    MAX_ENTRIES = 64
+    # 内存中任务上下文的总大小上限（字节）
+    MAX_BYTES = 128 * 1024 * 1024
+    # 任务空闲多久（秒）后移出内存
+    IDLE_TTL = 1800
+    # 落盘状态的保留时长（秒），过期后不再加载
+    SPILL_TTL = 7 * 24 * 3600
+
+    # 落盘目录和文件名（目录内不放图片扩展名的文件，避免被历史记录扫描当作生成结果）
+    SPILL_DIR = "task_state"
+    STATE_FILE = "state.json"
+    COVER_FILE = "cover.bin"
+    USER_IMAGE_FILE = "user_{}.bin"
+
+    def __init__(
+        self,
+        history_root_dir: Optional[str] = None,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        idle_ttl: Optional[float] = None
+    ):
+        self.history_root_dir = history_root_dir or os.path.join(
+            os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+            "history"
+        )
+        self.max_entries = max_entries or self.MAX_ENTRIES
+        self.max_bytes = max_bytes or self.MAX_BYTES
+        self.idle_ttl = idle_ttl or self.IDLE_TTL
+
+        # task_id -> 上下文，按访问顺序排列（最近访问的在末尾）
+        self._entries: "OrderedDict[str, TaskContext]" = OrderedDict()
+        self._last_access: Dict[str, float] = {}
+        # 被钉住的任务（正在生成）：task_id -> 引用计数
+        self._pins: Dict[str, int] = {}
+        # 正在落盘的任务，落盘完成前仍可从这里读取
+        self._spilling: Dict[str, TaskContext] = {}
+        self._lock = threading.Lock()
+
+        # 统计
+        self._hits = 0
+        self._loads = 0
+        self._misses = 0
+        self._spills = 0
+
+    def task_dir(self, task_id: str) -> str:
+        """任务输出目录"""
+        return os.path.join(self.history_root_dir, task_id)
+
+    def _spill_dir(self, task_id: str) -> str:
+        return os.path.join(self.task_dir(task_id), self.SPILL_DIR)
+
+    def get(self, task_id: str) -> Optional[TaskContext]:
+        """
+        获取任务上下文，内存中没有时尝试从落盘状态加载
+
+        Args:
+            task_id: 任务ID
+
+        Returns:
+            任务上下文，不存在时返回 None
+        """
+        with self._lock:
+            ctx = self._entries.get(task_id)
+            if ctx is not None:
+                self._hits += 1
+                self._touch(task_id)
+                return ctx
+            ctx = self._spilling.get(task_id)
+            if ctx is not None:
+                # 落盘进行中，直接放回内存
+                self._hits += 1
+                self._entries[task_id] = ctx
+                self._touch(task_id)
+                return ctx
+
+        ctx = self._load(task_id)
+
+        with self._lock:
+            if ctx is None:
+                self._misses += 1
+                return None
+            # 加载期间可能已有其他线程放入
+            existing = self._entries.get(task_id)
+            if existing is not None:
+                self._touch(task_id)
+                return existing
+            self._loads += 1
+            self._entries[task_id] = ctx
+            self._touch(task_id)
+            victims = self._select_victims()
+
+        self._spill_all(victims)
+        return ctx
+
+    def put(self, ctx: TaskContext):
+        """放入（或替换）任务上下文"""
+        with self._lock:
+            self._entries[ctx.task_id] = ctx
+            self._spilling.pop(ctx.task_id, None)
+            self._touch(ctx.task_id)
+            victims = self._select_victims()
+
+        self._spill_all(victims)
+
+    def discard(self, task_id: str, remove_spilled: bool = False):
+        """
+        从内存中移除任务上下文
+
+        Args:
+            task_id: 任务ID
+            remove_spilled: 是否同时删除落盘状态
+        """
+        with self._lock:
+            self._entries.pop(task_id, None)
+            self._last_access.pop(task_id, None)
+            self._spilling.pop(task_id, None)
+
+        if remove_spilled:
+            shutil.rmtree(self._spill_dir(task_id), ignore_errors=True)
+
+    @contextmanager
+    def hold(self, task_id: str):
+        """钉住任务上下文：期间不会被移出内存（用于正在进行的生成）"""
+        with self._lock:
+            self._pins[task_id] = self._pins.get(task_id, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                count = self._pins.get(task_id, 0) - 1
+                if count > 0:
+                    self._pins[task_id] = count
+                else:
+                    self._pins.pop(task_id, None)
+                self._touch(task_id)
+                victims = self._select_victims()
+            self._spill_all(victims)
+
+    def stats(self) -> Dict[str, Any]:
+        """存储状态（用于监控）"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "pinned": len(self._pins),
+                "bytes": sum(ctx.memory_size() for ctx in self._entries.values()),
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "idle_ttl": self.idle_ttl,
+                "hits": self._hits,
+                "loads": self._loads,
+                "misses": self._misses,
+                "spills": self._spills
+            }
+
+    def _touch(self, task_id: str):
+        """更新访问时间（调用方持有锁）"""
+        if task_id in self._entries:
+            self._entries.move_to_end(task_id)
+            self._last_access[task_id] = time.time()
+
+    def _select_victims(self) -> List[TaskContext]:
+        """按 空闲过期 → 数量上限 → 大小上限 选出需要移出内存的任务（调用方持有锁）"""
+        now = time.time()
+        victims = []
+
+        def evict(task_id):
+            ctx = self._entries.pop(task_id)
+            self._last_access.pop(task_id, None)
+            self._spilling[task_id] = ctx
+            victims.append(ctx)
+
+        candidates = [task_id for task_id in self._entries if task_id not in self._pins]
+
+        for task_id in list(candidates):
+            if now - self._last_access.get(task_id, now) > self.idle_ttl:
+                evict(task_id)
+                candidates.remove(task_id)
+
+        total_bytes = sum(ctx.memory_size() for ctx in self._entries.values())
+        for task_id in list(candidates):
+            if len(self._entries) <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            total_bytes -= self._entries[task_id].memory_size()
+            evict(task_id)
+
+        return victims
+
+    def _spill_all(self, victims: List[TaskContext]):
+        """把移出内存的任务落盘（在锁外执行磁盘 IO）"""
+        for ctx in victims:
+            try:
+                self._spill(ctx)
+                with self._lock:
+                    self._spills += 1
+                logger.debug(f"任务状态已落盘: task_id={ctx.task_id}")
+            except Exception as e:
+                logger.warning(f"⚠️ 任务状态落盘失败，该任务将无法重试: task_id={ctx.task_id}, error={e}")
+            finally:
+                with self._lock:
+                    # 落盘期间被重新放回内存的任务保留在内存中
+                    if self._spilling.get(ctx.task_id) is ctx:
+                        del self._spilling[ctx.task_id]
+
+    def _spill(self, ctx: TaskContext):
+        """把任务上下文写入 history/<task_id>/task_state/"""
+        spill_dir = self._spill_dir(ctx.task_id)
+        os.makedirs(spill_dir, exist_ok=True)
+
+        user_images = ctx.user_images or []
+        for i, img in enumerate(user_images):
+            write_file_atomic(os.path.join(spill_dir, self.USER_IMAGE_FILE.format(i)), img)
+
+        cover_path = os.path.join(spill_dir, self.COVER_FILE)
+        if ctx.cover_image is not None:
+            write_file_atomic(cover_path, ctx.cover_image)
+        elif os.path.exists(cover_path):
+            os.remove(cover_path)
+
+        state = ctx.to_dict()
+        state["user_image_count"] = len(user_images)
+        state["has_cover"] = ctx.cover_image is not None
+        state["saved_at"] = time.time()
+        # 状态文件最后写入，作为落盘完成的标志
+        write_file_atomic(
+            os.path.join(spill_dir, self.STATE_FILE),
+            json.dumps(state, ensure_ascii=False).encode("utf-8")
+        )
+
+    def _load(self, task_id: str) -> Optional[TaskContext]:
+        """从落盘状态还原任务上下文"""
+        spill_dir = self._spill_dir(task_id)
+        state_path = os.path.join(spill_dir, self.STATE_FILE)
+        if not os.path.exists(state_path):
+            return None
+
+        try:
+            with open(state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+
+            if time.time() - state.get("saved_at", 0) > self.SPILL_TTL:
+                logger.debug(f"任务落盘状态已过期: task_id={task_id}")
+                return None
+
+            cover_image = None
+            if state.get("has_cover"):
+                with open(os.path.join(spill_dir, self.COVER_FILE), "rb") as f:
+                    cover_image = f.read()
+
+            user_images = None
+            count = state.get("user_image_count", 0)
+            if count:
+                user_images = []
+                for i in range(count):
+                    with open(os.path.join(spill_dir, self.USER_IMAGE_FILE.format(i)), "rb") as f:
+                        user_images.append(f.read())
+
+            logger.debug(f"从磁盘加载任务状态: task_id={task_id}")
+            return TaskContext.from_dict(state, self.task_dir(task_id), cover_image, user_images)
+
+        except Exception as e:
+            logger.warning(f"⚠️ 任务落盘状态读取失败: task_id={task_id}, error={e}")
+            return None
+
+
+# 全局任务状态存储（不随 ImageService 重建而清空）
+_store_instance = None
+_store_lock = threading.Lock()
+
+
+def get_task_state_store() -> TaskStateStore:
+    """获取全局任务状态存储"""
+    global _store_instance
+    if _store_instance is None:
+        with _store_lock:
+            if _store_instance is None:
+                _store_instance = TaskStateStore()
+    return _store_instance
@@ -0,0 +1,136 @@
+"""
+缩略图生成
+
+缩略图（thumb_<文件名>，50KB 左右）不再在生图线程里同步生成：
+- 原图落盘后提交到后台线程池生成，不阻塞页面完成事件
+- 获取缩略图时如果还没生成（或已过期），当场生成并写入磁盘，之后直接复用
+"""
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+
+from backend.utils.fs import write_file_atomic
+from backend.utils.image_processor import get_image_processor
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_PREFIX = "thumb_"
+
+
+def thumbnail_filename(filename: str) -> str:
+    """原图对应的缩略图文件名"""
+    return f"{THUMBNAIL_PREFIX}{filename}"
+
+
+class ThumbnailService:
+    """缩略图服务：后台生成 + 按需生成，结果缓存在任务目录"""
+
+    # 调度缩略图生成的线程数（编码本身在图片处理进程池中执行）
+    MAX_WORKERS = 2
+    # 缩略图目标大小（KB）
+    THUMBNAIL_SIZE_KB = 50
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or self.MAX_WORKERS,
+            thread_name_prefix="redink-thumb"
+        )
+        # 原图路径 -> 进行中的生成任务（同一张图只生成一次）
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def schedule(self, image_path: str) -> Future:
+        """
+        提交后台生成缩略图
+
+        Args:
+            image_path: 原图路径
+
+        Returns:
+            生成任务（结果为缩略图路径）
+        """
+        with self._lock:
+            future = self._pending.get(image_path)
+            if future is not None and not future.done():
+                return future
+            future = self._executor.submit(self._build, image_path)
+            self._pending[image_path] = future
+
+        # 在锁外注册回调：任务已完成时回调会立即在当前线程执行
+        future.add_done_callback(lambda f, path=image_path: self._forget(path, f))
+        return future
+
+    def ensure_thumbnail(self, image_path: str) -> Optional[str]:
+        """
+        获取缩略图路径，不存在或比原图旧时立即生成
+
+        Args:
+            image_path: 原图路径
+
+        Returns:
+            缩略图路径，原图不存在或生成失败时返回 None
+        """
+        if not os.path.exists(image_path):
+            return None
+
+        thumb_path = self._thumbnail_path(image_path)
+        if self._is_fresh(image_path, thumb_path):
+            return thumb_path
+
+        # 后台正在生成时等待它完成，否则当场生成
+        try:
+            return self.schedule(image_path).result()
+        except Exception as e:
+            logger.warning(f"⚠️ 缩略图生成失败: {image_path}, error={e}")
+            return None
+
+    def _build(self, image_path: str) -> str:
+        """生成缩略图并写入磁盘"""
+        thumb_path = self._thumbnail_path(image_path)
+        if self._is_fresh(image_path, thumb_path):
+            return thumb_path
+
+        with open(image_path, "rb") as f:
+            image_data = f.read()
+
+        thumbnail_data = get_image_processor().compress(image_data, max_size_kb=self.THUMBNAIL_SIZE_KB)
+        write_file_atomic(thumb_path, thumbnail_data)
+        logger.debug(f"缩略图已生成: {thumb_path}")
+        return thumb_path
+
+    def _forget(self, image_path: str, future: Future):
+        with self._lock:
+            if self._pending.get(image_path) is future:
+                del self._pending[image_path]
+        if future.exception() is not None:
+            logger.warning(f"⚠️ 后台缩略图生成失败: {image_path}, error={future.exception()}")
+
+    @staticmethod
+    def _thumbnail_path(image_path: str) -> str:
+        directory, filename = os.path.split(image_path)
+        return os.path.join(directory, thumbnail_filename(filename))
+
+    @staticmethod
+    def _is_fresh(image_path: str, thumb_path: str) -> bool:
+        """缩略图存在且不早于原图（重新生成的原图会让旧缩略图失效）"""
+        try:
+            return os.path.getmtime(thumb_path) >= os.path.getmtime(image_path)
+        except OSError:
+            return False
+
+
+# 全局缩略图服务
+_thumbnail_instance = None
+_thumbnail_lock = threading.Lock()
+
+
+def get_thumbnail_service() -> ThumbnailService:
+    """获取全局缩略图服务"""
+    global _thumbnail_instance
+    if _thumbnail_instance is None:
+        with _thumbnail_lock:
+            if _thumbnail_instance is None:
+                _thumbnail_instance = ThumbnailService()
+    return _thumbnail_instance
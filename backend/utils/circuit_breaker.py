@@ -0,0 +1,289 @@
+"""
+服务商熔断器
+
+服务商宕机时，每个任务的每一页仍会完整走一遍重试流程才失败，大量线程停在退避等待里，
+用户要等几分钟才看到错误。熔断器按服务商统计最近的调用结果：
+- closed（正常）：放行所有调用，最近的调用中失败过多时进入 open
+- open（熔断）：直接拒绝调用（CircuitOpenError，不重试），冷却时间过后进入 half_open
+- half_open（探测）：只放行少量探测调用，成功则恢复 closed，失败则重新 open
+
+只有说明服务商不健康的错误（5xx、网络错误、未知错误）计入失败；限流由并发控制器处理，
+认证失败、安全过滤等请求本身的问题说明服务商是可达的，按成功处理。
+"""
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Dict, Optional
+
+from .retry import ERROR_NETWORK, ERROR_SERVER, ERROR_UNKNOWN, ProviderError, classify_error
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+ERROR_CIRCUIT_OPEN = "circuit_open"
+
+# 计入熔断统计的错误类型
+HEALTH_ERRORS = {ERROR_SERVER, ERROR_NETWORK, ERROR_UNKNOWN}
+
+
+class CircuitOpenError(ProviderError):
+    """熔断期间拒绝调用（不可重试）"""
+
+    def __init__(self, breaker_name: str, retry_in: float):
+        super().__init__(
+            f"⚠️ 服务商 {breaker_name} 暂时不可用（最近的请求连续失败，已熔断）\n\n"
+            f"约 {max(1, int(retry_in))} 秒后会自动探测恢复，请稍后重试。",
+            kind=ERROR_CIRCUIT_OPEN,
+            retryable=False,
+            retry_after=retry_in
+        )
+        self.breaker_name = breaker_name
+
+
+class CircuitBreaker:
+    """单个服务商的熔断器"""
+
+    # 统计最近多少次调用
+    WINDOW_SIZE = 20
+    # 窗口内失败次数达到该值、且失败率不低于 FAILURE_RATE 时熔断
+    FAILURE_THRESHOLD = 5
+    FAILURE_RATE = 0.5
+    # 熔断后多久开始探测（秒）
+    RECOVERY_TIMEOUT = 30.0
+    # 探测状态下同时放行的调用数
+    HALF_OPEN_MAX_CALLS = 1
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: Optional[int] = None,
+        recovery_timeout: Optional[float] = None,
+        window_size: Optional[int] = None
+    ):
+        """
+        Args:
+            name: 熔断器名称（如 image:gemini）
+            failure_threshold: 触发熔断的失败次数
+            recovery_timeout: 熔断后开始探测的等待时间（秒）
+            window_size: 统计窗口大小（调用次数）
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold or self.FAILURE_THRESHOLD
+        self.recovery_timeout = recovery_timeout or self.RECOVERY_TIMEOUT
+
+        self._outcomes = deque(maxlen=max(window_size or self.WINDOW_SIZE, self.failure_threshold))
+        self._state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._last_error: Optional[str] = None
+        self._lock = threading.Lock()
+
+        # 统计
+        self._rejected = 0
+        self._opened_count = 0
+
+    def configure(self, failure_threshold: Optional[int] = None, recovery_timeout: Optional[float] = None):
+        """更新参数（配置变更时调用）"""
+        with self._lock:
+            if failure_threshold:
+                self.failure_threshold = failure_threshold
+                if self._outcomes.maxlen < failure_threshold:
+                    self._outcomes = deque(self._outcomes, maxlen=failure_threshold)
+            if recovery_timeout:
+                self.recovery_timeout = recovery_timeout
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        """当前状态（冷却结束时 open 转为 half_open；调用方持有锁）"""
+        if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = STATE_HALF_OPEN
+            self._probes = 0
+            logger.info(f"⏳ 熔断器 [{self.name}] 冷却结束，开始探测恢复")
+        return self._state
+
+    def _retry_in(self) -> float:
+        """距离开始探测的剩余秒数（调用方持有锁）"""
+        if self._state != STATE_OPEN:
+            return 0.0
+        return max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+
+    def before_call(self):
+        """
+        调用前检查，熔断期间抛出 CircuitOpenError
+
+        Returns:
+            本次调用是否为探测调用
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == STATE_CLOSED:
+                return False
+            if state == STATE_HALF_OPEN and self._probes < self.HALF_OPEN_MAX_CALLS:
+                self._probes += 1
+                return True
+            self._rejected += 1
+            retry_in = self._retry_in() or self.recovery_timeout
+        raise CircuitOpenError(self.name, retry_in)
+
+    def record_success(self, probe: bool = False):
+        """记录一次成功调用"""
+        with self._lock:
+            if probe:
+                self._probes = max(0, self._probes - 1)
+            if self._state == STATE_HALF_OPEN:
+                self._state = STATE_CLOSED
+                self._outcomes.clear()
+                logger.info(f"✅ 熔断器 [{self.name}] 探测成功，已恢复")
+            self._outcomes.append(True)
+
+    def record_failure(self, error: Exception, probe: bool = False):
+        """
+        记录一次失败调用（只有服务商健康相关的错误计入熔断统计）
+
+        Args:
+            error: 调用抛出的异常
+            probe: 是否为探测调用
+        """
+        if classify_error(error) not in HEALTH_ERRORS:
+            self.record_success(probe)
+            return
+
+        with self._lock:
+            if probe:
+                self._probes = max(0, self._probes - 1)
+            self._last_error = str(error)[:200]
+            self._outcomes.append(False)
+
+            if self._state == STATE_HALF_OPEN:
+                self._trip("探测失败")
+                return
+
+            failures = self._outcomes.count(False)
+            if (
+                self._state == STATE_CLOSED
+                and failures >= self.failure_threshold
+                and failures / len(self._outcomes) >= self.FAILURE_RATE
+            ):
+                self._trip(f"最近 {len(self._outcomes)} 次调用失败 {failures} 次")
+
+    def _trip(self, reason: str):
+        """进入熔断状态（调用方持有锁）"""
+        self._state = STATE_OPEN
+        self._opened_at = time.monotonic()
+        self._probes = 0
+        self._opened_count += 1
+        logger.warning(f"⚡ 熔断器 [{self.name}] 已熔断（{reason}），{self.recovery_timeout:.0f}秒后探测恢复")
+
+    @contextmanager
+    def guard(self):
+        """
+        保护一次调用：熔断时直接拒绝，调用结果计入统计
+
+        用法：
+            with breaker.guard():
+                call_provider()
+        """
+        probe = self.before_call()
+        try:
+            yield
+        except Exception as e:
+            self.record_failure(e, probe)
+            raise
+        else:
+            self.record_success(probe)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """简要状态（附在 SSE 错误事件中）"""
+        with self._lock:
+            state = self._current_state()
+            return {
+                "name": self.name,
+                "state": state,
+                "retry_in": round(self._retry_in(), 1)
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        """完整状态（用于监控）"""
+        with self._lock:
+            state = self._current_state()
+            return {
+                "state": state,
+                "retry_in": round(self._retry_in(), 1),
+                "window": len(self._outcomes),
+                "failures": self._outcomes.count(False),
+                "failure_threshold": self.failure_threshold,
+                "recovery_timeout": self.recovery_timeout,
+                "opened_count": self._opened_count,
+                "rejected": self._rejected,
+                "last_error": self._last_error
+            }
+
+
+def guarded_by_breaker(func):
+    """
+    方法装饰器：用实例的 breaker 属性保护每次调用
+
+    与 with_retry 一起使用时放在内层，每次尝试都经过熔断器；熔断时抛出的
+    CircuitOpenError 不可重试，调用立即失败。
+    """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        breaker = getattr(self, "breaker", None)
+        if breaker is None:
+            return func(self, *args, **kwargs)
+        with breaker.guard():
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+# 全局熔断器注册表：类别:服务商名 -> 熔断器（进程内共享，所有任务共用同一份健康状态）
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(category: str, provider_name: str, provider_config: Optional[Dict[str, Any]] = None) -> CircuitBreaker:
+    """
+    获取服务商的熔断器
+
+    Args:
+        category: 类别（image / text）
+        provider_name: 服务商名称
+        provider_config: 服务商配置，可包含 breaker_failure_threshold / breaker_recovery_seconds
+
+    Returns:
+        熔断器（同名服务商共享）
+    """
+    provider_config = provider_config or {}
+    failure_threshold = provider_config.get('breaker_failure_threshold')
+    recovery_timeout = provider_config.get('breaker_recovery_seconds')
+    key = f"{category}:{provider_name}"
+
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(
+                key,
+                failure_threshold=failure_threshold,
+                recovery_timeout=recovery_timeout
+            )
+            return breaker
+
+    breaker.configure(failure_threshold, recovery_timeout)
+    return breaker
+
+
+def get_all_breaker_stats() -> Dict[str, Dict[str, Any]]:
+    """获取所有熔断器的状态"""
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {key: breaker.stats() for key, breaker in breakers.items()}
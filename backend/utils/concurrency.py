@@ -0,0 +1,388 @@
+"""
+自适应并发控制（AIMD）
+
+限制器按服务商名称在进程内全局共享：同一进程中所有任务（生成、重试、重新生成）
+都从同一个并发预算中申请槽位，负载按服务商配额而不是打开的页面数来控制。
+"""
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# 限流相关关键字（包含各生成器转换后的中文错误信息）
+RATE_LIMIT_KEYWORDS = [
+    "429", "resource_exhausted", "rate limit", "rate_limit", "too many requests",
+    "速率限制", "频率超限", "限流",
+]
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """判断异常是否为服务商限流（429 / RESOURCE_EXHAUSTED）"""
+    # 已分类的异常（见 retry.ProviderError）直接按分类判断
+    if getattr(error, "kind", None) == "rate_limit" or getattr(error, "status_code", None) == 429:
+        return True
+    error_str = str(error).lower()
+    return any(keyword in error_str for keyword in RATE_LIMIT_KEYWORDS)
+
+
+def parse_retry_after(error: Exception) -> Optional[float]:
+    """
+    从异常中提取服务商建议的等待时间（秒）
+
+    优先使用异常对象上的 retry_after 属性，其次解析错误信息中的
+    Retry-After 或 Google API 的 retryDelay 字段
+    """
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        try:
+            return float(retry_after)
+        except (TypeError, ValueError):
+            pass
+
+    error_str = str(error)
+    match = re.search(r"retry[-_ ]?after\W{0,3}(\d+(?:\.\d+)?)", error_str, re.IGNORECASE)
+    if match:
+        return float(match.group(1))
+
+    match = re.search(r"retryDelay\W{0,4}(\d+(?:\.\d+)?)s", error_str)
+    if match:
+        return float(match.group(1))
+
+    return None
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD 并发限制器
+
+    - 慢启动：每次成功 +1，直到首次退避（类似 TCP 慢启动）
+    - 加性增：之后每完成一轮（limit 次）健康请求 +1
+    - 乘性减：遇到 429 / RESOURCE_EXHAUSTED 时减半，并按 Retry-After 暂停放行；
+      其他错误或延迟明显升高时小幅下调
+    """
+
+    def __init__(
+        self,
+        name: str,
+        min_limit: int = 1,
+        max_limit: int = 15,
+        initial_limit: Optional[int] = None,
+        latency_tolerance: float = 2.0,
+        error_rate_threshold: float = 0.3,
+        window_size: int = 20,
+        requests_per_minute: Optional[float] = None
+    ):
+        """
+        Args:
+            name: 限制器名称（一般为服务商名称）
+            min_limit: 最小并发数
+            max_limit: 最大并发数
+            initial_limit: 初始并发数（默认等于 min_limit）
+            latency_tolerance: 延迟超过基线多少倍视为拥塞
+            error_rate_threshold: 最近窗口内非限流错误率超过该值时下调并发
+            window_size: 错误率统计窗口大小
+            requests_per_minute: 每分钟请求数上限（令牌桶，可选）
+        """
+        self.name = name
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.error_rate_threshold = error_rate_threshold
+        self.window_size = window_size
+
+        initial = initial_limit if initial_limit is not None else self.min_limit
+        self._limit = float(min(max(initial, self.min_limit), self.max_limit))
+        # 慢启动阈值：首次退避前为 max_limit
+        self._ssthresh = float(self.max_limit)
+
+        # 令牌桶（按服务商 RPM 配额限速，可选）
+        self.requests_per_minute = requests_per_minute
+        self._tokens = float(self.max_limit)
+        self._tokens_updated = time.monotonic()
+
+        self._in_flight = 0
+        self._waiting = 0
+        self._blocked_until = 0.0
+        self._latency_baseline: Optional[float] = None
+        self._recent_outcomes: list = []
+
+        # 统计
+        self._successes = 0
+        self._failures = 0
+        self._rate_limited = 0
+
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        """当前并发上限"""
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        """当前正在执行的请求数"""
+        return self._in_flight
+
+    def acquire(
+        self,
+        timeout: Optional[float] = None,
+        on_wait: Optional[Callable[[int], None]] = None
+    ) -> bool:
+        """
+        获取一个并发槽位（阻塞直到有空闲槽位或超时）
+
+        Args:
+            timeout: 最长等待时间（秒），None 表示一直等待
+            on_wait: 需要排队时回调一次，参数为当前排队位置（从 1 开始）
+
+        Returns:
+            是否成功获取
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        queued = False
+        with self._cond:
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait_for = None
+                    if now < self._blocked_until:
+                        wait_for = self._blocked_until - now
+                    elif self._in_flight < self.limit:
+                        token_wait = self._take_token(now)
+                        if token_wait <= 0:
+                            self._in_flight += 1
+                            return True
+                        wait_for = token_wait
+
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            return False
+                        wait_for = min(wait_for, remaining) if wait_for is not None else remaining
+
+                    if not queued:
+                        queued = True
+                        self._waiting += 1
+                        if on_wait is not None:
+                            on_wait(self._waiting)
+
+                    self._cond.wait(timeout=wait_for)
+            finally:
+                if queued:
+                    self._waiting -= 1
+
+    def _take_token(self, now: float) -> float:
+        """
+        从令牌桶取一个令牌（调用方持有锁）
+
+        Returns:
+            0 表示取到令牌；否则为需要等待的秒数
+        """
+        if not self.requests_per_minute:
+            return 0.0
+        rate = self.requests_per_minute / 60.0
+        self._tokens = min(float(self.max_limit), self._tokens + (now - self._tokens_updated) * rate)
+        self._tokens_updated = now
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return 0.0
+        return (1.0 - self._tokens) / rate
+
+    def release(self):
+        """释放槽位"""
+        with self._cond:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._cond.notify_all()
+
+    def try_acquire(self) -> bool:
+        """有空闲槽位时立即获取，否则返回 False（不排队）"""
+        return self.acquire(timeout=0)
+
+    @contextmanager
+    def slot(self, on_wait: Optional[Callable[[int], None]] = None, acquired: bool = False):
+        """
+        获取槽位的上下文管理器，自动记录结果（失败只记录与负载相关的错误）
+
+        Args:
+            on_wait: 需要排队时的回调
+            acquired: 槽位已通过 try_acquire() 取得，只负责释放和记录结果
+        """
+        # 延迟导入：retry 模块依赖本模块
+        from .retry import ERROR_NETWORK, ERROR_RATE_LIMIT, ERROR_SERVER, classify_error
+
+        if not acquired:
+            self.acquire(on_wait=on_wait)
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.release()
+            # 只有限流、服务端和网络（含超时）错误反映服务商的负载；鉴权、参数、安全过滤、熔断拒绝等
+            # 错误与并发无关，只释放槽位，不影响并发上限
+            if classify_error(e) in (ERROR_RATE_LIMIT, ERROR_SERVER, ERROR_NETWORK):
+                self.record_failure(e)
+            raise
+        else:
+            self.release()
+            self.record_success(time.monotonic() - start)
+
+    def record_success(self, latency: float):
+        """记录一次成功请求及其耗时（秒）"""
+        with self._cond:
+            self._successes += 1
+            self._push_outcome(True)
+
+            congested = False
+            if self._latency_baseline is None:
+                self._latency_baseline = latency
+            else:
+                congested = latency > self._latency_baseline * self.latency_tolerance
+                # 基线取慢速 EWMA，避免被单次长尾拉高
+                self._latency_baseline = 0.9 * self._latency_baseline + 0.1 * latency
+
+            if congested:
+                self._decrease(0.9)
+            elif self._limit < self._ssthresh:
+                # 慢启动
+                self._limit = min(self._limit + 1, self.max_limit)
+            else:
+                # 拥塞避免：每轮 +1
+                self._limit = min(self._limit + 1.0 / max(self._limit, 1.0), self.max_limit)
+
+            self._cond.notify_all()
+
+    def record_failure(self, error: Exception):
+        """记录一次失败请求，按错误类型调整并发"""
+        with self._cond:
+            self._failures += 1
+
+            if is_rate_limit_error(error):
+                self._rate_limited += 1
+                self._decrease(0.5)
+                retry_after = parse_retry_after(error)
+                if retry_after:
+                    self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+                logger.warning(
+                    f"⏳ [{self.name}] 触发限流，并发上限降至 {self.limit}"
+                    + (f"，暂停 {retry_after:.0f} 秒" if retry_after else "")
+                )
+            else:
+                self._push_outcome(False)
+                errors = self._recent_outcomes.count(False)
+                if len(self._recent_outcomes) >= 5 and errors / len(self._recent_outcomes) > self.error_rate_threshold:
+                    self._decrease(0.75)
+                    logger.warning(f"⚠️ [{self.name}] 错误率过高，并发上限降至 {self.limit}")
+
+            self._cond.notify_all()
+
+    def _decrease(self, factor: float):
+        """乘性减（调用方持有锁）"""
+        self._limit = max(float(self.min_limit), self._limit * factor)
+        self._ssthresh = max(float(self.min_limit), self._limit)
+
+    def _push_outcome(self, ok: bool):
+        self._recent_outcomes.append(ok)
+        if len(self._recent_outcomes) > self.window_size:
+            self._recent_outcomes.pop(0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前状态快照（用于监控接口）"""
+        with self._cond:
+            blocked_for = max(0.0, self._blocked_until - time.monotonic())
+            return {
+                "name": self.name,
+                "limit": self.limit,
+                "in_flight": self._in_flight,
+                "queued": self._waiting,
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "latency_baseline_ms": round(self._latency_baseline * 1000) if self._latency_baseline else None,
+                "blocked_for_seconds": round(blocked_for, 1),
+                "requests_per_minute": self.requests_per_minute,
+                "successes": self._successes,
+                "failures": self._failures,
+                "rate_limited": self._rate_limited,
+            }
+
+    def configure(self, min_limit: int, max_limit: int, requests_per_minute: Optional[float] = None):
+        """更新并发上下限（配置变更时调用，保留当前已学习到的并发水平）"""
+        with self._cond:
+            self.min_limit = max(1, int(min_limit))
+            self.max_limit = max(self.min_limit, int(max_limit))
+            self._limit = float(min(max(self._limit, self.min_limit), self.max_limit))
+            self._ssthresh = float(min(max(self._ssthresh, self.min_limit), self.max_limit))
+            self.requests_per_minute = requests_per_minute
+            self._cond.notify_all()
+
+    @classmethod
+    def from_provider_config(cls, name: str, provider_config: Dict[str, Any]) -> "AdaptiveConcurrencyLimiter":
+        """
+        根据服务商配置创建限制器
+
+        配置项：
+        - max_concurrency: 最大并发数（默认 15）
+        - min_concurrency: 最小并发数（默认 1）
+        - initial_concurrency: 初始并发数
+        - requests_per_minute: 每分钟请求数上限（可选）
+        - high_concurrency: 兼容旧配置，为 true 时初始并发直接取最大值
+        """
+        max_limit, min_limit, rpm = _limits_from_config(provider_config)
+        initial = provider_config.get('initial_concurrency')
+        if initial is None:
+            initial = max_limit if provider_config.get('high_concurrency', False) else min_limit
+        return cls(
+            name,
+            min_limit=min_limit,
+            max_limit=max_limit,
+            initial_limit=int(initial),
+            requests_per_minute=rpm
+        )
+
+
+def _limits_from_config(provider_config: Dict[str, Any]):
+    """从服务商配置中读取 (max_limit, min_limit, requests_per_minute)"""
+    max_limit = int(provider_config.get('max_concurrency', 15))
+    min_limit = int(provider_config.get('min_concurrency', 1))
+    rpm = provider_config.get('requests_per_minute')
+    return max_limit, min_limit, float(rpm) if rpm else None
+
+
+# 进程内全局的服务商限制器（按服务商名称）
+_limiters: Dict[str, AdaptiveConcurrencyLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_provider_limiter(name: str, provider_config: Dict[str, Any]) -> AdaptiveConcurrencyLimiter:
+    """
+    获取服务商的全局并发限制器
+
+    同名服务商在进程内共享同一个限制器；配置更新后沿用已学习到的并发水平，仅更新上下限
+
+    Args:
+        name: 服务商名称
+        provider_config: 服务商配置
+
+    Returns:
+        AdaptiveConcurrencyLimiter
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = AdaptiveConcurrencyLimiter.from_provider_config(name, provider_config)
+            _limiters[name] = limiter
+        else:
+            max_limit, min_limit, rpm = _limits_from_config(provider_config)
+            limiter.configure(min_limit, max_limit, rpm)
+        return limiter
+
+
+def get_all_limiter_states() -> Dict[str, Dict[str, Any]]:
+    """所有服务商限制器的状态快照"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.snapshot() for limiter in limiters}
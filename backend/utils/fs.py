@@ -0,0 +1,31 @@
+"""文件读写工具"""
+import os
+import threading
+
+
+def write_file_atomic(path: str, data: bytes, durable: bool = False):
+    """
+    原子写文件：先写临时文件再替换，读取方不会看到写了一半的文件
+
+    Args:
+        path: 目标路径
+        data: 文件内容
+        durable: 是否在替换前 fsync，确保掉电后数据仍在
+    """
+    # 临时文件不使用图片扩展名，避免被历史记录扫描当作生成结果；
+    # 文件名带线程 ID，同一文件的并发写入不会共用一个临时文件
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        # 写入失败（磁盘满等）时不留下临时文件
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
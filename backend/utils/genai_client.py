@@ -1,71 +1,26 @@
 """Google GenAI 客户端封装"""
-import time
-import random
-from functools import wraps
-from typing import Generator, Union
+import threading
+from typing import Dict, Generator, Optional, Union
 from google import genai
 from google.genai import types
 
 # 导入统一的错误解析函数
 from ..generators.google_genai import parse_genai_error
-
-
-def retry_on_429(max_retries=3, base_delay=2):
-    """429 错误自动重试装饰器（带智能错误解析）"""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            last_error = None
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    last_error = e
-                    error_str = str(e).lower()
-
-                    # 不可重试的错误类型
-                    non_retryable = [
-                        "401", "unauthenticated",  # 认证错误
-                        "403", "permission_denied", "forbidden",  # 权限错误
-                        "404", "not_found",  # 资源不存在
-                        "invalid_argument",  # 参数错误
-                        "safety", "blocked", "filter",  # 安全过滤
-                    ]
-
-                    should_retry = True
-                    for keyword in non_retryable:
-                        if keyword in error_str:
-                            should_retry = False
-                            break
-
-                    if not should_retry:
-                        # 直接抛出，不重试
-                        raise Exception(parse_genai_error(e))
-
-                    # 可重试的错误
-                    if attempt < max_retries - 1:
-                        if "429" in error_str or "resource_exhausted" in error_str:
-                            wait_time = (base_delay ** attempt) + random.uniform(0, 1)
-                            print(f"[重试] 遇到资源限制，{wait_time:.1f}秒后重试 (尝试 {attempt + 2}/{max_retries})")
-                        else:
-                            wait_time = min(2 ** attempt, 10) + random.uniform(0, 1)
-                            print(f"[重试] 请求失败，{wait_time:.1f}秒后重试 (尝试 {attempt + 2}/{max_retries})")
-                        time.sleep(wait_time)
-                        continue
-
-                    # 重试次数耗尽
-                    raise Exception(parse_genai_error(e))
-
-            # 理论上不会到这里，但保险起见
-            raise Exception(parse_genai_error(last_error))
-        return wrapper
-    return decorator
+from .circuit_breaker import CircuitBreaker, get_circuit_breaker, guarded_by_breaker
+from .key_pool import ApiKeyPool, with_api_key
+from .retry import RetryPolicy, with_retry
 
 
 class GenAIClient:
     """GenAI 客户端封装类（已弃用，请使用 GoogleGenAIGenerator）"""
 
-    def __init__(self, api_key: str = None, base_url: str = None):
+    def __init__(
+        self,
+        api_key: str = None,
+        base_url: str = None,
+        breaker: Optional[CircuitBreaker] = None,
+        key_pool: Optional[ApiKeyPool] = None
+    ):
         self.api_key = api_key
         if not self.api_key:
             raise ValueError(
@@ -73,21 +28,18 @@ class GenAIClient:
                 "解决方案：在系统设置页面编辑该服务商，填写 API Key"
             )
 
-        # 构建客户端参数
-        client_kwargs = {"api_key": self.api_key}
+        self.base_url = base_url
+        self.client = self._create_client(self.api_key)
 
-        # 如果有 base_url，使用 http_options
-        if base_url:
-            client_kwargs["http_options"] = {
-                "base_url": base_url,
-                "api_version": "v1beta"
-            }
+        # 每个 Key 一个 SDK 客户端（按需创建）
+        self._clients: Dict[str, genai.Client] = {self.api_key: self.client}
+        self._clients_lock = threading.Lock()
 
-        # 默认使用 Gemini API (vertexai=False)，因为大多数用户使用 Google AI Studio 的 API Key
-        # Vertex AI 需要 OAuth2 认证，不支持 API Key
-        client_kwargs["vertexai"] = False
+        # 服务商熔断器（服务商不可用时快速失败）
+        self.breaker = breaker or get_circuit_breaker("text", "google_gemini")
 
-        self.client = genai.Client(**client_kwargs)
+        # API Key 池（配置多个 Key 时每次请求轮换 Key，未配置时始终使用 api_key）
+        self.key_pool = key_pool
 
         # 默认安全设置：全部关闭
         self.default_safety_settings = [
@@ -97,7 +49,46 @@ class GenAIClient:
             types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="OFF"),
         ]
 
-    @retry_on_429(max_retries=3, base_delay=2)
+    def _create_client(self, api_key: str) -> genai.Client:
+        """创建 SDK 客户端"""
+        # 构建客户端参数
+        client_kwargs = {"api_key": api_key}
+
+        # 如果有 base_url，使用 http_options
+        if self.base_url:
+            client_kwargs["http_options"] = {
+                "base_url": self.base_url,
+                "api_version": "v1beta"
+            }
+
+        # 默认使用 Gemini API (vertexai=False)，因为大多数用户使用 Google AI Studio 的 API Key
+        # Vertex AI 需要 OAuth2 认证，不支持 API Key
+        client_kwargs["vertexai"] = False
+
+        return genai.Client(**client_kwargs)
+
+    def _client_for(self, api_key: Optional[str]) -> genai.Client:
+        """获取 Key 对应的 SDK 客户端"""
+        if not api_key:
+            return self.client
+        with self._clients_lock:
+            client = self._clients.get(api_key)
+            if client is None:
+                client = self._clients[api_key] = self._create_client(api_key)
+            return client
+
+    @staticmethod
+    def _stream_text(response_stream) -> Generator[str, None, None]:
+        """从流式响应中逐块取出文本（跳过没有内容的块）"""
+        for chunk in response_stream:
+            if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
+                continue
+            if chunk.text:
+                yield chunk.text
+
+    @with_retry(RetryPolicy(max_attempts=3), format_error=parse_genai_error)
+    @guarded_by_breaker
+    @with_api_key
     def generate_text(
         self,
         prompt: str,
@@ -109,6 +100,7 @@ class GenAIClient:
         images: list = None,
         system_prompt: str = None,
         stream: bool = False,
+        api_key: Optional[str] = None,
         **kwargs
     ) -> Union[str, Generator[str, None, None]]:
         """
@@ -123,10 +115,12 @@ class GenAIClient:
             use_thinking: 是否启用思考模式
             images: 图片列表（暂不支持）
             system_prompt: 系统提示词（暂不支持）
+            api_key: 本次请求使用的 Key（由 Key 池分配，默认使用 api_key）
 
         Returns:
             生成的文本
         """
+        client = self._client_for(api_key)
         parts = [types.Part(text=prompt)]
 
         if images:
@@ -165,23 +159,26 @@ class GenAIClient:
 
         # 如果是流式模式，返回生成器
         if stream:
+            chunks = self._stream_text(client.models.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=generate_content_config,
+            ))
+            # generate_content_stream 在第一次迭代时才发出请求：在这里（熔断器和 Key 池保护的调用内）取出第一个文本块，
+            # 限流 / 认证失败等错误才会计入熔断器、让 Key 冷却或停用，并按重试策略换 Key 重试
+            first_chunk = next(chunks, None)
+
             def stream_generator():
                 """流式生成文本的生成器"""
-                for chunk in self.client.models.generate_content_stream(
-                    model=model,
-                    contents=contents,
-                    config=generate_content_config,
-                ):
-                    if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
-                        continue
-                    if chunk.text:
-                        yield chunk.text
+                if first_chunk is not None:
+                    yield first_chunk
+                yield from chunks
 
             return stream_generator()
         else:
             # 同步模式，累积所有文本
             result = ""
-            for chunk in self.client.models.generate_content_stream(
+            for chunk in client.models.generate_content_stream(
                 model=model,
                 contents=contents,
                 config=generate_content_config,
@@ -192,13 +189,16 @@ class GenAIClient:
 
             return result
 
-    @retry_on_429(max_retries=5, base_delay=3)  # 图片生成重试更多次
+    @with_retry(RetryPolicy(max_attempts=5), format_error=parse_genai_error)  # 图片生成重试更多次
+    @guarded_by_breaker
+    @with_api_key
     def generate_image(
         self,
         prompt: str,
         model: str = "gemini-3-pro-image-preview",
         aspect_ratio: str = "3:4",
         temperature: float = 1.0,
+        api_key: Optional[str] = None,
     ) -> bytes:
         """
         生成图片
@@ -208,10 +208,12 @@ class GenAIClient:
             model: 模型名称
             aspect_ratio: 宽高比
             temperature: 温度
+            api_key: 本次请求使用的 Key（由 Key 池分配，默认使用 api_key）
 
         Returns:
             图片二进制数据
         """
+        client = self._client_for(api_key)
         contents = [
             types.Content(
                 role="user",
@@ -232,7 +234,7 @@ class GenAIClient:
         )
 
         image_data = None
-        for chunk in self.client.models.generate_content_stream(
+        for chunk in client.models.generate_content_stream(
             model=model,
             contents=contents,
             config=generate_content_config,
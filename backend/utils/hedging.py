@@ -0,0 +1,198 @@
+"""
+对冲请求（hedged requests）
+
+图片服务商的耗时长尾很重：一页卡住会让整个任务在其他页面都完成后继续等待。
+对冲的做法是：请求耗时超过最近耗时的某个分位数后，再发一个相同的请求（同一服务商或备用服务商），
+先返回的结果胜出，其余请求的结果直接丢弃。
+
+- LatencyTracker：按服务商记录最近的成功耗时，计算分位数
+- hedged_call()：执行主请求，按需补发对冲请求，返回最先成功的结果
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Callable, Dict, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 主请求还在排队等待并发槽位时，检查是否已开始的间隔（秒）
+START_POLL_INTERVAL = 0.05
+
+
+class LatencyTracker:
+    """最近成功请求的耗时统计"""
+
+    # 保留最近多少个样本
+    WINDOW_SIZE = 200
+    # 样本数少于该值时不计算分位数（不对冲）
+    MIN_SAMPLES = 5
+
+    def __init__(self, window_size: Optional[int] = None):
+        self._samples = deque(maxlen=window_size or self.WINDOW_SIZE)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        """记录一次成功请求的耗时（秒）"""
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        计算耗时分位数
+
+        Args:
+            p: 分位（0-100）
+
+        Returns:
+            耗时（秒），样本不足时返回 None
+        """
+        with self._lock:
+            if len(self._samples) < self.MIN_SAMPLES:
+                return None
+            samples = sorted(self._samples)
+        rank = min(len(samples) - 1, max(0, int(round(p / 100.0 * (len(samples) - 1)))))
+        return samples[rank]
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        """耗时分布（用于监控）"""
+        with self._lock:
+            count = len(self._samples)
+        return {
+            "samples": count,
+            "p50_ms": _to_ms(self.percentile(50)),
+            "p90_ms": _to_ms(self.percentile(90)),
+            "p99_ms": _to_ms(self.percentile(99))
+        }
+
+
+def _to_ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+def _start(func: Callable[[], T]) -> Future:
+    """
+    在独立线程中执行 func
+
+    不使用共享线程池：请求本身已经受服务商并发控制约束，共享线程池被占满时
+    主请求可能排在对冲请求后面，反而拖长耗时。
+    """
+    future: Future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="redink-hedge", daemon=True).start()
+    return future
+
+
+def hedged_call(
+    primary: Callable[[], T],
+    next_hedge: Callable[[int], Optional[Callable[[], T]]],
+    hedge_after: Optional[float] = None,
+    parallel: int = 1,
+    max_hedges: int = 1,
+    primary_started: Optional[threading.Event] = None
+) -> T:
+    """
+    执行请求，必要时补发对冲请求，返回最先成功的结果
+
+    Args:
+        primary: 主请求
+        next_hedge: 对冲请求工厂，参数为第几个对冲请求（从 1 开始）；
+            返回 None 表示不能再发（额度用尽、服务商没有空闲并发等）
+        hedge_after: 主请求超过该耗时（秒）仍未完成时补发一个对冲请求，None 表示不补发
+        parallel: 一开始就同时发出的请求数（含主请求）
+        max_hedges: 对冲请求总数上限（含一开始并行发出的）
+        primary_started: 主请求真正开始（取得并发槽位）时设置的事件，hedge_after 从此时开始计时，
+            排队等待槽位的时间不计入；为空时从提交主请求开始计时
+
+    Returns:
+        最先成功的请求结果
+
+    Raises:
+        所有请求都失败时，抛出主请求的异常
+    """
+    futures: List[Future] = [_start(primary)]
+    hedges = 0
+
+    def launch() -> bool:
+        nonlocal hedges
+        if hedges >= max_hedges:
+            return False
+        hedge = next_hedge(hedges + 1)
+        if hedge is None:
+            return False
+        hedges += 1
+        futures.append(_start(hedge))
+        return True
+
+    for _ in range(parallel - 1):
+        if not launch():
+            break
+
+    delayed_pending = hedge_after is not None
+    started = time.monotonic() if primary_started is None else None
+    pending = set(futures)
+
+    while True:
+        timeout = None
+        if delayed_pending:
+            if started is None and primary_started.is_set():
+                started = time.monotonic()
+            if started is None:
+                # 主请求还在排队：暂不计时
+                timeout = START_POLL_INTERVAL
+            else:
+                timeout = max(0.0, hedge_after - (time.monotonic() - started))
+
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            if future.exception() is None:
+                # 胜出：其余请求无法中断（HTTP 请求已发出），结果直接丢弃
+                for other in pending:
+                    other.cancel()
+                if future is not futures[0]:
+                    logger.info(f"⚡ 对冲请求先于主请求完成（共发出 {len(futures)} 个请求）")
+                return future.result()
+
+        if not done and delayed_pending and started is not None:
+            delayed_pending = False
+            if launch():
+                logger.info(f"⏳ 请求超过 {hedge_after:.1f}秒未完成，已发出对冲请求")
+                pending.add(futures[-1])
+            continue
+
+        if not pending:
+            # 全部失败：优先报告主请求的错误
+            raise futures[0].exception()
+
+
+# 全局耗时统计：服务商名称 -> LatencyTracker（所有任务共享）
+_trackers: Dict[str, LatencyTracker] = {}
+_trackers_lock = threading.Lock()
+
+
+def get_latency_tracker(provider_name: str) -> LatencyTracker:
+    """获取服务商的耗时统计"""
+    with _trackers_lock:
+        tracker = _trackers.get(provider_name)
+        if tracker is None:
+            tracker = _trackers[provider_name] = LatencyTracker()
+        return tracker
+
+
+def get_all_latency_stats() -> Dict[str, Dict[str, Optional[float]]]:
+    """获取所有服务商的耗时分布"""
+    with _trackers_lock:
+        trackers = dict(_trackers)
+    return {name: tracker.stats() for name, tracker in trackers.items()}
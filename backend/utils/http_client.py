@@ -0,0 +1,152 @@
+"""
+共享 HTTP 客户端
+
+服务商调用和图片下载原来直接使用 requests.post / requests.get，每次请求都重新建立 TCP + TLS 连接，
+十几个页面同时请求同一个服务商时握手开销和临时端口占用都很明显。
+这里所有调用共用一个 Session：
+- 按主机建立连接池并保持长连接，服务商的连接池大小按并发上限（含对冲额外请求）设置
+- 连接超时和读取超时可分别配置（connect_timeout / read_timeout）
+- 提供各连接池的统计（已创建、使用中、空闲的连接数）
+"""
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+def http_timeout(config: Optional[Dict[str, Any]], read_timeout: float) -> Tuple[float, float]:
+    """
+    读取服务商配置中的超时设置
+
+    Args:
+        config: 服务商配置（可选 connect_timeout / read_timeout，单位秒）
+        read_timeout: 默认读取超时
+
+    Returns:
+        (连接超时, 读取超时)，可直接作为 requests 的 timeout 参数
+    """
+    config = config or {}
+    return (
+        float(config.get('connect_timeout', PooledHttpClient.CONNECT_TIMEOUT)),
+        float(config.get('read_timeout', read_timeout))
+    )
+
+
+def pool_size_for(config: Optional[Dict[str, Any]]) -> int:
+    """
+    服务商连接池大小：并发上限 + 对冲请求的额外额度（可用 http_pool_size 直接指定）
+    """
+    config = config or {}
+    if config.get('http_pool_size'):
+        return int(config['http_pool_size'])
+    size = int(config.get('max_concurrency', 15))
+    if config.get('hedge', False):
+        size += int(config.get('hedge_max_extra', 3))
+    return max(1, size)
+
+
+def _host_prefix(url: str) -> Optional[str]:
+    """URL 对应的主机前缀（scheme://host/），无法解析时返回 None"""
+    parts = urlsplit(url or '')
+    if not parts.scheme or not parts.netloc:
+        return None
+    return f"{parts.scheme}://{parts.netloc}/"
+
+
+class PooledHttpClient:
+    """进程内共享的 HTTP 客户端（长连接、按主机分池）"""
+
+    # 默认连接超时（秒）
+    CONNECT_TIMEOUT = 10.0
+    # 未单独配置的主机（如图片下载地址）每个主机的连接池大小
+    DEFAULT_POOL_SIZE = 10
+    # 默认适配器最多同时保留的主机连接池数量
+    DEFAULT_POOL_HOSTS = 32
+
+    def __init__(self):
+        self.session = requests.Session()
+        self._default_adapter = HTTPAdapter(
+            pool_connections=self.DEFAULT_POOL_HOSTS,
+            pool_maxsize=self.DEFAULT_POOL_SIZE
+        )
+        self.session.mount('http://', self._default_adapter)
+        self.session.mount('https://', self._default_adapter)
+        # 主机前缀 -> (适配器, 连接池大小)
+        self._host_adapters: Dict[str, Tuple[HTTPAdapter, int]] = {}
+        self._lock = threading.Lock()
+
+    def ensure_pool(self, base_url: str, pool_size: int):
+        """
+        为服务商主机单独建立连接池（已有的连接池更小时扩容）
+
+        Args:
+            base_url: 服务商地址
+            pool_size: 连接池大小（通常为服务商的并发上限）
+        """
+        prefix = _host_prefix(base_url)
+        if prefix is None:
+            return
+        with self._lock:
+            existing = self._host_adapters.get(prefix)
+            if existing and existing[1] >= pool_size:
+                return
+            # 旧适配器上的连接仍可正常完成，不主动关闭
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            self.session.mount(prefix, adapter)
+            self._host_adapters[prefix] = (adapter, pool_size)
+        logger.debug(f"HTTP 连接池: {prefix} size={pool_size}")
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """发送请求（参数同 requests.request）"""
+        kwargs.setdefault('timeout', (self.CONNECT_TIMEOUT, 60.0))
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """各主机连接池的状态（用于监控）"""
+        with self._lock:
+            adapters = [self._default_adapter] + [adapter for adapter, _ in self._host_adapters.values()]
+
+        result: Dict[str, Dict[str, Any]] = {}
+        for adapter in adapters:
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host = f"{key.key_scheme}://{key.key_host}:{key.key_port}"
+                # 连接池队列初始为 maxsize 个空位，取出即为使用中，归还的是可复用的空闲连接
+                queue = list(pool.pool.queue) if pool.pool is not None else []
+                result[host] = {
+                    "maxsize": pool.pool.maxsize if pool.pool is not None else 0,
+                    "in_use": (pool.pool.maxsize - len(queue)) if pool.pool is not None else 0,
+                    "idle": sum(1 for conn in queue if conn is not None),
+                    "created": pool.num_connections,
+                    "requests": pool.num_requests
+                }
+        return result
+
+
+# 全局客户端实例
+_client: Optional[PooledHttpClient] = None
+_client_lock = threading.Lock()
+
+
+def get_http_client() -> PooledHttpClient:
+    """获取全局 HTTP 客户端"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PooledHttpClient()
+    return _client
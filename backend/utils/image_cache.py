@@ -0,0 +1,243 @@
+"""
+图片生成结果缓存（按内容寻址）
+
+缓存键是整个生成请求的指纹：服务商类型、最终提示词、全部生成参数（模型、尺寸、宽高比、
+温度等）以及参考图片的摘要。完全相同的请求直接返回缓存的图片，不再调用服务商。
+
+缓存落盘到项目根目录的 cache/images/，按总大小做 LRU 淘汰。各服务商通过配置
+cache: true 开启（默认关闭）。
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from .fs import write_file_atomic
+from .reference_payload import ReferencePayload
+
+logger = logging.getLogger(__name__)
+
+
+def image_cache_key(provider_type: str, prompt: str, params: Dict[str, Any]) -> str:
+    """
+    计算生成请求的缓存键
+
+    Args:
+        provider_type: 服务商类型
+        prompt: 最终提示词
+        params: 传给生成器的其他参数，参考图片（bytes / ReferencePayload）以摘要参与计算
+
+    Returns:
+        sha256 十六进制字符串
+    """
+    def normalize(value):
+        if isinstance(value, ReferencePayload):
+            return "sha256:" + value.digest
+        if isinstance(value, (bytes, bytearray)):
+            return "sha256:" + hashlib.sha256(value).hexdigest()
+        if isinstance(value, (list, tuple)):
+            return [normalize(v) for v in value]
+        if isinstance(value, dict):
+            return {k: normalize(v) for k, v in value.items()}
+        return value
+
+    fingerprint = {
+        "type": provider_type,
+        "prompt": prompt,
+        "params": normalize(params)
+    }
+    raw = json.dumps(fingerprint, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ImageCache:
+    """磁盘图片缓存：按总大小 LRU 淘汰，记录命中统计"""
+
+    # 默认缓存上限（MB）
+    DEFAULT_MAX_MB = 1024
+
+    FILE_SUFFIX = ".bin"
+
+    def __init__(self, cache_dir: str, max_bytes: Optional[int] = None):
+        """
+        Args:
+            cache_dir: 缓存目录
+            max_bytes: 缓存总大小上限（字节）
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes or self.DEFAULT_MAX_MB * 1024 * 1024
+
+        # key -> 文件大小，按最近使用排列（最近使用的在末尾）
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+        self._evictions = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + self.FILE_SUFFIX)
+
+    def _load_index(self):
+        """扫描缓存目录重建索引（按修改时间排序作为使用顺序）"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(self.FILE_SUFFIX):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, name[:-len(self.FILE_SUFFIX)], stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total_bytes += size
+
+        if entries:
+            logger.info(f"图片缓存已加载: {len(entries)} 项, {self._total_bytes / 1024 / 1024:.1f}MB")
+
+    def configure(self, max_bytes: int):
+        """调整缓存上限（立即按新上限淘汰）"""
+        with self._lock:
+            self.max_bytes = max_bytes
+            victims = self._select_victims()
+        self._remove_files(victims)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        读取缓存
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            图片数据，未命中时返回 None
+        """
+        with self._lock:
+            if key not in self._index:
+                self._misses += 1
+                return None
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # 更新修改时间，重启后仍能保持使用顺序
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                size = self._index.pop(key, None)
+                if size is not None:
+                    self._total_bytes -= size
+                self._misses += 1
+            return None
+
+        with self._lock:
+            if key in self._index:
+                self._index.move_to_end(key)
+            self._hits += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        """
+        写入缓存（超出上限时淘汰最久未使用的项）
+
+        Args:
+            key: 缓存键
+            data: 图片数据
+        """
+        if len(data) > self.max_bytes:
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_file_atomic(path, data, durable=True)
+
+        with self._lock:
+            old_size = self._index.pop(key, None)
+            if old_size is not None:
+                self._total_bytes -= old_size
+            self._index[key] = len(data)
+            self._total_bytes += len(data)
+            self._writes += 1
+            victims = self._select_victims()
+
+        self._remove_files(victims)
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计（用于监控）"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+                "writes": self._writes,
+                "evictions": self._evictions
+            }
+
+    def _select_victims(self):
+        """选出需要淘汰的缓存项（调用方持有锁）"""
+        victims = []
+        while self._total_bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            self._evictions += 1
+            victims.append(key)
+        return victims
+
+    def _remove_files(self, keys):
+        """删除被淘汰的缓存文件（在锁外执行磁盘 IO）"""
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+
+# 全局图片缓存（所有服务商共享，缓存键中包含服务商类型）
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+
+def get_image_cache(max_mb: Optional[int] = None) -> ImageCache:
+    """
+    获取全局图片缓存
+
+    Args:
+        max_mb: 缓存上限（MB），传入时按此调整上限
+    """
+    global _cache_instance
+    if _cache_instance is None:
+        with _cache_lock:
+            if _cache_instance is None:
+                cache_dir = os.path.join(
+                    os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+                    "cache", "images"
+                )
+                _cache_instance = ImageCache(cache_dir)
+
+    if max_mb and max_mb * 1024 * 1024 != _cache_instance.max_bytes:
+        _cache_instance.configure(max_mb * 1024 * 1024)
+    return _cache_instance
+
+
+def get_image_cache_stats() -> Optional[Dict[str, Any]]:
+    """获取全局图片缓存统计（未启用时返回 None）"""
+    if _cache_instance is None:
+        return None
+    return _cache_instance.stats()
@@ -0,0 +1,241 @@
+"""
+图片处理引擎
+
+Pillow 的解码、缩放和 JPEG 编码都是 CPU 密集操作。放在请求线程和生图工作线程里执行时，
+它们和 JSON、base64、SSE 处理争抢同一个 GIL，多页并发时实际只能用满一个核。
+
+这里把图片处理放到进程池中执行：
+- submit() 提交任意模块级函数，返回 Future；compress() / compress_many() 是常用的同步封装
+- 等待中的任务数有上限，超出时提交方阻塞等待（背压），避免大量图片数据堆积在内存中
+- 按操作统计次数、执行耗时和排队耗时
+- 进程池不可用时退化为在当前线程执行
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional
+
+from .image_compressor import compress_image
+
+logger = logging.getLogger(__name__)
+
+
+def _timed_call(func: Callable, args: tuple, kwargs: dict):
+    """在工作进程中执行函数，并返回执行耗时"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+class _OperationStats:
+    """单类操作的耗时统计"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.inline = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.queue_seconds = 0.0
+
+    def record(self, exec_seconds: float, queue_seconds: float):
+        self.count += 1
+        self.total_seconds += exec_seconds
+        self.max_seconds = max(self.max_seconds, exec_seconds)
+        self.queue_seconds += queue_seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "inline": self.inline,
+            "avg_ms": round(self.total_seconds / self.count * 1000, 1) if self.count else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 1),
+            "avg_queue_ms": round(self.queue_seconds / self.count * 1000, 1) if self.count else 0.0
+        }
+
+
+class ImageProcessor:
+    """进程池图片处理服务"""
+
+    # 工作进程数上限
+    MAX_WORKERS = 16
+    # 每个工作进程允许排队的任务数（总排队上限 = 工作进程数 × 该值）
+    QUEUE_PER_WORKER = 4
+
+    def __init__(self, max_workers: Optional[int] = None, max_pending: Optional[int] = None):
+        """
+        Args:
+            max_workers: 工作进程数（默认按 CPU 核数，不超过 MAX_WORKERS）
+            max_pending: 已提交但未完成的任务数上限
+        """
+        self.max_workers = max_workers or max(1, min(os.cpu_count() or 1, self.MAX_WORKERS))
+        self.max_pending = max_pending or self.max_workers * self.QUEUE_PER_WORKER
+
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pending = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pool_disabled = False
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _OperationStats] = {}
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        """按需创建进程池（创建失败时退化为当前线程执行）"""
+        with self._lock:
+            if self._executor is None and not self._pool_disabled:
+                try:
+                    # forkserver / spawn 启动的子进程不继承 Flask 和工作线程的状态
+                    methods = multiprocessing.get_all_start_methods()
+                    method = "forkserver" if "forkserver" in methods else "spawn"
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        mp_context=multiprocessing.get_context(method)
+                    )
+                    logger.info(f"图片处理进程池已启动: workers={self.max_workers}, max_pending={self.max_pending}")
+                except Exception as e:
+                    logger.warning(f"⚠️ 图片处理进程池启动失败，改为在当前线程处理: {e}")
+                    self._pool_disabled = True
+            return self._executor
+
+    def _op_stats(self, op_name: str) -> _OperationStats:
+        """获取操作统计对象（调用方持有锁）"""
+        stats = self._stats.get(op_name)
+        if stats is None:
+            stats = self._stats[op_name] = _OperationStats()
+        return stats
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """
+        提交图片处理任务（排队已满时阻塞等待）
+
+        Args:
+            func: 模块级函数（需要能被 pickle 传给工作进程）
+            *args, **kwargs: 函数参数
+
+        Returns:
+            Future，结果为函数返回值
+        """
+        op_name = func.__name__
+        executor = self._get_executor()
+        if executor is None:
+            return self._run_inline(op_name, func, args, kwargs)
+
+        self._slots.acquire()
+        with self._lock:
+            self._pending += 1
+        submitted_at = time.perf_counter()
+
+        result_future: Future = Future()
+
+        def on_done(inner: Future):
+            self._slots.release()
+            elapsed = time.perf_counter() - submitted_at
+            with self._lock:
+                self._pending -= 1
+                stats = self._op_stats(op_name)
+                error = inner.exception()
+                if error is None:
+                    result, exec_seconds = inner.result()
+                    stats.record(exec_seconds, max(0.0, elapsed - exec_seconds))
+                else:
+                    stats.errors += 1
+
+            if error is None:
+                result_future.set_result(result)
+            elif isinstance(error, BrokenProcessPool):
+                # 工作进程异常退出：重建进程池，本次任务在当前线程重做
+                logger.warning(f"⚠️ 图片处理进程池异常，已重建: {error}")
+                self._reset_executor(executor)
+                inline = self._run_inline(op_name, func, args, kwargs)
+                if inline.exception() is None:
+                    result_future.set_result(inline.result())
+                else:
+                    result_future.set_exception(inline.exception())
+            else:
+                result_future.set_exception(error)
+
+        try:
+            inner = executor.submit(_timed_call, func, args, kwargs)
+        except Exception:
+            self._slots.release()
+            with self._lock:
+                self._pending -= 1
+            self._reset_executor(executor)
+            return self._run_inline(op_name, func, args, kwargs)
+
+        inner.add_done_callback(on_done)
+        return result_future
+
+    def _run_inline(self, op_name: str, func: Callable, args: tuple, kwargs: dict) -> Future:
+        """在当前线程执行（进程池不可用或任务很小时）"""
+        future: Future = Future()
+        try:
+            result, exec_seconds = _timed_call(func, args, kwargs)
+        except Exception as e:
+            with self._lock:
+                self._op_stats(op_name).errors += 1
+            future.set_exception(e)
+            return future
+
+        with self._lock:
+            stats = self._op_stats(op_name)
+            stats.record(exec_seconds, 0.0)
+            stats.inline += 1
+        future.set_result(result)
+        return future
+
+    def _reset_executor(self, broken: ProcessPoolExecutor):
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False)
+
+    def compress(self, image_data: bytes, max_size_kb: int = 200, **kwargs) -> bytes:
+        """
+        压缩图片（参数同 compress_image），等待结果返回
+
+        已经小于目标大小的图片不会被处理，直接返回，不经过进程池。
+        """
+        if len(image_data) <= max_size_kb * 1024:
+            return image_data
+        return self.submit(compress_image, image_data, max_size_kb=max_size_kb, **kwargs).result()
+
+    def compress_many(self, images: List[bytes], max_size_kb: int = 200) -> List[bytes]:
+        """并行压缩多张图片，按原顺序返回"""
+        futures = []
+        for img in images:
+            if len(img) <= max_size_kb * 1024:
+                futures.append(None)
+            else:
+                futures.append(self.submit(compress_image, img, max_size_kb=max_size_kb))
+        return [img if future is None else future.result() for img, future in zip(images, futures)]
+
+    def stats(self) -> Dict[str, Any]:
+        """处理引擎状态（用于监控）"""
+        with self._lock:
+            return {
+                "mode": "inline" if self._pool_disabled else "process_pool",
+                "workers": self.max_workers,
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "operations": {name: stats.to_dict() for name, stats in self._stats.items()}
+            }
+
+
+# 全局图片处理引擎
+_processor_instance = None
+_processor_lock = threading.Lock()
+
+
+def get_image_processor() -> ImageProcessor:
+    """获取全局图片处理引擎"""
+    global _processor_instance
+    if _processor_instance is None:
+        with _processor_lock:
+            if _processor_instance is None:
+                _processor_instance = ImageProcessor()
+    return _processor_instance
@@ -0,0 +1,305 @@
+"""
+API Key 池
+
+服务商配置可以提供多个 API Key（api_key 写成列表，或使用 api_keys），请求在这些 Key 之间轮换，
+每个 Key 的限流额度叠加，单个 Key 的 RPM 不再是吞吐上限：
+- 每个 Key 单独统计请求数、成功/失败数和最近一分钟的请求数（可配置 key_requests_per_minute 限速）
+- 遇到 429 的 Key 进入冷却（优先按 Retry-After，连续限流时冷却时间翻倍），冷却期间不再分配
+- 返回 401 / 403 的 Key 直接停用，直到配置更新
+"""
+import logging
+import threading
+import time
+from collections import deque
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from .retry import ERROR_AUTH, ERROR_RATE_LIMIT, ProviderError, classify_error
+from .concurrency import parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def provider_api_keys(provider_config: Dict[str, Any]) -> List[str]:
+    """
+    读取服务商配置中的全部 API Key（去重，保持顺序）
+
+    支持 api_key: "xxx"、api_key: [..] 和 api_keys: [..] 三种写法
+    """
+    keys: List[str] = []
+    for value in (provider_config.get('api_key'), provider_config.get('api_keys')):
+        if isinstance(value, str):
+            value = [value]
+        for key in value or []:
+            if isinstance(key, str) and key.strip() and key.strip() not in keys:
+                keys.append(key.strip())
+    return keys
+
+
+def mask_key(key: str) -> str:
+    """遮盖 Key，只显示前4位和后4位"""
+    if len(key) <= 8:
+        return '*' * len(key)
+    return key[:4] + '*' * (len(key) - 8) + key[-4:]
+
+
+class _KeyState:
+    """单个 Key 的使用统计"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.in_flight = 0
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.consecutive_rate_limits = 0
+        self.cooldown_until = 0.0
+        self.disabled_reason: Optional[str] = None
+        self.last_used = 0.0
+        # 最近一分钟的请求时间（用于 RPM 限速和统计）
+        self.recent = deque()
+
+    def requests_last_minute(self, now: float) -> int:
+        while self.recent and now - self.recent[0] > 60:
+            self.recent.popleft()
+        return len(self.recent)
+
+
+class ApiKeyPool:
+    """单个服务商的 API Key 池"""
+
+    # 429 后的默认冷却时间（秒），连续限流时翻倍
+    COOLDOWN_SECONDS = 30.0
+    MAX_COOLDOWN_SECONDS = 600.0
+
+    def __init__(self, name: str, keys: List[str], requests_per_minute: Optional[float] = None):
+        """
+        Args:
+            name: Key 池名称（如 image:gemini）
+            keys: API Key 列表
+            requests_per_minute: 单个 Key 每分钟请求数上限（可选）
+        """
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self._states: Dict[str, _KeyState] = {key: _KeyState(key) for key in keys}
+        self._lock = threading.Lock()
+
+    @property
+    def keys(self) -> List[str]:
+        return list(self._states)
+
+    def configure(self, keys: List[str], requests_per_minute: Optional[float] = None):
+        """更新 Key 列表（保留仍在使用的 Key 的统计；重新配置的 Key 解除停用）"""
+        with self._lock:
+            self.requests_per_minute = requests_per_minute
+            states = {}
+            for key in keys:
+                state = self._states.get(key) or _KeyState(key)
+                state.disabled_reason = None
+                states[key] = state
+            self._states = states
+
+    def acquire(self) -> str:
+        """
+        选择一个可用的 Key（冷却中、已停用、达到 RPM 上限的 Key 不参与；优先选择进行中请求最少、
+        最久未使用的 Key）
+
+        Returns:
+            API Key
+
+        Raises:
+            ProviderError: 没有可用的 Key（全部停用时为认证错误，否则为限流错误并附带等待时间）
+        """
+        with self._lock:
+            now = time.monotonic()
+            best: Optional[_KeyState] = None
+            earliest_ready: Optional[float] = None
+
+            for state in self._states.values():
+                if state.disabled_reason:
+                    continue
+                ready_at = state.cooldown_until
+                if self.requests_per_minute and state.requests_last_minute(now) >= self.requests_per_minute:
+                    ready_at = max(ready_at, state.recent[0] + 60)
+                if ready_at > now:
+                    earliest_ready = ready_at if earliest_ready is None else min(earliest_ready, ready_at)
+                    continue
+                if best is None or (state.in_flight, state.last_used) < (best.in_flight, best.last_used):
+                    best = state
+
+            if best is not None:
+                best.in_flight += 1
+                best.requests += 1
+                best.last_used = now
+                best.recent.append(now)
+                return best.key
+
+            if earliest_ready is None:
+                raise ProviderError(
+                    f"❌ 服务商 {self.name} 的所有 API Key 都已失效（认证失败或无权限）\n\n"
+                    "【解决方案】\n在系统设置页面检查并更新 API Key",
+                    kind=ERROR_AUTH
+                )
+            wait = earliest_ready - now
+
+        raise ProviderError(
+            f"⏳ 服务商 {self.name} 的所有 API Key 都在限流冷却中，约 {max(1, int(wait))} 秒后恢复",
+            kind=ERROR_RATE_LIMIT,
+            retry_after=wait
+        )
+
+    def release(self, key: str, error: Optional[Exception] = None):
+        """
+        归还 Key 并记录本次调用结果
+
+        Args:
+            key: acquire() 返回的 Key
+            error: 调用失败时的异常
+        """
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                # 调用期间 Key 已从配置中移除
+                return
+            state.in_flight = max(0, state.in_flight - 1)
+
+            if error is None:
+                state.successes += 1
+                state.consecutive_rate_limits = 0
+                return
+
+            kind = classify_error(error)
+            if kind == ERROR_RATE_LIMIT:
+                state.rate_limited += 1
+                state.consecutive_rate_limits += 1
+                cooldown = parse_retry_after(error)
+                if cooldown is None:
+                    cooldown = min(
+                        self.COOLDOWN_SECONDS * (2 ** (state.consecutive_rate_limits - 1)),
+                        self.MAX_COOLDOWN_SECONDS
+                    )
+                state.cooldown_until = time.monotonic() + cooldown
+                logger.warning(f"⏳ [{self.name}] API Key {mask_key(key)} 触发限流，冷却 {cooldown:.0f} 秒")
+            elif kind == ERROR_AUTH:
+                state.failures += 1
+                state.disabled_reason = str(error)[:200]
+                logger.warning(f"❌ [{self.name}] API Key {mask_key(key)} 认证失败，已停用")
+            else:
+                state.failures += 1
+
+    def call(self, func: Callable[[str], T]) -> T:
+        """
+        用池中的 Key 调用 func，某个 Key 限流或认证失败时立即换下一个可用 Key
+
+        单个 Key 的 429 / 401 不会交给上层的重试退避和并发控制处理，只有所有 Key 都不可用时
+        才向上抛出（限流错误附带最早恢复的等待时间）。
+
+        Args:
+            func: 参数为 API Key 的调用
+
+        Returns:
+            func 的返回值
+        """
+        tries = max(1, len(self._states))
+        attempt = 1
+        while True:
+            key = self.acquire()
+            try:
+                result = func(key)
+            except Exception as e:
+                self.release(key, e)
+                if attempt >= tries or classify_error(e) not in (ERROR_RATE_LIMIT, ERROR_AUTH):
+                    raise
+                attempt += 1
+                logger.info(f"⚠️ [{self.name}] API Key {mask_key(key)} 不可用，换下一个 Key 重试")
+                continue
+            self.release(key)
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        """各 Key 的使用情况（Key 已脱敏，用于监控）"""
+        with self._lock:
+            now = time.monotonic()
+            keys = []
+            for state in self._states.values():
+                if state.disabled_reason:
+                    status = "disabled"
+                elif state.cooldown_until > now:
+                    status = "cooldown"
+                else:
+                    status = "active"
+                keys.append({
+                    "key": mask_key(state.key),
+                    "status": status,
+                    "cooldown_remaining": round(max(0.0, state.cooldown_until - now), 1),
+                    "in_flight": state.in_flight,
+                    "requests": state.requests,
+                    "requests_last_minute": state.requests_last_minute(now),
+                    "successes": state.successes,
+                    "failures": state.failures,
+                    "rate_limited": state.rate_limited,
+                    "disabled_reason": state.disabled_reason
+                })
+            return {
+                "requests_per_minute": self.requests_per_minute,
+                "keys": keys
+            }
+
+
+def with_api_key(func):
+    """
+    方法装饰器：每次调用从实例的 key_pool 租用一个 Key，作为 api_key 参数传入
+
+    与 with_retry 一起使用时放在内层：单个 Key 限流 / 失效时直接换 Key，不消耗重试次数。
+    """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        pool = getattr(self, "key_pool", None)
+        if pool is None:
+            return func(self, *args, **kwargs)
+        return pool.call(lambda api_key: func(self, *args, api_key=api_key, **kwargs))
+    return wrapper
+
+
+# 全局 Key 池注册表：类别:服务商名 -> Key 池（进程内共享）
+_pools: Dict[str, ApiKeyPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_key_pool(category: str, provider_name: str, provider_config: Dict[str, Any]) -> Optional[ApiKeyPool]:
+    """
+    获取服务商的 Key 池
+
+    Args:
+        category: 类别（image / text）
+        provider_name: 服务商名称
+        provider_config: 服务商配置（api_key / api_keys，可选 key_requests_per_minute）
+
+    Returns:
+        Key 池；没有配置任何 Key 时返回 None
+    """
+    keys = provider_api_keys(provider_config)
+    if not keys:
+        return None
+    rpm = provider_config.get('key_requests_per_minute')
+    name = f"{category}:{provider_name}"
+
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = _pools[name] = ApiKeyPool(name, keys, rpm)
+            return pool
+
+    if pool.keys != keys or pool.requests_per_minute != rpm:
+        pool.configure(keys, rpm)
+    return pool
+
+
+def get_all_key_pool_stats() -> Dict[str, Dict[str, Any]]:
+    """获取所有 Key 池的使用情况"""
+    with _pools_lock:
+        pools = dict(_pools)
+    return {name: pool.stats() for name, pool in pools.items()}
@@ -0,0 +1,275 @@
+"""
+大纲解析
+
+大纲生成和大纲修改服务原来各有一份 _parse_outline，且只能在整段文本生成完之后解析。
+这里提供共用的解析函数，以及边接收文本块边解析的 IncrementalOutlineParser：
+- 每个 <page> 块闭合（出现下一个 <page> 分隔符）时立即产出该页
+- 最后一页在流结束时产出
+- 产出的页面列表与 parse_outline(完整文本) 完全一致（包括页码 index）
+
+大纲修改的补丁模式下，模型只输出受影响页面的 <patch> 标签（IncrementalPatchParser 边接收边解析），
+apply_outline_patches 把补丁应用到原页面列表。
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+# 页面分隔符（大小写不敏感）
+PAGE_SEPARATOR = re.compile(r'<page>', flags=re.IGNORECASE)
+# 旧格式分隔符：文本中没有 <page> 时使用
+LEGACY_SEPARATOR = "---"
+
+# 补丁标签：<patch op="replace" page="3">...</patch>，删除可写成自闭合 <patch op="delete" page="3"/>
+PATCH_PATTERN = re.compile(r'<patch\b([^>]*?)(?:/>|>(.*?)</patch\s*>)', flags=re.IGNORECASE | re.DOTALL)
+PATCH_ATTR_PATTERN = re.compile(r'(\w+)\s*=\s*["\']?([\w-]+)["\']?')
+PATCH_OPS = ("replace", "delete", "insert")
+
+# 页面类型标记 -> 页面类型
+PAGE_TYPE_MAPPING = {
+    "封面": "cover",
+    "内容": "content",
+    "总结": "summary",
+}
+
+
+def detect_page_type(page_text: str) -> str:
+    """根据页面开头的 [封面] / [内容] / [总结] 标记判断页面类型，默认 content"""
+    type_match = re.match(r"\[(\S+)\]", page_text)
+    if type_match:
+        return PAGE_TYPE_MAPPING.get(type_match.group(1), "content")
+    return "content"
+
+
+def _make_page(index: int, page_text: str) -> Dict[str, Any]:
+    return {
+        "index": index,
+        "type": detect_page_type(page_text),
+        "content": page_text
+    }
+
+
+def parse_outline(outline_text: str) -> List[Dict[str, Any]]:
+    """
+    解析大纲文本为页面列表
+
+    Args:
+        outline_text: 大纲文本（按 <page> 分割，兼容旧的 --- 分隔符）
+
+    Returns:
+        页面列表 [{index, type, content}]
+    """
+    # 按 <page> 分割页面（兼容旧的 --- 分隔符）
+    if '<page>' in outline_text:
+        pages_raw = PAGE_SEPARATOR.split(outline_text)
+    else:
+        # 向后兼容：如果没有 <page> 则使用 ---
+        pages_raw = outline_text.split(LEGACY_SEPARATOR)
+
+    pages = []
+    for index, page_text in enumerate(pages_raw):
+        page_text = page_text.strip()
+        if not page_text:
+            continue
+        pages.append(_make_page(index, page_text))
+
+    return pages
+
+
+class IncrementalOutlineParser:
+    """
+    流式大纲解析器
+
+    用法：
+        parser = IncrementalOutlineParser()
+        for chunk in stream:
+            for page in parser.feed(chunk):
+                ...  # 页面已完整
+        for page in parser.finish():
+            ...  # 最后一页
+        parser.pages  # 与 parse_outline(完整文本) 相同
+
+    只有确认文本使用 <page> 分隔后才会提前产出页面；旧的 --- 格式在流结束时一次性解析，
+    避免文本后半段出现 <page> 时前面已产出的页面与最终结果不一致。
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.pages: List[Dict[str, Any]] = []
+        # 是否已确认使用 <page> 分隔（与 parse_outline 相同，按小写 <page> 判断）
+        self._page_mode = False
+        # 尚未闭合的页面在 text 中的起始位置
+        self._open_start = 0
+        # 已闭合的分段数（即下一分段的 index）
+        self._segments = 0
+        self._finished = False
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """
+        追加一段文本
+
+        Args:
+            chunk: 新收到的文本块
+
+        Returns:
+            本次新闭合的页面（可能为空）
+        """
+        if self._finished or not chunk:
+            return []
+
+        # 只需在新文本及其前面可能被截断的分隔符范围内查找
+        search_from = max(0, len(self.text) - len('<page>') + 1)
+        self.text += chunk
+        if not self._page_mode:
+            self._page_mode = '<page>' in self.text[search_from:]
+            if not self._page_mode:
+                return []
+
+        return self._close_segments()
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """
+        文本接收完毕，产出剩余的页面
+
+        Returns:
+            本次新产出的页面
+        """
+        if self._finished:
+            return []
+        self._finished = True
+
+        if not self._page_mode:
+            self.pages = parse_outline(self.text)
+            return list(self.pages)
+
+        new_pages = self._close_segments()
+        last = self._take_segment(self.text[self._open_start:])
+        if last is not None:
+            new_pages.append(last)
+        return new_pages
+
+    def _close_segments(self) -> List[Dict[str, Any]]:
+        new_pages = []
+        for match in PAGE_SEPARATOR.finditer(self.text, self._open_start):
+            page = self._take_segment(self.text[self._open_start:match.start()])
+            self._open_start = match.end()
+            if page is not None:
+                new_pages.append(page)
+        return new_pages
+
+    def _take_segment(self, segment: str) -> Optional[Dict[str, Any]]:
+        index = self._segments
+        self._segments += 1
+        page_text = segment.strip()
+        if not page_text:
+            return None
+        page = _make_page(index, page_text)
+        self.pages.append(page)
+        return page
+
+
+def _parse_patch(attrs: str, body: Optional[str]) -> Optional[Dict[str, Any]]:
+    """解析一个补丁标签，格式不正确时返回 None"""
+    values = {key.lower(): value for key, value in PATCH_ATTR_PATTERN.findall(attrs)}
+    op = values.get("op", "replace").lower()
+    if op not in PATCH_OPS:
+        return None
+
+    position_key = "after" if op == "insert" else "page"
+    try:
+        position = int(values[position_key])
+    except (KeyError, ValueError):
+        return None
+
+    patch: Dict[str, Any] = {"op": op, position_key: position}
+    if op != "delete":
+        content = (body or "").strip()
+        if not content:
+            return None
+        patch["content"] = content
+        patch["type"] = detect_page_type(content) if re.match(r"\[(\S+)\]", content) else None
+    return patch
+
+
+class IncrementalPatchParser:
+    """
+    流式补丁解析器：每个 <patch> 标签闭合时立即产出
+
+    补丁中的页码（page / after）是修改前大纲中从 1 开始的页码。
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.patches: List[Dict[str, Any]] = []
+        # 已解析到的位置
+        self._pos = 0
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """
+        追加一段文本
+
+        Returns:
+            本次新闭合的补丁
+        """
+        self.text += chunk
+        new_patches = []
+        for match in PATCH_PATTERN.finditer(self.text, self._pos):
+            self._pos = match.end()
+            patch = _parse_patch(match.group(1), match.group(2))
+            if patch is not None:
+                self.patches.append(patch)
+                new_patches.append(patch)
+        return new_patches
+
+
+def apply_outline_patches(pages: List[Dict[str, Any]], patches: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    把补丁应用到页面列表
+
+    补丁的页码都指修改前的页面（从 1 开始），与补丁的先后顺序无关；页码超出范围的补丁被忽略。
+    替换内容没有类型标记时沿用原页面的类型。
+
+    Args:
+        pages: 修改前的页面列表
+        patches: 补丁列表
+
+    Returns:
+        修改后的页面列表（index 从 0 重新编号）
+    """
+    count = len(pages)
+    replaced: Dict[int, Dict[str, Any]] = {}
+    deleted = set()
+    inserted: Dict[int, List[Dict[str, Any]]] = {}
+
+    for patch in patches:
+        op = patch["op"]
+        if op == "insert":
+            if 0 <= patch["after"] <= count:
+                inserted.setdefault(patch["after"], []).append(patch)
+            continue
+        if not 1 <= patch["page"] <= count:
+            continue
+        if op == "delete":
+            deleted.add(patch["page"])
+        else:
+            replaced[patch["page"]] = patch
+
+    result: List[Dict[str, Any]] = []
+
+    def add(content: str, page_type: Optional[str]):
+        result.append({
+            "index": len(result),
+            "type": page_type or detect_page_type(content),
+            "content": content
+        })
+
+    for patch in inserted.get(0, []):
+        add(patch["content"], patch["type"])
+    for position, page in enumerate(pages, start=1):
+        if position in replaced:
+            patch = replaced[position]
+            add(patch["content"], patch["type"] or page.get("type"))
+        elif position not in deleted:
+            add(page.get("content", ""), page.get("type"))
+        for patch in inserted.get(position, []):
+            add(patch["content"], patch["type"])
+
+    return result
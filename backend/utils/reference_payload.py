@@ -0,0 +1,133 @@
+"""
+参考图片载荷
+
+同一个任务里，封面和用户上传的参考图会随每一页的请求重复发送。这里把一张参考图
+压缩、计算摘要、base64 编码的结果保存下来，一个任务内只处理一次：
+- ReferencePayload：压缩后的图片数据 + 摘要 + 按需生成并缓存的 base64 / data URI
+- ReferencePayloadCache：按 (内容摘要, 压缩档位) 缓存载荷，挂在任务上下文上
+- prepare_reference_images()：生成器内部使用，已是载荷的直接复用，原始图片并行压缩
+"""
+import base64
+import hashlib
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+
+from .image_processor import get_image_processor
+
+# 默认压缩档位（KB）
+DEFAULT_MAX_SIZE_KB = 200
+
+
+class ReferencePayload:
+    """已压缩、可直接放进请求体的参考图片"""
+
+    __slots__ = ("data", "digest", "mime_type", "_b64")
+
+    def __init__(self, data: bytes, mime_type: str = "image/png"):
+        """
+        Args:
+            data: 压缩后的图片数据
+            mime_type: data URI 中使用的 MIME 类型
+        """
+        self.data = data
+        self.digest = hashlib.sha256(data).hexdigest()
+        self.mime_type = mime_type
+        self._b64: Optional[str] = None
+
+    @property
+    def b64(self) -> str:
+        """base64 编码（首次访问时生成）"""
+        if self._b64 is None:
+            self._b64 = base64.b64encode(self.data).decode("utf-8")
+        return self._b64
+
+    @property
+    def data_uri(self) -> str:
+        """data URI 形式"""
+        return f"data:{self.mime_type};base64,{self.b64}"
+
+    def memory_size(self) -> int:
+        """占用的内存字节数（图片数据 + base64）"""
+        return len(self.data) + len(self._b64 or "")
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, ReferencePayload):
+            return self.digest == other.digest
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.digest)
+
+
+# 生成器接受的参考图片类型：原始图片数据或已准备好的载荷
+ReferenceImage = Union[bytes, ReferencePayload]
+
+
+class ReferencePayloadCache:
+    """参考图片载荷缓存：同一张图在同一压缩档位下只压缩、编码一次"""
+
+    def __init__(self):
+        self._payloads: Dict[Tuple[str, int], ReferencePayload] = {}
+        self._lock = threading.Lock()
+
+    def get(self, image: ReferenceImage, max_size_kb: int = DEFAULT_MAX_SIZE_KB) -> ReferencePayload:
+        """
+        获取参考图片的载荷，不存在时压缩并缓存
+
+        Args:
+            image: 原始图片数据（已经是载荷时直接返回）
+            max_size_kb: 压缩档位
+
+        Returns:
+            参考图片载荷
+        """
+        if isinstance(image, ReferencePayload):
+            return image
+
+        key = (hashlib.sha256(image).hexdigest(), max_size_kb)
+        with self._lock:
+            payload = self._payloads.get(key)
+        if payload is not None:
+            return payload
+
+        payload = ReferencePayload(get_image_processor().compress(image, max_size_kb=max_size_kb))
+        with self._lock:
+            return self._payloads.setdefault(key, payload)
+
+    def get_many(self, images: Optional[List[bytes]], max_size_kb: int = DEFAULT_MAX_SIZE_KB) -> List[ReferencePayload]:
+        """批量获取载荷，按原顺序返回"""
+        return [self.get(img, max_size_kb) for img in images or []]
+
+    def memory_size(self) -> int:
+        """缓存占用的内存字节数"""
+        with self._lock:
+            return sum(payload.memory_size() for payload in self._payloads.values())
+
+    def clear(self):
+        with self._lock:
+            self._payloads.clear()
+
+
+def prepare_reference_images(
+    images: List[ReferenceImage],
+    max_size_kb: int = DEFAULT_MAX_SIZE_KB
+) -> List[ReferencePayload]:
+    """
+    把参考图片统一为载荷：已是载荷的直接复用，原始图片并行压缩
+
+    Args:
+        images: 参考图片（原始数据或载荷）
+        max_size_kb: 压缩档位
+
+    Returns:
+        载荷列表，顺序与输入一致
+    """
+    raw_images = [img for img in images if not isinstance(img, ReferencePayload)]
+    compressed = iter(get_image_processor().compress_many(raw_images, max_size_kb=max_size_kb))
+    return [
+        img if isinstance(img, ReferencePayload) else ReferencePayload(next(compressed))
+        for img in images
+    ]
@@ -0,0 +1,344 @@
+"""
+统一的重试策略
+
+之前生成器、文本客户端各自带重试装饰器，ImageService 外面还有一层重试，层层叠加后
+一次硬失败最多会触发 15 次服务商调用。现在重试只在调用链上的一个位置发生：
+- 图片生成：ImageService 按服务商配置的 RetryPolicy 重试（生成器本身不再重试）
+- 文本生成：TextChatClient / GenAIClient 的方法用 with_retry 装饰
+
+每次调用有总尝试次数和总耗时预算；错误先分类再决定是否重试：
+认证失败（401/403）、资源不存在（404）、参数错误、安全过滤属于终止性错误，不重试；
+限流（429）优先按服务商返回的 Retry-After 等待。
+"""
+import logging
+import random
+import time
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional
+
+from .concurrency import is_rate_limit_error, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+
+# 错误类型
+ERROR_RATE_LIMIT = "rate_limit"
+ERROR_AUTH = "auth"
+ERROR_NOT_FOUND = "not_found"
+ERROR_INVALID_REQUEST = "invalid_request"
+ERROR_SAFETY = "safety"
+ERROR_SERVER = "server"
+ERROR_NETWORK = "network"
+ERROR_UNKNOWN = "unknown"
+
+# 终止性错误：重试不会改变结果
+TERMINAL_ERRORS = {ERROR_AUTH, ERROR_NOT_FOUND, ERROR_INVALID_REQUEST, ERROR_SAFETY}
+
+# 按关键字识别错误类型（顺序即优先级；包含 Google API 的状态名）
+_ERROR_KEYWORDS = [
+    (ERROR_AUTH, ["401", "unauthenticated", "403", "permission_denied", "forbidden"]),
+    (ERROR_NOT_FOUND, ["404", "not_found"]),
+    (ERROR_SAFETY, ["safety", "blocked", "filter"]),
+    (ERROR_INVALID_REQUEST, ["invalid_argument"]),
+    (ERROR_NETWORK, ["timeout", "timed out", "connection", "network", "超时"]),
+    (ERROR_SERVER, ["500", "502", "503", "504", "internal", "unavailable"]),
+]
+
+
+class ProviderError(Exception):
+    """
+    服务商调用失败
+
+    错误信息是给用户看的（通常已经过友好化处理），分类信息单独保存，
+    这样重试和并发控制不必再从中文错误信息里猜测错误类型。
+    """
+
+    def __init__(
+        self,
+        message: str,
+        status_code: Optional[int] = None,
+        kind: Optional[str] = None,
+        retryable: Optional[bool] = None,
+        retry_after: Optional[float] = None
+    ):
+        """
+        Args:
+            message: 错误信息
+            status_code: HTTP 状态码（如有）
+            kind: 错误类型（ERROR_*），为空时按状态码推断
+            retryable: 是否可重试，为空时按错误类型推断
+            retry_after: 服务商建议的等待时间（秒）
+        """
+        super().__init__(message)
+        self.status_code = status_code
+        self.kind = kind or _kind_from_status(status_code) or ERROR_UNKNOWN
+        self.retryable = retryable if retryable is not None else self.kind not in TERMINAL_ERRORS
+        self.retry_after = retry_after
+
+
+def _kind_from_status(status_code: Optional[int]) -> Optional[str]:
+    """按 HTTP 状态码判断错误类型"""
+    if not status_code:
+        return None
+    if status_code == 429:
+        return ERROR_RATE_LIMIT
+    if status_code in (401, 403):
+        return ERROR_AUTH
+    if status_code == 404:
+        return ERROR_NOT_FOUND
+    if status_code in (400, 422):
+        return ERROR_INVALID_REQUEST
+    if status_code == 408:
+        return ERROR_NETWORK
+    if status_code >= 500:
+        return ERROR_SERVER
+    return None
+
+
+def _status_code_of(error: Exception) -> Optional[int]:
+    """提取异常上的 HTTP 状态码（ProviderError、google-genai APIError、requests HTTPError）"""
+    for attr in ("status_code", "code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def classify_error(error: Exception) -> str:
+    """
+    判断错误类型
+
+    Args:
+        error: 异常
+
+    Returns:
+        错误类型（ERROR_*）
+    """
+    if isinstance(error, ProviderError):
+        return error.kind
+
+    kind = _kind_from_status(_status_code_of(error))
+    if kind:
+        # 400 里也可能是安全过滤
+        if kind == ERROR_INVALID_REQUEST and "safety" in str(error).lower():
+            return ERROR_SAFETY
+        return kind
+
+    if is_rate_limit_error(error):
+        return ERROR_RATE_LIMIT
+
+    error_str = str(error).lower()
+    for kind, keywords in _ERROR_KEYWORDS:
+        if any(keyword in error_str for keyword in keywords):
+            return kind
+
+    return ERROR_UNKNOWN
+
+
+def is_retryable(error: Exception) -> bool:
+    """错误是否值得重试"""
+    if isinstance(error, ProviderError):
+        return error.retryable
+    return classify_error(error) not in TERMINAL_ERRORS
+
+
+def to_provider_error(error: Exception, message: Optional[str] = None) -> ProviderError:
+    """
+    把底层异常转换为 ProviderError（保留分类信息）
+
+    Args:
+        error: 原始异常
+        message: 给用户看的错误信息（为空时使用原始错误信息）
+    """
+    if isinstance(error, ProviderError) and message is None:
+        return error
+    return ProviderError(
+        message or str(error),
+        status_code=_status_code_of(error),
+        kind=classify_error(error),
+        retryable=is_retryable(error),
+        retry_after=parse_retry_after(error)
+    )
+
+
+def http_error(response: Any, message: str) -> ProviderError:
+    """
+    根据 HTTP 响应构造 ProviderError（读取 Retry-After 响应头）
+
+    Args:
+        response: requests 响应对象
+        message: 错误信息
+    """
+    retry_after = None
+    header = response.headers.get("Retry-After") if getattr(response, "headers", None) else None
+    if header:
+        try:
+            retry_after = float(header)
+        except ValueError:
+            retry_after = None
+    return ProviderError(message, status_code=response.status_code, retry_after=retry_after)
+
+
+class RetryPolicy:
+    """重试策略：总尝试次数 + 总耗时预算 + 指数退避"""
+
+    # 默认值（可通过服务商配置 retry_max_attempts / retry_budget_seconds 覆盖）
+    MAX_ATTEMPTS = 3
+    MAX_ELAPSED = 180.0
+    BASE_DELAY = 2.0
+    MAX_DELAY = 30.0
+
+    def __init__(
+        self,
+        max_attempts: Optional[int] = None,
+        max_elapsed: Optional[float] = None,
+        base_delay: Optional[float] = None,
+        max_delay: Optional[float] = None
+    ):
+        """
+        Args:
+            max_attempts: 总尝试次数（包含第一次）
+            max_elapsed: 总耗时预算（秒），预计超出时不再重试
+            base_delay: 首次重试前的等待时间（秒），之后指数增长
+            max_delay: 单次等待上限（秒）
+        """
+        self.max_attempts = max(1, max_attempts or self.MAX_ATTEMPTS)
+        self.max_elapsed = max_elapsed or self.MAX_ELAPSED
+        self.base_delay = base_delay if base_delay is not None else self.BASE_DELAY
+        self.max_delay = max_delay or self.MAX_DELAY
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], **defaults) -> "RetryPolicy":
+        """
+        从服务商配置创建
+
+        配置项：
+        - retry_max_attempts: 总尝试次数
+        - retry_budget_seconds: 总耗时预算（秒）
+        """
+        return cls(
+            max_attempts=config.get('retry_max_attempts', defaults.get('max_attempts')),
+            max_elapsed=config.get('retry_budget_seconds', defaults.get('max_elapsed')),
+            base_delay=defaults.get('base_delay'),
+            max_delay=defaults.get('max_delay')
+        )
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        """
+        计算第 attempt 次失败后的等待时间
+
+        服务商给出 Retry-After 时按它等待，否则指数退避加随机抖动
+        """
+        retry_after = parse_retry_after(error)
+        if retry_after is not None:
+            return max(0.0, retry_after)
+        delay = self.base_delay * (2 ** (attempt - 1))
+        return min(delay, self.max_delay) + random.uniform(0, 1)
+
+
+def retry_call(
+    func: Callable[[], Any],
+    policy: Optional[RetryPolicy] = None,
+    on_retry: Optional[Callable[[int, Exception, float], None]] = None,
+    attempts: Optional[List[Dict[str, Any]]] = None,
+    format_error: Optional[Callable[[Exception], str]] = None,
+    label: str = "请求"
+) -> Any:
+    """
+    按重试策略执行 func
+
+    Args:
+        func: 无参调用
+        policy: 重试策略（默认 RetryPolicy()）
+        on_retry: 决定重试时回调 (第几次失败, 异常, 等待秒数)
+        attempts: 传入列表时逐次追加尝试记录（attempt、ok、kind、duration_ms、error、wait）
+        format_error: 放弃时把原始异常转换为给用户看的错误信息
+        label: 日志中的调用描述
+
+    Returns:
+        func 的返回值
+
+    Raises:
+        最后一次失败的异常（提供 format_error 时为转换后的 ProviderError）
+    """
+    policy = policy or RetryPolicy()
+    started = time.monotonic()
+
+    for attempt in range(1, policy.max_attempts + 1):
+        attempt_started = time.monotonic()
+        try:
+            result = func()
+        except Exception as e:
+            duration = time.monotonic() - attempt_started
+            kind = classify_error(e)
+            retryable = is_retryable(e)
+            wait = policy.backoff(attempt, e)
+            elapsed = time.monotonic() - started
+
+            give_up = (
+                not retryable
+                or attempt >= policy.max_attempts
+                or elapsed + wait > policy.max_elapsed
+            )
+
+            if attempts is not None:
+                attempts.append({
+                    "attempt": attempt,
+                    "ok": False,
+                    "kind": kind,
+                    "duration_ms": int(duration * 1000),
+                    "error": str(e)[:200],
+                    "wait": None if give_up else round(wait, 1)
+                })
+
+            if give_up:
+                if not retryable:
+                    logger.warning(f"❌ {label}失败（{kind}，不重试）: {str(e)[:200]}")
+                else:
+                    logger.warning(f"❌ {label}失败，重试预算已用尽 (尝试 {attempt}/{policy.max_attempts}, 耗时 {elapsed:.0f}s)")
+                # ProviderError 的信息已经是给用户看的，不再转换
+                if format_error is not None and not isinstance(e, ProviderError):
+                    raise to_provider_error(e, format_error(e)) from e
+                raise
+
+            logger.warning(
+                f"⚠️ {label}失败（{kind}），{wait:.1f}秒后重试 (尝试 {attempt + 1}/{policy.max_attempts}): {str(e)[:100]}"
+            )
+            if on_retry:
+                on_retry(attempt, e, wait)
+            time.sleep(wait)
+            continue
+
+        if attempts is not None:
+            attempts.append({
+                "attempt": attempt,
+                "ok": True,
+                "duration_ms": int((time.monotonic() - attempt_started) * 1000)
+            })
+        return result
+
+
+def with_retry(
+    policy: Optional[RetryPolicy] = None,
+    format_error: Optional[Callable[[Exception], str]] = None
+):
+    """
+    重试装饰器（retry_call 的装饰器形式）
+
+    Args:
+        policy: 重试策略
+        format_error: 放弃时把原始异常转换为给用户看的错误信息
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return retry_call(
+                lambda: func(*args, **kwargs),
+                policy=policy,
+                format_error=format_error,
+                label=func.__qualname__
+            )
+        return wrapper
+    return decorator
@@ -0,0 +1,113 @@
+"""
+服务和客户端注册表
+
+大纲、文案、大纲修改服务原来每个请求都新建实例：重新解析 text_providers.yaml、重新读取提示词模板、
+重新创建 genai.Client / TextChatClient。这里按"配置指纹"缓存已构建的实例：
+- 指纹由当前生效的服务商配置（active_provider 及其配置项）的哈希和提示词模板的修改时间组成
+- 配置文件由 Config.current() 按修改时间监视，文件没变时不重新解析
+- 指纹变化（在设置页保存、手动编辑配置或模板）后的下一个请求自动重建，改动立即生效
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+TEXT_CONFIG_PATH = Path(__file__).parent.parent.parent / 'text_providers.yaml'
+PROMPTS_DIR = Path(__file__).parent.parent / 'prompts'
+
+
+def file_stamp(path: Path) -> Tuple[str, Optional[int], Optional[int]]:
+    """文件的 (路径, 修改时间, 大小)，文件不存在时后两项为 None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return str(path), None, None
+    return str(path), stat.st_mtime_ns, stat.st_size
+
+
+def config_fingerprint(*parts: Any) -> str:
+    """配置内容的哈希（字典按键排序，保证相同配置得到相同指纹）"""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def text_service_fingerprint(template_names: Iterable[str] = ()) -> str:
+    """
+    文本类服务的配置指纹：当前文本服务商配置 + 提示词模板的修改时间
+
+    Args:
+        template_names: 服务使用的提示词模板文件名（位于 backend/prompts）
+    """
+    from backend.config import Config
+    try:
+        config = Config.current().text
+    except ValueError:
+        # 格式错误时按文件本身计算指纹，由服务构建时报告具体错误
+        config = {"_invalid": file_stamp(TEXT_CONFIG_PATH)}
+
+    config = config or {}
+    active = config.get('active_provider')
+    provider = (config.get('providers') or {}).get(active)
+    templates = [file_stamp(PROMPTS_DIR / name) for name in template_names]
+    return config_fingerprint(active, provider, templates)
+
+
+class ServiceRegistry:
+    """按配置指纹缓存服务 / 客户端实例"""
+
+    def __init__(self):
+        # 名称 -> (指纹, 实例)
+        self._entries: Dict[str, Tuple[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get_or_create(self, name: str, fingerprint: str, factory: Callable[[], T]) -> T:
+        """
+        获取缓存的实例，指纹变化或尚未创建时调用 factory 构建
+
+        构建失败（如配置缺少 API Key）时不缓存，下次请求重新构建。
+
+        Args:
+            name: 实例名称
+            fingerprint: 当前配置指纹
+            factory: 构建函数
+
+        Returns:
+            实例
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry[0] == fingerprint:
+                return entry[1]
+
+        instance = factory()
+
+        with self._lock:
+            rebuilt = name in self._entries
+            self._entries[name] = (fingerprint, instance)
+        if rebuilt:
+            logger.info(f"配置已变化，已重建: {name}")
+        return instance
+
+    def invalidate(self, name: Optional[str] = None):
+        """清除缓存的实例（name 为 None 时全部清除）"""
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
+
+
+# 全局注册表
+_registry = ServiceRegistry()
+
+
+def get_service_registry() -> ServiceRegistry:
+    """获取全局服务注册表"""
+    return _registry
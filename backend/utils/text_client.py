@@ -1,47 +1,27 @@
 """Text API 客户端封装"""
-import time
-import random
 import base64
 import json
-import requests
-from functools import wraps
-from typing import List, Optional, Union, Generator
-from .image_compressor import compress_image
-
-
-def retry_on_429(max_retries=3, base_delay=2):
-    """429 错误自动重试装饰器"""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    error_str = str(e)
-                    if "429" in error_str or "rate" in error_str.lower():
-                        if attempt < max_retries - 1:
-                            wait_time = (base_delay ** attempt) + random.uniform(0, 1)
-                            print(f"[重试] 遇到限流，{wait_time:.1f}秒后重试 (尝试 {attempt + 2}/{max_retries})")
-                            time.sleep(wait_time)
-                            continue
-                    raise
-            raise Exception(
-                f"Text API 重试 {max_retries} 次后仍失败。\n"
-                "可能原因：\n"
-                "1. API持续限流或配额不足\n"
-                "2. 网络连接持续不稳定\n"
-                "3. API服务暂时不可用\n"
-                "建议：稍后再试，或联系API服务提供商"
-            )
-        return wrapper
-    return decorator
+from typing import List, Optional, Tuple, Union, Generator
+from .image_processor import get_image_processor
+from .circuit_breaker import CircuitBreaker, get_circuit_breaker, guarded_by_breaker
+from .http_client import get_http_client, http_timeout
+from .key_pool import ApiKeyPool, get_key_pool, provider_api_keys, with_api_key
+from .retry import RetryPolicy, http_error, with_retry
+from .service_registry import config_fingerprint, get_service_registry
 
 
 class TextChatClient:
     """Text API 客户端封装类"""
 
-    def __init__(self, api_key: str = None, base_url: str = None, endpoint_type: str = None):
+    def __init__(
+        self,
+        api_key: str = None,
+        base_url: str = None,
+        endpoint_type: str = None,
+        breaker: Optional[CircuitBreaker] = None,
+        key_pool: Optional[ApiKeyPool] = None,
+        timeout: Optional[Tuple[float, float]] = None
+    ):
         self.api_key = api_key
         if not self.api_key:
             raise ValueError(
@@ -58,6 +38,16 @@ class TextChatClient:
             endpoint = '/' + endpoint
         self.chat_endpoint = f"{self.base_url}{endpoint}"
 
+        # 共享连接池（长连接）；超时为 (连接, 读取)，默认读取超时 5 分钟
+        self.http = get_http_client()
+        self.timeout = timeout or http_timeout(None, 300)
+
+        # 服务商熔断器（服务商不可用时快速失败）
+        self.breaker = breaker or get_circuit_breaker("text", "openai_compatible")
+
+        # API Key 池（配置多个 Key 时每次请求轮换 Key，未配置时始终使用 api_key）
+        self.key_pool = key_pool
+
     def _encode_image_to_base64(self, image_data: bytes) -> str:
         """将图片数据编码为 base64"""
         return base64.b64encode(image_data).decode('utf-8')
@@ -85,7 +75,7 @@ class TextChatClient:
         for img in images:
             if isinstance(img, bytes):
                 # 压缩图片到 200KB 以内
-                compressed_img = compress_image(img, max_size_kb=200)
+                compressed_img = get_image_processor().compress(img, max_size_kb=200)
                 # 图片数据，转为 base64 data URL
                 base64_data = self._encode_image_to_base64(compressed_img)
                 image_url = f"data:image/png;base64,{base64_data}"
@@ -100,7 +90,9 @@ class TextChatClient:
 
         return content
 
-    @retry_on_429(max_retries=3, base_delay=2)
+    @with_retry(RetryPolicy(max_attempts=3))
+    @guarded_by_breaker
+    @with_api_key
     def generate_text(
         self,
         prompt: str,
@@ -110,6 +102,7 @@ class TextChatClient:
         images: List[Union[bytes, str]] = None,
         system_prompt: str = None,
         stream: bool = False,
+        api_key: Optional[str] = None,
         **kwargs
     ) -> Union[str, Generator[str, None, None]]:
         """
@@ -122,6 +115,7 @@ class TextChatClient:
             max_output_tokens: 最大输出 token
             images: 图片列表（可选）
             system_prompt: 系统提示词（可选）
+            api_key: 本次请求使用的 Key（由 Key 池分配，默认使用 api_key）
 
         Returns:
             生成的文本
@@ -153,24 +147,24 @@ class TextChatClient:
         headers = {
             "Content-Type": "application/json",
             "Accept": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
+            "Authorization": f"Bearer {api_key or self.api_key}"
         }
 
         # 如果不是流式模式，使用原有逻辑
         if not stream:
-            response = requests.post(
+            response = self.http.post(
                 self.chat_endpoint,
                 json=payload,
                 headers=headers,
-                timeout=300  # 5分钟超时
+                timeout=self.timeout
             )
         else:
             # 流式模式
-            response = requests.post(
+            response = self.http.post(
                 self.chat_endpoint,
                 json=payload,
                 headers=headers,
-                timeout=300,
+                timeout=self.timeout,
                 stream=True  # 启用流式接收
             )
 
@@ -180,7 +174,8 @@ class TextChatClient:
 
             # 根据状态码给出更详细的错误信息
             if status_code == 401:
-                raise Exception(
+                raise http_error(
+                    response,
                     "❌ API Key 认证失败\n\n"
                     "【可能原因】\n"
                     "1. API Key 无效或已过期\n"
@@ -192,7 +187,8 @@ class TextChatClient:
                     f"\n【请求地址】{self.chat_endpoint}"
                 )
             elif status_code == 403:
-                raise Exception(
+                raise http_error(
+                    response,
                     "❌ 权限被拒绝\n\n"
                     "【可能原因】\n"
                     "1. API Key 没有访问该模型的权限\n"
@@ -204,7 +200,8 @@ class TextChatClient:
                     f"\n【原始错误】{error_detail[:200]}"
                 )
             elif status_code == 404:
-                raise Exception(
+                raise http_error(
+                    response,
                     "❌ 模型不存在或 API 端点错误\n\n"
                     "【可能原因】\n"
                     f"1. 模型 '{model}' 不存在或已下线\n"
@@ -215,7 +212,8 @@ class TextChatClient:
                     f"\n【请求地址】{self.chat_endpoint}"
                 )
             elif status_code == 429:
-                raise Exception(
+                raise http_error(
+                    response,
                     "⏳ API 配额或速率限制\n\n"
                     "【说明】\n"
                     "请求频率过高或配额已用尽。\n\n"
@@ -225,7 +223,8 @@ class TextChatClient:
                     "3. 考虑升级计划获取更多配额"
                 )
             elif status_code >= 500:
-                raise Exception(
+                raise http_error(
+                    response,
                     f"⚠️ API 服务器错误 ({status_code})\n\n"
                     "【说明】\n"
                     "这是服务端的临时故障，与您的配置无关。\n\n"
@@ -234,7 +233,8 @@ class TextChatClient:
                     "2. 如果持续出现，检查服务商状态页"
                 )
             else:
-                raise Exception(
+                raise http_error(
+                    response,
                     f"❌ API 请求失败 (状态码: {status_code})\n\n"
                     f"【原始错误】\n{error_detail}\n\n"
                     f"【请求地址】{self.chat_endpoint}\n"
@@ -286,27 +286,51 @@ class TextChatClient:
                 )
 
 
-def get_text_chat_client(provider_config: dict):
+def get_text_chat_client(provider_config: dict, provider_name: str = None):
     """
     获取 Text Chat 客户端实例（根据 type 返回对应客户端）
 
+    同一服务商配置不变时复用已创建的客户端（按配置指纹缓存），配置变化后自动重建
+
     Args:
         provider_config: 服务商配置字典
             - type: 'google_gemini' 或 'openai_compatible'
-            - api_key: API密钥
+            - api_key: API密钥（多个 Key 可写成列表或使用 api_keys）
             - base_url: API基础URL（可选）
             - endpoint_type: 自定义端点路径（可选）
+            - connect_timeout / read_timeout: 连接 / 读取超时（可选，秒）
+        provider_name: 服务商名称（熔断器按服务商区分，默认使用 type）
 
     Returns:
         GenAIClient 或 TextChatClient
     """
+    name = provider_name or provider_config.get('type', 'openai_compatible')
+    return get_service_registry().get_or_create(
+        f"text_client:{name}",
+        config_fingerprint(provider_config),
+        lambda: _create_text_chat_client(provider_config, name)
+    )
+
+
+def _create_text_chat_client(provider_config: dict, provider_name: str):
+    """创建 Text Chat 客户端实例"""
     provider_type = provider_config.get('type', 'openai_compatible')
-    api_key = provider_config.get('api_key')
+    keys = provider_api_keys(provider_config)
+    api_key = keys[0] if keys else None
     base_url = provider_config.get('base_url')
     endpoint_type = provider_config.get('endpoint_type')
+    breaker = get_circuit_breaker("text", provider_name, provider_config)
+    key_pool = get_key_pool("text", provider_name, provider_config)
 
     if provider_type == 'google_gemini':
         from .genai_client import GenAIClient
-        return GenAIClient(api_key=api_key, base_url=base_url)
+        return GenAIClient(api_key=api_key, base_url=base_url, breaker=breaker, key_pool=key_pool)
     else:
-        return TextChatClient(api_key=api_key, base_url=base_url, endpoint_type=endpoint_type)
+        return TextChatClient(
+            api_key=api_key,
+            base_url=base_url,
+            endpoint_type=endpoint_type,
+            breaker=breaker,
+            key_pool=key_pool,
+            timeout=http_timeout(provider_config, 300)
+        )
@@ -19,6 +19,15 @@ export interface OutlineResponse {
   error?: string
 }
 
+// 大纲修改补丁（page / after 为修改前的页码，从 1 开始）
+export interface OutlinePatch {
+  op: 'replace' | 'insert' | 'delete'
+  page?: number
+  after?: number
+  content?: string
+  type?: 'cover' | 'content' | 'summary' | null
+}
+
 export interface ProgressEvent {
   index: number
   status: 'generating' | 'done' | 'error'
@@ -66,6 +75,52 @@ export async function generateOutline(
   return response.data
 }
 
+// ==================== 流式文本协议 v2 ====================
+// 流式文本接口带上 protocol=2 后，服务端只发送增量文本（delta 事件），
+// 并定期发送校验点（checkpoint 事件：已发送的字符数和 UTF-8 CRC32），不再每块都发送完整文本
+const STREAM_PROTOCOL_QUERY = 'protocol=2'
+
+const CRC32_TABLE = (() => {
+  const table = new Uint32Array(256)
+  for (let i = 0; i < 256; i++) {
+    let c = i
+    for (let k = 0; k < 8; k++) {
+      c = c & 1 ? 0xedb88320 ^ (c >>> 1) : c >>> 1
+    }
+    table[i] = c >>> 0
+  }
+  return table
+})()
+
+// 拼接增量文本并与服务端校验点比对
+class StreamTextAssembler {
+  text = ''
+  private crc = 0xffffffff
+  private length = 0
+  private encoder = new TextEncoder()
+
+  append(delta: string): string {
+    this.text += delta
+    // 服务端按 Python 字符（码点）计数
+    this.length += Array.from(delta).length
+    const bytes = this.encoder.encode(delta)
+    for (let i = 0; i < bytes.length; i++) {
+      this.crc = CRC32_TABLE[(this.crc ^ bytes[i]) & 0xff] ^ (this.crc >>> 8)
+    }
+    return this.text
+  }
+
+  verify(checkpoint: { length: number; crc32: number }): boolean {
+    const crc = (this.crc ^ 0xffffffff) >>> 0
+    if (checkpoint.length === this.length && checkpoint.crc32 === crc) {
+      return true
+    }
+    // 校验失败时继续显示，最终以 complete 事件中的完整文本为准
+    console.warn('流式文本校验失败:', { expected: checkpoint, actual: { length: this.length, crc32: crc } })
+    return false
+  }
+}
+
 // 流式生成大纲（SSE）
 export async function generateOutlineStream(
   topic: string,
@@ -81,7 +136,8 @@ export async function generateOutlineStream(
     search_results?: any[]
   }) => void,
   onError?: (error: string) => void,
-  onStreamError?: (error: Error) => void
+  onStreamError?: (error: Error) => void,
+  onPage?: (page: Page) => void  // 页面闭合时立即回调（无需等待生成结束）
 ): Promise<void> {
   try {
     // 准备请求数据
@@ -102,7 +158,7 @@ export async function generateOutlineStream(
       })
     }
 
-    const response = await fetch(`${API_BASE_URL}/outline/stream`, {
+    const response = await fetch(`${API_BASE_URL}/outline/stream?${STREAM_PROTOCOL_QUERY}`, {
       method: 'POST',
       headers: images ? undefined : { 'Content-Type': 'application/json' },
       body
@@ -118,6 +174,7 @@ export async function generateOutlineStream(
     }
 
     const decoder = new TextDecoder()
+    const assembler = new StreamTextAssembler()
     let buffer = ''
 
     // SSE 解析逻辑
@@ -158,6 +215,22 @@ export async function generateOutlineStream(
                 onText(data.chunk, data.accumulated)
               }
               break
+            case 'delta': {
+              // v2：只携带新增文本
+              const accumulated = assembler.append(data.delta)
+              if (onText) {
+                onText(data.delta, accumulated)
+              }
+              break
+            }
+            case 'checkpoint':
+              assembler.verify(data)
+              break
+            case 'page':
+              if (onPage) {
+                onPage(data)
+              }
+              break
             case 'complete':
               if (onComplete) {
                 onComplete({
@@ -203,7 +276,7 @@ export async function generateCopywritingStream(
   onStreamError?: (error: Error) => void
 ): Promise<void> {
   try {
-    const response = await fetch(`${API_BASE_URL}/copywriting/stream`, {
+    const response = await fetch(`${API_BASE_URL}/copywriting/stream?${STREAM_PROTOCOL_QUERY}`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -221,6 +294,7 @@ export async function generateCopywritingStream(
     }
 
     const decoder = new TextDecoder()
+    const assembler = new StreamTextAssembler()
     let buffer = ''
 
     while (true) {
@@ -249,6 +323,17 @@ export async function generateCopywritingStream(
                 onText(data.chunk, data.accumulated)
               }
               break
+            case 'delta': {
+              // v2：只携带新增文本
+              const accumulated = assembler.append(data.delta)
+              if (onText) {
+                onText(data.delta, accumulated)
+              }
+              break
+            }
+            case 'checkpoint':
+              assembler.verify(data)
+              break
             case 'complete':
               if (onComplete) {
                 onComplete({
@@ -508,6 +593,64 @@ export async function getHistoryStats(): Promise<{
   return response.data
 }
 
+// 读取图片生成的 SSE 事件流（/generate 与 /tasks/<task_id>/events 格式相同）
+async function readImageEvents(
+  response: Response,
+  onProgress: (event: ProgressEvent) => void,
+  onComplete: (event: ProgressEvent) => void,
+  onError: (event: ProgressEvent) => void,
+  onFinish: (event: FinishEvent) => void
+) {
+  const reader = response.body?.getReader()
+  if (!reader) {
+    throw new Error('无法读取响应流')
+  }
+
+  const decoder = new TextDecoder()
+  let buffer = ''
+
+  while (true) {
+    const { done, value } = await reader.read()
+
+    if (done) break
+
+    buffer += decoder.decode(value, { stream: true })
+    const lines = buffer.split('\n\n')
+    buffer = lines.pop() || ''
+
+    for (const line of lines) {
+      if (!line.trim()) continue
+
+      const [eventLine, dataLine] = line.split('\n')
+      if (!eventLine || !dataLine) continue
+
+      const eventType = eventLine.replace('event: ', '').trim()
+      const eventData = dataLine.replace('data: ', '').trim()
+
+      try {
+        const data = JSON.parse(eventData)
+
+        switch (eventType) {
+          case 'progress':
+            onProgress(data)
+            break
+          case 'complete':
+            onComplete(data)
+            break
+          case 'error':
+            onError(data)
+            break
+          case 'finish':
+            onFinish(data)
+            break
+        }
+      } catch (e) {
+        console.error('解析 SSE 数据失败:', e)
+      }
+    }
+  }
+}
+
 // 使用 POST 方式生成图片（更可靠）
 export async function generateImagesPost(
   pages: Page[],
@@ -537,7 +680,7 @@ export async function generateImagesPost(
       )
     }
 
-    const response = await fetch(`${API_BASE_URL}/generate`, {
+    let response = await fetch(`${API_BASE_URL}/generate`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -551,58 +694,17 @@ export async function generateImagesPost(
       })
     })
 
-    if (!response.ok) {
-      throw new Error(`HTTP error! status: ${response.status}`)
+    // 409：该任务的后台生成仍在进行（例如刷新页面后再次点击生成），改为订阅它的事件流
+    if (response.status === 409 && taskId) {
+      console.log('任务仍在生成中，订阅任务事件:', taskId)
+      response = await fetch(`${API_BASE_URL}/tasks/${encodeURIComponent(taskId)}/events`)
     }
 
-    const reader = response.body?.getReader()
-    if (!reader) {
-      throw new Error('无法读取响应流')
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`)
     }
 
-    const decoder = new TextDecoder()
-    let buffer = ''
-
-    while (true) {
-      const { done, value } = await reader.read()
-
-      if (done) break
-
-      buffer += decoder.decode(value, { stream: true })
-      const lines = buffer.split('\n\n')
-      buffer = lines.pop() || ''
-
-      for (const line of lines) {
-        if (!line.trim()) continue
-
-        const [eventLine, dataLine] = line.split('\n')
-        if (!eventLine || !dataLine) continue
-
-        const eventType = eventLine.replace('event: ', '').trim()
-        const eventData = dataLine.replace('data: ', '').trim()
-
-        try {
-          const data = JSON.parse(eventData)
-
-          switch (eventType) {
-            case 'progress':
-              onProgress(data)
-              break
-            case 'complete':
-              onComplete(data)
-              break
-            case 'error':
-              onError(data)
-              break
-            case 'finish':
-              onFinish(data)
-              break
-          }
-        } catch (e) {
-          console.error('解析 SSE 数据失败:', e)
-        }
-      }
-    }
+    await readImageEvents(response, onProgress, onComplete, onError, onFinish)
   } catch (error) {
     onStreamError(error as Error)
   }
@@ -687,10 +789,13 @@ export async function modifyOutlineStream(
     summary: string
   }) => void,
   onError?: (error: string) => void,
-  onStreamError?: (error: Error) => void
+  onStreamError?: (error: Error) => void,
+  onPage?: (page: Page) => void,  // 页面闭合时立即回调（无需等待生成结束）
+  mode: 'rewrite' | 'patch' = 'rewrite',  // patch：只返回受影响页面的补丁
+  onPatch?: (patch: OutlinePatch) => void
 ): Promise<void> {
   try {
-    const response = await fetch(`${API_BASE_URL}/outline/modify/stream`, {
+    const response = await fetch(`${API_BASE_URL}/outline/modify/stream?${STREAM_PROTOCOL_QUERY}`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -698,7 +803,8 @@ export async function modifyOutlineStream(
       body: JSON.stringify({
         topic,
         current_outline: currentOutline,
-        instruction
+        instruction,
+        mode
       })
     })
 
@@ -712,6 +818,7 @@ export async function modifyOutlineStream(
     }
 
     const decoder = new TextDecoder()
+    const assembler = new StreamTextAssembler()
     let buffer = ''
 
     // SSE 解析逻辑（复用 generateOutlineStream 的逻辑）
@@ -746,6 +853,27 @@ export async function modifyOutlineStream(
                 onText(data.chunk, data.accumulated)
               }
               break
+            case 'delta': {
+              // v2：只携带新增文本
+              const accumulated = assembler.append(data.delta)
+              if (onText) {
+                onText(data.delta, accumulated)
+              }
+              break
+            }
+            case 'checkpoint':
+              assembler.verify(data)
+              break
+            case 'page':
+              if (onPage) {
+                onPage(data)
+              }
+              break
+            case 'patch':
+              if (onPatch) {
+                onPatch(data)
+              }
+              break
             case 'complete':
               if (onComplete) {
                 onComplete({
@@ -21,6 +21,8 @@ export interface Provider {
   endpoint_type?: string
   high_concurrency?: boolean
   short_prompt?: boolean
+  prompt_mode?: string
+  style_reference?: string
 }
 
 // 服务商配置类型
@@ -50,7 +52,8 @@ export interface ImageProviderForm {
   base_url: string
   model: string
   high_concurrency: boolean
-  short_prompt: boolean
+  prompt_mode: string
+  style_reference: string
   endpoint_type: string
   _has_api_key: boolean
 }
@@ -156,7 +159,8 @@ export function useProviderForm() {
       base_url: '',
       model: '',
       high_concurrency: false,
-      short_prompt: false,
+      prompt_mode: 'full',
+      style_reference: 'image',
       endpoint_type: '/v1/images/generations',
       _has_api_key: false
     }
@@ -416,7 +420,9 @@ export function useProviderForm() {
       base_url: provider.base_url || '',
       model: provider.model || '',
       high_concurrency: provider.high_concurrency || false,
-      short_prompt: provider.short_prompt || false,
+      // 兼容旧配置：short_prompt: true 等价于简短模式
+      prompt_mode: provider.prompt_mode || (provider.short_prompt ? 'short' : 'full'),
+      style_reference: provider.style_reference || 'image',
       endpoint_type: provider.endpoint_type || '/v1/images/generations',
       _has_api_key: !!provider.api_key_masked
     }
@@ -459,7 +465,8 @@ export function useProviderForm() {
       type: imageForm.value.type,
       model: imageForm.value.model,
       high_concurrency: imageForm.value.high_concurrency,
-      short_prompt: imageForm.value.short_prompt
+      prompt_mode: imageForm.value.prompt_mode,
+      style_reference: imageForm.value.style_reference
     }
 
     // 如果是 OpenAI 兼容接口，保存 endpoint_type
@@ -285,6 +285,10 @@ export const useGeneratorStore = defineStore('generator', {
       this.outline.raw = ''
       this.outline.pages = []
 
+      // 新主题对应新的任务和历史记录：不能沿用上一个任务，否则会覆盖上一条历史记录的图片
+      this.taskId = null
+      this.recordId = null
+
       // 清除旧的搜索结果
       this.searchResults = []
       this.usedSearch = false